@@ -1,20 +1,77 @@
 # analyzer.py
+import re
+from functools import lru_cache
+
 import textstat
 import numpy as np
 
-def analyze_text_features(text):
-    readability = textstat.flesch_reading_ease(text)
-    sentence_count = textstat.sentence_count(text)
-    word_count = textstat.lexicon_count(text)
+# Column order of the feature arrays returned by analyze_text_features_batch()
+FEATURE_NAMES = ("readability", "sentence_count", "word_count", "avg_sentence_length", "lexical_diversity")
+
+# textstat's sentence pattern: a run up to and including terminal punctuation.
+_SENTENCE = re.compile(r"\b[^.!?]+[.!?]*", re.UNICODE)
+_HAS_WORD_CHAR = re.compile(r"\w")
+
+
+@lru_cache(maxsize=100_000)
+def _syllables(word):
+    return textstat.syllable_count(word)
+
+
+def _word_count(text):
+    return sum(1 for token in text.split() if _HAS_WORD_CHAR.search(token))
+
+
+def _document_features(text):
+    """All heuristic features from one tokenization and one sentence scan of text.
+
+    Same counts and Flesch reading ease as textstat (its sentence regex, with
+    fragments of two words or fewer not counted, and 0 readability for text
+    without words), but syllable counts are memoized per word and the text
+    is not rescanned for every metric.
+    """
+    tokens = text.split()
+    word_count = 0
+    syllables = 0
+    for token in tokens:
+        if _HAS_WORD_CHAR.search(token):
+            word_count += 1
+            syllables += _syllables(token.lower())
+
+    sentence_count = 0
+    if text:
+        sentences = _SENTENCE.findall(text)
+        short = sum(1 for sentence in sentences if _word_count(sentence) <= 2)
+        sentence_count = max(1, len(sentences) - short)
     avg_sentence_length = word_count / max(1, sentence_count)
-    lexical_diversity = len(set(text.split())) / max(1, word_count)
-    return {
-        "readability": readability,
-        "sentence_count": sentence_count,
-        "word_count": word_count,
-        "avg_sentence_length": avg_sentence_length,
-        "lexical_diversity": lexical_diversity
-    }
+    if word_count and syllables:
+        readability = 206.835 - 1.015 * avg_sentence_length - 84.6 * (syllables / word_count)
+    else:
+        readability = 0.0
+    lexical_diversity = len(set(tokens)) / max(1, word_count)
+    return (readability, sentence_count, word_count, avg_sentence_length, lexical_diversity)
+
+
+def analyze_text_features_batch(texts):
+    """Features for many documents as a (len(texts), len(FEATURE_NAMES)) float array."""
+    out = np.empty((len(texts), len(FEATURE_NAMES)), dtype=np.float64)
+    for i, text in enumerate(texts):
+        out[i] = _document_features(text)
+    return out
+
+
+def analyze_text_features(text):
+    return dict(zip(FEATURE_NAMES, (float(v) for v in analyze_text_features_batch([text])[0])))
+
+
+def heuristic_scores(features):
+    """Vectorized heuristic_score over a feature array from analyze_text_features_batch()."""
+    features = np.asarray(features, dtype=np.float64)
+    read_score = 1 - (features[:, 0] / 100)
+    diversity_penalty = 1 - features[:, 4]
+    length_factor = np.minimum(features[:, 3] / 25, 1)
+    return np.clip((read_score + diversity_penalty + length_factor) / 3, 0, 1)
+
 
 def heuristic_score(features):
     read_score = 1 - (features["readability"] / 100)
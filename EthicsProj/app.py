@@ -1,17 +1,27 @@
 # app.py
+import json
 import os
-from flask import Flask, render_template, request, redirect
-from werkzeug.utils import secure_filename
-
-from text_detector import detect_ai_text
-from image_detector import detect_ai_image
-from video_detector import detect_ai_video
+import threading
+from bisect import bisect_left
+from flask import Flask, Response, render_template, request, redirect, jsonify, url_for
+from cache import result_cache, content_key, digest_key, normalized_offsets
+from jobs import job_manager, QueueFull, TERMINAL_EVENTS
+from uploads import UploadRequest, MAX_REQUEST_BYTES, store_upload, start_janitor
+import metrics
+import models
 
 UPLOAD_FOLDER = "static/uploads"
+# Comma-separated models to load at startup, e.g. "roberta,clip,gemini".
+MODEL_WARMUP = os.getenv("MODEL_WARMUP", "")
+# Comment line sent on idle event streams so proxies keep the connection open.
+SSE_KEEPALIVE_SECONDS = float(os.getenv("SSE_KEEPALIVE_SECONDS", "15"))
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 
 app = Flask(__name__)
+app.request_class = UploadRequest
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
+# Bodies declaring a larger Content-Length are rejected with 413 before any parsing.
+app.config['MAX_CONTENT_LENGTH'] = MAX_REQUEST_BYTES
 
 
 @app.route("/")
@@ -19,33 +29,73 @@ def index():
     return render_template("index.html")
 
 
+def enqueue(kind, arg, key, meta):
+    """Start (or reuse from cache) an analysis and return its job."""
+    cached = result_cache.get(key)
+    if cached is not None:
+        return job_manager.complete(kind, cached, meta)
+    return job_manager.submit(kind, arg, meta,
+                              on_done=lambda job: result_cache.put(key, kind, job.result))
+
+
+def busy_response():
+    return ("The server is busy analyzing other submissions. Please try again shortly.",
+            429, {"Retry-After": "10"})
+
+
+def save_upload(field):
+    """Store the uploaded file under its content hash; returns (path, sha256) or (None, None)."""
+    file = request.files.get(field)
+    if not file:
+        return None, None
+    return store_upload(file, app.config["UPLOAD_FOLDER"])
+
+
 # --- TEXT ROUTE ---
 @app.route("/analyze_text", methods=["POST"])
 def analyze_text():
     user_input = request.form["text_input"]
+    try:
+        job = enqueue("text", user_input, content_key("text", user_input), {"text": user_input})
+    except QueueFull:
+        return busy_response()
+    return redirect(url_for("job_view", job_id=job.id), code=303)
+
+
+def chunk_segments(text, chunks):
+    """Split text into consecutive (piece, score) segments, one per scored chunk.
 
+    Windows overlap, so each chunk owns the span up to where the next one starts.
+    Chunk offsets refer to normalize_text(text) and are mapped back onto text.
+    """
+    if not chunks:
+        return []
+    chunks = sorted(chunks, key=lambda c: c["start"])
+    positions = normalized_offsets(text)
+    starts = [0] + [bisect_left(positions, c["start"]) for c in chunks[1:]] + [len(text)]
+    segments = []
+    for i, chunk in enumerate(chunks):
+        start, end = starts[i], starts[i + 1]
+        segments.append({"text": text[start:end], "score": chunk["score"] * 100.0})
+    return segments
+
+
+def render_text_result(user_input, result, error_msg=None):
     # URL or raw text handled by your backend
-    error_msg = None
-    try:
-        result = detect_ai_text(user_input)
-        if isinstance(result, dict):
-            raw_score = result.get('final_score', 0.0)
-            roberta_score = result.get('roberta', 0.0)
-            gemini_score = result.get('gemini', 0.0)
-            heuristic_score_val = result.get('heuristic', 0.0)
-            reasoning_text = result.get('reasoning', '')
-            is_ai_flag = result.get('is_ai', False)
-        else:
-            raw_score = result if result is not None else 0.0
-            roberta_score = gemini_score = heuristic_score_val = 0.0
-            reasoning_text = ''
-            is_ai_flag = False
-    except Exception as e:
-        # Log the traceback to the server console for debugging
-        import traceback
-        traceback.print_exc()
-        error_msg = str(e)
-        raw_score = 0.0
+    if isinstance(result, dict):
+        raw_score = result.get('final_score', 0.0)
+        roberta_score = result.get('roberta', 0.0)
+        gemini_score = result.get('gemini', 0.0)
+        heuristic_score_val = result.get('heuristic', 0.0)
+        reasoning_text = result.get('reasoning', '')
+        is_ai_flag = result.get('is_ai', False)
+        segments = chunk_segments(user_input, result.get('chunks'))
+    else:
+        raw_score = result if result is not None else 0.0
+        roberta_score = gemini_score = heuristic_score_val = 0.0
+        reasoning_text = ''
+        is_ai_flag = False
+        segments = []
 
     # Ensure a numeric percent value between 0 and 100
     try:
@@ -56,7 +106,8 @@ def analyze_text():
 
     # Format component scores for display (percent strings)
     roberta_display = f"{roberta_score*100:.2f}%"
-    gemini_display = f"{gemini_score*100:.2f}%"
+    gemini_display = f"{gemini_score*100:.2f}%" if gemini_score is not None else (
+        "unavailable" if result.get('gemini_unavailable') else "skipped")
     heuristic_display = f"{heuristic_score_val*100:.2f}%"
 
     return render_template("result_text.html",
@@ -68,43 +119,39 @@ def analyze_text():
                            heuristic=heuristic_display,
                            reasoning=reasoning_text,
                            is_ai=is_ai_flag,
+                           segments=segments,
                            error_msg=error_msg)
 
 # --- IMAGE ROUTE ---
 @app.route("/analyze_image", methods=["POST"])
 def analyze_image():
-    file = request.files["image_file"]
-    if not file:
+    filepath, digest = save_upload("image_file")
+    if not filepath:
         return redirect("/")
+    try:
+        job = enqueue("image", filepath, digest_key("image", digest), {"path": filepath})
+    except QueueFull:
+        return busy_response()
+    return redirect(url_for("job_view", job_id=job.id), code=303)
 
-    filename = secure_filename(file.filename)
-    filepath = os.path.join(app.config["UPLOAD_FOLDER"], filename)
-    file.save(filepath)
 
-    try:
-        result = detect_ai_image(filepath)
-        if isinstance(result, dict):
-            final = result.get('final_score', 0.0)
-            clip_score = result.get('clip', 0.0)
-            gemini_score = result.get('gemini', 0.0)
-            reasoning_text = result.get('reasoning', '')
-            is_ai_flag = result.get('is_ai', False)
-        else:
-            final = result if result is not None else 0.0
-            clip_score = gemini_score = 0.0
-            reasoning_text = ''
-            is_ai_flag = False
-    except Exception as e:
-        import traceback
-        traceback.print_exc()
-        final = 0.0
+def render_image_result(filepath, result, error_msg=None):
+    if isinstance(result, dict):
+        final = result.get('final_score', 0.0)
+        clip_score = result.get('clip', 0.0)
+        gemini_score = result.get('gemini', 0.0)
+        reasoning_text = result.get('reasoning', '')
+        is_ai_flag = result.get('is_ai', False)
+    else:
+        final = result if result is not None else 0.0
         clip_score = gemini_score = 0.0
-        reasoning_text = str(e)
+        reasoning_text = error_msg or ''
         is_ai_flag = False
 
     final_percent = max(0.0, min(100.0, float(final) * 100.0))
     clip_display = f"{clip_score*100:.2f}%"
-    gemini_display = f"{gemini_score*100:.2f}%"
+    gemini_display = f"{gemini_score*100:.2f}%" if gemini_score is not None else (
+        "unavailable" if result.get('gemini_unavailable') else "skipped")
 
     return render_template("result_image.html",
                        image_path=filepath,
@@ -120,35 +167,35 @@ def analyze_image():
 # --- VIDEO ROUTE ---
 @app.route("/analyze_video", methods=["POST"])
 def analyze_video():
-    file = request.files["video_file"]
-    if not file:
+    filepath, digest = save_upload("video_file")
+    if not filepath:
         return redirect("/")
+    try:
+        job = enqueue("video", filepath, digest_key("video", digest), {"path": filepath})
+    except QueueFull:
+        return busy_response()
+    return redirect(url_for("job_view", job_id=job.id), code=303)
 
-    filename = secure_filename(file.filename)
-    filepath = os.path.join(app.config["UPLOAD_FOLDER"], filename)
-    file.save(filepath)
 
-    try:
-        result = detect_ai_video(filepath)
-        if isinstance(result, dict):
-            avg = result.get('avg', 0.0)
-            gemini_frame = result.get('gemini_frame', 0.0)
-            reasoning_text = result.get('reasoning', '')
-            is_ai_flag = result.get('is_ai', False)
-        else:
-            # legacy tuple support
-            try:
-                avg, gemini_frame, reasoning_text = result
-            except Exception:
-                avg = gemini_frame = 0.0
-                reasoning_text = ''
-            is_ai_flag = avg > 0.5
-    except Exception as e:
-        import traceback
-        traceback.print_exc()
-        avg = gemini_frame = 0.0
-        reasoning_text = str(e)
-        is_ai_flag = False
+def render_video_result(filepath, result, error_msg=None):
+    temporal = None
+    if isinstance(result, dict):
+        avg = result.get('final_score', result.get('avg', 0.0))
+        gemini_frame = result.get('gemini_frame', 0.0)
+        temporal = result.get('temporal')
+        frame_avg = result.get('avg', avg)
+        reasoning_text = result.get('reasoning', '')
+        is_ai_flag = result.get('is_ai', False)
+    else:
+        # legacy tuple support
+        try:
+            avg, gemini_frame, reasoning_text = result
+        except Exception:
+            avg = gemini_frame = 0.0
+            reasoning_text = error_msg or ''
+        is_ai_flag = avg > 0.5
+        frame_avg = avg
+    frame_details = result.get('frame_details', []) if isinstance(result, dict) else []
 
     avg_percent = max(0.0, min(100.0, float(avg) * 100.0))
 
@@ -157,8 +204,171 @@ def analyze_video():
                        avg_score=f"{avg_percent:.2f}%",
                        avg_num=avg_percent,
                        gemini_frame=f"{gemini_frame*100:.2f}%",
+                       frame_avg=f"{frame_avg*100:.2f}%",
+                       temporal=None if temporal is None else f"{temporal*100:.2f}%",
                        reasoning=reasoning_text,
-                       is_ai=is_ai_flag)
+                       is_ai=is_ai_flag,
+                       frame_details=frame_details,
+                       error=error_msg,
+                       live=False)
+
+
+# --- TEXT BATCH API ---
+MAX_TEXT_BATCH = int(os.getenv("MAX_TEXT_BATCH", "64"))
+
+
+@app.route("/api/analyze_text_batch", methods=["POST"])
+def analyze_text_batch():
+    """Score a JSON list of texts ({"texts": [...]}) in one request."""
+    from text_detector import detect_ai_texts
+
+    data = request.get_json(silent=True) or {}
+    texts = data.get("texts")
+    if not isinstance(texts, list) or not all(isinstance(t, str) for t in texts):
+        return jsonify({"error": "expected {\"texts\": [string, ...]}"}), 400
+    if len(texts) > MAX_TEXT_BATCH:
+        return jsonify({"error": f"at most {MAX_TEXT_BATCH} texts per request"}), 413
+
+    keys = [content_key("text", t) for t in texts]
+    results = [result_cache.get(k) for k in keys]
+    missing = [i for i, r in enumerate(results) if r is None]
+    if missing:
+        fresh = detect_ai_texts([texts[i] for i in missing])
+        for i, res in zip(missing, fresh):
+            result_cache.put(keys[i], "text", res)
+            results[i] = res
+    return jsonify({"results": results})
+
+
+# --- JOBS ---
+@app.route("/api/jobs/<kind>", methods=["POST"])
+def create_job(kind):
+    """JSON entry point: submit text (form/JSON field "text") or a file upload ("file")."""
+    if kind == "text":
+        data = request.get_json(silent=True) or request.form
+        text = data.get("text")
+        if not text:
+            return jsonify({"error": "missing text"}), 400
+        arg, key, meta = text, content_key("text", text), {"text": text}
+    elif kind in ("image", "video"):
+        filepath, digest = save_upload("file")
+        if not filepath:
+            return jsonify({"error": "missing file"}), 400
+        arg, key, meta = filepath, digest_key(kind, digest), {"path": filepath}
+    else:
+        return jsonify({"error": f"unknown kind {kind}"}), 404
+    try:
+        job = enqueue(kind, arg, key, meta)
+    except QueueFull:
+        return jsonify({"error": "queue full"}), 429, {"Retry-After": "10"}
+    return jsonify({"job_id": job.id, "status": job.current_status(),
+                    "status_url": url_for("job_status", job_id=job.id)}), 202
+
+
+@app.route("/jobs/<job_id>")
+def job_status(job_id):
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({"error": "unknown job"}), 404
+    return jsonify(job.to_dict())
+
+
+@app.route("/jobs/<job_id>/view")
+def job_view(job_id):
+    """HTML result page for a job; shows a self-refreshing wait page until it finishes.
+
+    Unfinished video jobs get the live result page, fed by /jobs/<id>/events,
+    when they run in this process (JOB_POOL=thread); process pools send no events.
+    """
+    job = job_manager.get(job_id)
+    if job is None:
+        return redirect("/")
+    if job.kind == "video" and job.status == "cancelled":
+        return render_video_result(job.meta.get("path"), None, "Analysis cancelled.")
+    if job.kind == "video" and job.status not in TERMINAL_EVENTS and job_manager.live_events:
+        return render_template("result_video.html", live=True, job_id=job.id,
+                               video_path=job.meta.get("path"))
+    if job.status not in TERMINAL_EVENTS:
+        return render_template("job_pending.html", job_id=job.id, kind=job.kind,
+                               status=job.current_status())
+    if job.kind == "text":
+        return render_text_result(job.meta.get("text", ""), job.result, job.error)
+    if job.kind == "image":
+        return render_image_result(job.meta.get("path"), job.result, job.error)
+    return render_video_result(job.meta.get("path"), job.result, job.error)
+
+
+@app.route("/jobs/<job_id>/events")
+def job_events(job_id):
+    """Server-sent events for a job: "frame" and "progress" updates, then done/failed/cancelled.
+
+    Event ids are positions in the job's event list, so a reconnecting
+    EventSource resumes after Last-Event-ID.
+    """
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({"error": "unknown job"}), 404
+    last_id = request.headers.get("Last-Event-ID", type=int)
+    start = last_id + 1 if last_id is not None else 0
+
+    def stream():
+        index = start
+        while True:
+            events = job.events_since(index, SSE_KEEPALIVE_SECONDS)
+            if not events:
+                yield ": keepalive\n\n"
+                continue
+            for event, data in events:
+                payload = json.dumps(data, default=float)
+                yield f"id: {index}\nevent: {event}\ndata: {payload}\n\n"
+                index += 1
+                if event in TERMINAL_EVENTS:
+                    return
+
+    return Response(stream(), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+@app.route("/jobs/<job_id>/cancel", methods=["POST"])
+def cancel_job(job_id):
+    """Stop a queued or running job; a running video stops after its current frames."""
+    job = job_manager.cancel(job_id)
+    if job is None:
+        return jsonify({"error": "unknown job"}), 404
+    return jsonify(job.to_dict())
+
+
+# --- MODEL REGISTRY ---
+@app.route("/models")
+def model_stats():
+    return jsonify(models.stats())
+
+
+@app.route("/gemini")
+def gemini_stats():
+    """Circuit breaker state and the current Gemini deadline, budget and rate limit."""
+    import gemini
+    return jsonify(gemini.stats())
+
+
+# --- METRICS ---
+@app.route("/metrics")
+def prometheus_metrics():
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+
+# --- CACHE STATS ---
+@app.route("/cache/stats")
+def cache_stats():
+    from phash import near_duplicates
+    return jsonify({**result_cache.snapshot(), "near_duplicates": near_duplicates.stats()})
+
+
+start_janitor(UPLOAD_FOLDER)
+
+if MODEL_WARMUP:
+    threading.Thread(target=models.warmup, args=(MODEL_WARMUP.split(","),),
+                     name="model-warmup", daemon=True).start()
 
 
 if __name__ == "__main__":
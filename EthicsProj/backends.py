@@ -0,0 +1,275 @@
+# backends.py
+"""CPU inference backends for RoBERTa and the CLIP vision tower.
+
+INFERENCE_BACKEND picks how the registry prepares the models:
+
+  torch  - eager fp32 PyTorch (reference)
+  int8   - dynamic int8 quantization of the Linear layers
+  onnx   - graphs exported once to ONNX_DIR and run with ONNX Runtime. The
+           file name carries a tag of the model revision, its weights and the
+           exporter versions, so a changed model is exported again instead of
+           reusing a stale graph.
+
+The wrapped models keep the call signatures the detectors already use
+(`model(**inputs).logits`, `clip_model.get_image_features(**inputs)`), so the
+detectors do not know which backend is active.
+
+Run `python backends.py` to compare each backend's scores against fp32 on the
+sample media and report throughput.
+"""
+import argparse
+import hashlib
+import os
+import time
+from types import SimpleNamespace
+
+import torch
+
+INFERENCE_BACKEND = os.getenv("INFERENCE_BACKEND", "torch")
+ONNX_DIR = os.getenv("ONNX_DIR", "onnx_models")
+BACKENDS = ("torch", "int8", "onnx")
+# Bump when _export_roberta or _export_clip_vision change what they write.
+ONNX_EXPORT_VERSION = 1
+
+
+def _onnx_session(path):
+    try:
+        import onnxruntime as ort
+    except ImportError:
+        raise RuntimeError("INFERENCE_BACKEND=onnx needs the onnxruntime package") from None
+    opts = ort.SessionOptions()
+    opts.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    return ort.InferenceSession(path, opts, providers=["CPUExecutionProvider"])
+
+
+class OnnxSequenceClassifier:
+    """Callable stand-in for the RoBERTa classifier backed by an ONNX session."""
+
+    def __init__(self, session, config):
+        self.session = session
+        self.config = config
+
+    def eval(self):
+        return self
+
+    def __call__(self, input_ids, attention_mask=None, **_):
+        if attention_mask is None:
+            attention_mask = torch.ones_like(input_ids)
+        (logits,) = self.session.run(["logits"], {
+            "input_ids": input_ids.numpy(),
+            "attention_mask": attention_mask.numpy(),
+        })
+        return SimpleNamespace(logits=torch.from_numpy(logits))
+
+
+class _ClipImageFeatures(torch.nn.Module):
+    def __init__(self, clip_model):
+        super().__init__()
+        self.clip_model = clip_model
+
+    def forward(self, pixel_values):
+        return self.clip_model.get_image_features(pixel_values=pixel_values)
+
+
+class OnnxClipModel:
+    """CLIP with the vision tower replaced by an ONNX session; everything else delegates."""
+
+    def __init__(self, clip_model, session):
+        self._clip_model = clip_model
+        self.session = session
+
+    def __getattr__(self, name):
+        return getattr(self._clip_model, name)
+
+    def get_image_features(self, pixel_values, **_):
+        (features,) = self.session.run(["image_embeds"], {"pixel_values": pixel_values.numpy()})
+        return torch.from_numpy(features)
+
+
+def _export_roberta(model, path):
+    dummy = torch.ones((1, 16), dtype=torch.long)
+    torch.onnx.export(
+        model, (dummy, dummy), path,
+        input_names=["input_ids", "attention_mask"], output_names=["logits"],
+        dynamic_axes={"input_ids": {0: "batch", 1: "seq"},
+                      "attention_mask": {0: "batch", 1: "seq"},
+                      "logits": {0: "batch"}},
+        opset_version=17,
+    )
+
+
+def _export_clip_vision(clip_model, path):
+    size = clip_model.config.vision_config.image_size
+    dummy = torch.zeros((1, 3, size, size))
+    torch.onnx.export(
+        _ClipImageFeatures(clip_model), (dummy,), path,
+        input_names=["pixel_values"], output_names=["image_embeds"],
+        dynamic_axes={"pixel_values": {0: "batch"}, "image_embeds": {0: "batch"}},
+        opset_version=17,
+    )
+
+
+def _model_tag(model):
+    """Short hash of the model's revision, a sample of its weights and the exporter versions."""
+    import transformers
+    config = model.config
+    h = hashlib.sha256()
+    for part in (getattr(config, "_name_or_path", ""), getattr(config, "_commit_hash", None) or "",
+                 transformers.__version__, torch.__version__, str(ONNX_EXPORT_VERSION)):
+        h.update(str(part).encode("utf-8") + b"\0")
+    # First and last parameter tensors catch a fine-tuned checkpoint saved under the same name.
+    params = list(model.parameters())
+    for param in (params[0], params[-1]):
+        h.update(param.detach().cpu().numpy().tobytes())
+    return h.hexdigest()[:12]
+
+
+def _onnx_path(name, export, model):
+    os.makedirs(ONNX_DIR, exist_ok=True)
+    path = os.path.join(ONNX_DIR, f"{name}-{_model_tag(model)}.onnx")
+    if not os.path.exists(path):
+        print(f"[backends] Exporting {name} to {path}...")
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with torch.no_grad():
+            export(model, tmp)
+        os.replace(tmp, path)
+    return path
+
+
+def prepare_roberta(model, backend=None):
+    """Return the RoBERTa classifier adapted to the chosen backend."""
+    backend = backend or INFERENCE_BACKEND
+    if backend == "int8":
+        return torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+    if backend == "onnx":
+        path = _onnx_path("roberta-base-openai-detector", _export_roberta, model)
+        return OnnxSequenceClassifier(_onnx_session(path), model.config)
+    if backend != "torch":
+        raise ValueError(f"Unknown INFERENCE_BACKEND {backend!r}; expected one of {BACKENDS}")
+    return model
+
+
+def prepare_clip(clip_model, backend=None):
+    """Return CLIP with its vision tower adapted to the chosen backend.
+
+    The text tower stays fp32: it only runs once, to embed the prompt set.
+    """
+    backend = backend or INFERENCE_BACKEND
+    if backend == "int8":
+        # quantize_dynamic only swaps children of the module it is given, and
+        # visual_projection is itself a Linear, so both go in through a container.
+        towers = torch.quantization.quantize_dynamic(
+            torch.nn.ModuleDict({"vision_model": clip_model.vision_model,
+                                 "visual_projection": clip_model.visual_projection}),
+            {torch.nn.Linear}, dtype=torch.qint8)
+        clip_model.vision_model = towers["vision_model"]
+        clip_model.visual_projection = towers["visual_projection"]
+        return clip_model
+    if backend == "onnx":
+        path = _onnx_path("clip-vit-base-patch32-vision", _export_clip_vision, clip_model)
+        return OnnxClipModel(clip_model, _onnx_session(path))
+    if backend != "torch":
+        raise ValueError(f"Unknown INFERENCE_BACKEND {backend!r}; expected one of {BACKENDS}")
+    return clip_model
+
+
+SAMPLE_TEXTS = [
+    "The quick brown fox jumps over the lazy dog while the farmer watches from the porch.",
+    "In conclusion, it is important to note that technology plays a crucial role in modern society, "
+    "offering numerous benefits while also presenting various challenges that must be addressed.",
+    "honestly i didnt think the game would go to overtime but here we are, pizza's cold and everyone's yelling",
+    "Artificial intelligence has transformed numerous industries, enabling unprecedented efficiency "
+    "and innovation across healthcare, finance, and education.",
+]
+
+
+def _sample_images(folder="static/uploads"):
+    from PIL import Image
+    images = []
+    if os.path.isdir(folder):
+        for name in sorted(os.listdir(folder)):
+            if name.lower().endswith((".jpg", ".jpeg", ".png", ".webp")):
+                with Image.open(os.path.join(folder, name)) as image:
+                    images.append(image.convert("RGB"))
+    return images
+
+
+def _time_it(fn, repeats):
+    fn()  # warm-up
+    start = time.perf_counter()
+    for _ in range(repeats):
+        out = fn()
+    return out, time.perf_counter() - start
+
+
+def parity_report(backends=BACKENDS, repeats=5):
+    """Score the sample texts/images with each backend and compare to fp32.
+
+    Returns {backend: {"roberta": {...}, "clip": {...}}} with max/mean
+    absolute difference of the AI probability and items per second.
+    """
+    from transformers import AutoTokenizer, AutoModelForSequenceClassification, CLIPModel, CLIPProcessor
+    from image_detector import CLIP_PROMPTS, AI_PROMPTS
+
+    tokenizer = AutoTokenizer.from_pretrained("roberta-base-openai-detector", use_fast=True)
+    clip_processor = CLIPProcessor.from_pretrained("openai/clip-vit-base-patch32")
+    text_inputs = tokenizer(SAMPLE_TEXTS, return_tensors="pt", truncation=True, max_length=512, padding=True)
+    images = _sample_images()
+    pixel_inputs = clip_processor(images=images, return_tensors="pt") if images else None
+
+    def roberta_scores(model):
+        with torch.no_grad():
+            return torch.softmax(model(**text_inputs).logits, dim=-1)[:, 1]
+
+    def clip_scores(clip_model, prompt_emb):
+        with torch.inference_mode():
+            emb = clip_model.get_image_features(**pixel_inputs)
+            emb = emb / emb.norm(dim=-1, keepdim=True)
+            probs = (clip_model.logit_scale.exp() * emb @ prompt_emb.T).softmax(dim=1)
+            return probs[:, list(AI_PROMPTS)].sum(dim=1)
+
+    report = {}
+    reference = {}
+    for backend in backends:
+        entry = {}
+        roberta = AutoModelForSequenceClassification.from_pretrained("roberta-base-openai-detector").eval()
+        model = prepare_roberta(roberta, backend)
+        scores, elapsed = _time_it(lambda: roberta_scores(model), repeats)
+        entry["roberta"] = {"items_per_sec": len(SAMPLE_TEXTS) * repeats / elapsed}
+        reference.setdefault("roberta", scores)
+        diff = (scores - reference["roberta"]).abs()
+        entry["roberta"].update(max_abs_diff=diff.max().item(), mean_abs_diff=diff.mean().item())
+
+        if pixel_inputs is not None:
+            clip = CLIPModel.from_pretrained("openai/clip-vit-base-patch32").eval()
+            with torch.inference_mode():
+                prompt_emb = clip.get_text_features(
+                    **clip_processor(text=CLIP_PROMPTS, return_tensors="pt", padding=True))
+                prompt_emb = prompt_emb / prompt_emb.norm(dim=-1, keepdim=True)
+            clip = prepare_clip(clip, backend)
+            scores, elapsed = _time_it(lambda: clip_scores(clip, prompt_emb), repeats)
+            entry["clip"] = {"items_per_sec": len(images) * repeats / elapsed}
+            reference.setdefault("clip", scores)
+            diff = (scores - reference["clip"]).abs()
+            entry["clip"].update(max_abs_diff=diff.max().item(), mean_abs_diff=diff.mean().item())
+        report[backend] = entry
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare inference backends against fp32.")
+    parser.add_argument("--backends", default=",".join(BACKENDS),
+                        help="comma-separated backends; the first one is the reference (default: %(default)s)")
+    parser.add_argument("--repeats", type=int, default=5)
+    args = parser.parse_args()
+
+    report = parity_report([b.strip() for b in args.backends.split(",") if b.strip()], args.repeats)
+    print(f"\n{'backend':8s} {'model':8s} {'items/s':>10s} {'max diff':>10s} {'mean diff':>10s}")
+    for backend, entry in report.items():
+        for name, row in entry.items():
+            print(f"{backend:8s} {name:8s} {row['items_per_sec']:10.1f} "
+                  f"{row['max_abs_diff']:10.4f} {row['mean_abs_diff']:10.4f}")
+
+
+if __name__ == "__main__":
+    main()
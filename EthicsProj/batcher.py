@@ -0,0 +1,106 @@
+# batcher.py
+"""Dynamic micro-batching for model calls made from many threads.
+
+Callers submit single items; a background thread collects whatever arrives
+within max_wait_ms (or until max_batch items are waiting), runs one batched
+call, and hands each caller its own output.
+"""
+import os
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+
+
+class MicroBatcher:
+    def __init__(self, batch_fn, max_batch=16, max_wait_ms=5.0, name="batcher"):
+        """batch_fn takes a list of items and returns a list of outputs in the same order."""
+        self.batch_fn = batch_fn
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000.0
+        self.name = name
+        self.batches = 0
+        self.items = 0
+        self._reset()
+        os.register_at_fork(after_in_child=self._reset)
+
+    def _reset(self):
+        # Also run in forked children, which inherit the queue but not the thread.
+        self._queue = queue.Queue()
+        self._thread = None
+        self._start_lock = threading.Lock()
+
+    def _ensure_started(self):
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+                self._thread.start()
+
+    def submit(self, item):
+        """Queue one item and return a Future for its output."""
+        self._ensure_started()
+        fut = Future()
+        self._queue.put((item, fut))
+        return fut
+
+    def __call__(self, item):
+        return self.submit(item).result()
+
+    def map(self, items):
+        """Submit all items at once so they can share batches; returns outputs in order."""
+        futures = [self.submit(item) for item in items]
+        return [f.result() for f in futures]
+
+    def imap(self, items, key=None, max_pending=None):
+        """Yield (item, output) in order, consuming items lazily.
+
+        At most max_pending items (default two batches) are queued at a time,
+        so a long iterable neither sits in memory nor crowds out other
+        callers. key(item) is what gets submitted (default the item itself).
+        """
+        max_pending = max_pending or 2 * self.max_batch
+        pending = deque()
+        for item in items:
+            pending.append((item, self.submit(item if key is None else key(item))))
+            if len(pending) >= max_pending:
+                item, fut = pending.popleft()
+                yield item, fut.result()
+        while pending:
+            item, fut = pending.popleft()
+            yield item, fut.result()
+
+    def _collect(self):
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            items = [item for item, _ in batch]
+            try:
+                outputs = self.batch_fn(items)
+            except Exception as e:
+                for _, fut in batch:
+                    fut.set_exception(e)
+                continue
+            self.batches += 1
+            self.items += len(batch)
+            for (_, fut), out in zip(batch, outputs):
+                fut.set_result(out)
+
+    def stats(self):
+        return {
+            "batches": self.batches,
+            "items": self.items,
+            "avg_batch_size": self.items / self.batches if self.batches else 0.0,
+        }
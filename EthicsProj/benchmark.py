@@ -0,0 +1,260 @@
+# benchmark.py
+"""Offline benchmark for the text, image and video pipelines.
+
+Gemini is replaced by fake_gemini.FakeGeminiClient so runs are repeatable and
+cost nothing. Each pipeline reports p50/p95/p99 latency, items per second,
+the peak RSS during the stage and how much resident memory the stage left
+behind. On Linux the peak is reset before every stage (/proc/self/clear_refs);
+elsewhere it is the process-lifetime peak, marked "process" in the report. The near-duplicate index (phash.py) is
+emptied before every measured call, so repeated iterations score their
+inputs again instead of reusing the first iteration's results. Model outputs
+are recorded into a temporary feature store, not FEATURE_STORE_PATH. Results
+can be saved as a JSON baseline and compared against a previous one:
+
+    python benchmark.py --save baseline.json
+    python benchmark.py --compare baseline.json --fail-on-regression 10
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+import cascade
+import models
+from fake_gemini import FakeGeminiClient
+from phash import near_duplicates
+
+SAMPLE_DIR = "static/uploads"
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".webp")
+
+
+def _proc_status_mb(field):
+    """A kB field of /proc/self/status in MB, or None where there is no procfs."""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith(field + ":"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+def rss_mb():
+    rss = _proc_status_mb("VmRSS")
+    return rss if rss is not None else peak_rss_mb()
+
+
+def peak_rss_mb():
+    """Peak RSS since the last reset_peak_rss() (Linux) or since the process started."""
+    peak = _proc_status_mb("VmHWM")
+    if peak is not None:
+        return peak
+    # ru_maxrss is KiB on Linux, bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024
+
+
+def reset_peak_rss():
+    """Start a new peak window; False where the kernel does not support it."""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+@contextlib.contextmanager
+def measure_memory(stats):
+    """Add peak_rss_mb, rss_delta_mb and peak_scope for the enclosed block to stats."""
+    before = rss_mb()
+    scope = "stage" if reset_peak_rss() else "process"
+    yield
+    stats.update(peak_rss_mb=peak_rss_mb(), rss_delta_mb=rss_mb() - before, peak_scope=scope)
+
+
+def sample_images(folder=SAMPLE_DIR):
+    return [os.path.join(folder, name) for name in sorted(os.listdir(folder))
+            if name.lower().endswith(IMAGE_EXTENSIONS)]
+
+
+def make_sample_video(images, path, seconds_per_image=2, fps=30):
+    """Stitch the sample images into a short video so the video pipeline has input."""
+    import cv2
+    size = (640, 360)
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"mp4v"), fps, size)
+    for image_path in images:
+        frame = cv2.resize(cv2.imread(image_path), size)
+        for _ in range(seconds_per_image * fps):
+            writer.write(frame)
+    writer.release()
+    return path
+
+
+def summarize(latencies, wall_seconds, items):
+    lat = np.asarray(latencies) * 1000.0
+    return {
+        "runs": len(latencies),
+        "items": items,
+        "p50_ms": float(np.percentile(lat, 50)),
+        "p95_ms": float(np.percentile(lat, 95)),
+        "p99_ms": float(np.percentile(lat, 99)),
+        "items_per_sec": items / wall_seconds if wall_seconds else 0.0,
+    }
+
+
+def run_stage(name, fn, inputs, iterations, quiet=True):
+    """Call fn(x) for each input, iterations times; returns the summary dict."""
+    latencies = []
+    memory = {}
+    with measure_memory(memory):
+        start = time.perf_counter()
+        for _ in range(iterations):
+            for item in inputs:
+                near_duplicates.clear()
+                t0 = time.perf_counter()
+                if quiet:
+                    with contextlib.redirect_stdout(io.StringIO()):
+                        fn(item)
+                else:
+                    fn(item)
+                latencies.append(time.perf_counter() - t0)
+        wall = time.perf_counter() - start
+    stats = summarize(latencies, wall, len(latencies))
+    stats.update(memory)
+    print(f"{name:12s} p50 {stats['p50_ms']:9.1f} ms  p95 {stats['p95_ms']:9.1f} ms  "
+          f"p99 {stats['p99_ms']:9.1f} ms  {stats['items_per_sec']:7.2f} items/s  "
+          f"peak RSS {stats['peak_rss_mb']:.0f} MB ({stats['peak_scope']})  "
+          f"RSS {stats['rss_delta_mb']:+.0f} MB")
+    return stats
+
+
+def run_benchmark(args):
+    fake = FakeGeminiClient(latency_ms=args.latency_ms, jitter_ms=args.jitter_ms,
+                            error_rate=args.error_rate, burst_every=args.burst_every,
+                            burst_len=args.burst_len, seed=args.seed)
+    models.override("gemini", fake)
+    if args.cascade:
+        cascade.CASCADE_ENABLED.update(text=True, image=True)
+    pipelines = [p.strip() for p in args.pipelines.split(",") if p.strip()]
+    report = {"config": vars(args).copy(), "commit": git_commit(), "stages": {}}
+    report["config"].pop("save", None)
+    report["config"].pop("compare", None)
+
+    if "text" in pipelines:
+        from backends import SAMPLE_TEXTS
+        from text_detector import detect_ai_text
+        stage = report["stages"]["text_load"] = {}
+        with measure_memory(stage):
+            start = time.perf_counter()
+            models.get("roberta")
+            stage["seconds"] = time.perf_counter() - start
+        report["stages"]["text"] = run_stage("text", detect_ai_text, SAMPLE_TEXTS, args.iterations, not args.verbose)
+
+    images = sample_images()
+    if "image" in pipelines or "video" in pipelines:
+        stage = report["stages"]["clip_load"] = {}
+        with measure_memory(stage):
+            start = time.perf_counter()
+            models.get("clip")
+            stage["seconds"] = time.perf_counter() - start
+
+    if "image" in pipelines:
+        from image_detector import detect_ai_image
+        report["stages"]["image"] = run_stage("image", detect_ai_image, images, args.iterations, not args.verbose)
+
+    if "video" in pipelines:
+        from video_detector import detect_ai_video
+        with tempfile.TemporaryDirectory() as tmp:
+            video = make_sample_video(images, os.path.join(tmp, "sample.mp4"))
+            report["stages"]["video"] = run_stage("video", detect_ai_video, [video], args.iterations, not args.verbose)
+
+    report["gemini_calls"] = fake.calls
+    report["gemini_failures"] = fake.failures
+    report["escalation_rate"] = {kind: cascade.escalation_rate(kind) for kind in ("text", "image")}
+    return report
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True).strip()
+    except Exception:
+        return None
+
+
+def compare(report, baseline, threshold_pct):
+    """Print per-stage deltas; returns the list of regressed stage/metric names."""
+    regressions = []
+    print(f"\nComparison against baseline {baseline.get('commit')}:")
+    for stage, cur in report["stages"].items():
+        old = baseline.get("stages", {}).get(stage)
+        if not old:
+            continue
+        for metric, higher_is_better in (("p50_ms", False), ("p95_ms", False),
+                                         ("items_per_sec", True), ("seconds", False)):
+            if metric not in cur or metric not in old or not old[metric]:
+                continue
+            delta = (cur[metric] - old[metric]) / old[metric] * 100.0
+            worse = -delta if higher_is_better else delta
+            flag = ""
+            if worse > threshold_pct:
+                flag = "  <-- regression"
+                regressions.append(f"{stage}.{metric}")
+            print(f"  {stage:12s} {metric:14s} {old[metric]:10.2f} -> {cur[metric]:10.2f} ({delta:+.1f}%){flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the detector pipelines against a fake Gemini.")
+    parser.add_argument("--pipelines", default="text,image,video")
+    parser.add_argument("--iterations", type=int, default=3)
+    parser.add_argument("--latency-ms", type=float, default=800.0, help="mean fake Gemini latency")
+    parser.add_argument("--jitter-ms", type=float, default=200.0)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of calls failing with 500")
+    parser.add_argument("--burst-every", type=int, default=0, help="calls between 503 bursts (0 = none)")
+    parser.add_argument("--burst-len", type=int, default=0, help="failing calls per 503 burst")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--save", help="write the report as a JSON baseline")
+    parser.add_argument("--compare", help="baseline JSON to compare against")
+    parser.add_argument("--fail-on-regression", type=float, default=None, metavar="PCT",
+                        help="exit 1 if any metric is more than PCT%% worse than the baseline")
+    parser.add_argument("--cascade", action="store_true",
+                        help="skip Gemini for confident local scores (see cascade.py)")
+    parser.add_argument("--verbose", action="store_true", help="show detector output")
+    args = parser.parse_args()
+
+    from feature_store import feature_store
+    with tempfile.TemporaryDirectory() as store_dir:
+        feature_store.use(store_dir)
+        report = run_benchmark(args)
+    print(f"\nGemini stand-in: {report['gemini_calls']} calls, {report['gemini_failures']} injected failures")
+    for kind, rate in report["escalation_rate"].items():
+        if rate is not None:
+            print(f"Cascade escalation rate ({kind}): {rate*100:.1f}%")
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Saved baseline to {args.save}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        threshold = args.fail_on_regression if args.fail_on_regression is not None else 10.0
+        regressions = compare(report, baseline, threshold)
+        if regressions and args.fail_on_regression is not None:
+            print(f"[!] Regressions: {', '.join(regressions)}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,253 @@
+# cache.py
+"""Content-addressed result cache shared by the text, image and video detectors.
+
+Results are keyed by a SHA-256 over the media kind, the model/weight versions
+used for that kind, and the normalized text or raw file bytes. Lookups go
+through a small in-process LRU first and fall back to a persistent sqlite
+table. Both tiers expire entries by age (TTL); the table is also trimmed by
+row count.
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from cascade import version_tag
+
+CACHE_DB_PATH = os.getenv("RESULT_CACHE_PATH", "cache/results.sqlite3")
+CACHE_TTL_SECONDS = int(os.getenv("RESULT_CACHE_TTL", str(7 * 24 * 3600)))
+CACHE_MAX_ROWS = int(os.getenv("RESULT_CACHE_MAX_ROWS", "50000"))
+CACHE_MEMORY_ITEMS = int(os.getenv("RESULT_CACHE_MEMORY_ITEMS", "512"))
+# sqlite is trimmed once per this many writes, so the table may briefly hold
+# up to this many rows over RESULT_CACHE_MAX_ROWS.
+CACHE_EVICT_EVERY = int(os.getenv("RESULT_CACHE_EVICT_EVERY", "256"))
+
+# Scores differ slightly between inference backends (see backends.py), so the
+# backend is part of every key.
+INFERENCE_BACKEND = os.getenv("INFERENCE_BACKEND", "torch")
+# Mirrors video_detector.VIDEO_SAMPLING and the settings of each mode; they
+# decide which frames get scored. See video_version().
+VIDEO_SAMPLING = os.getenv("VIDEO_SAMPLING", "fixed")
+# KEYFRAME_MODE and the scene settings pick the keyframes of fixed and
+# adaptive runs (stream mode does not use them).
+KEYFRAME_MODE = os.getenv("KEYFRAME_MODE", "interval")
+_KEYFRAMES = (f"scene{os.getenv('SCENE_PROBE_INTERVAL', '5')}g{os.getenv('SCENE_MIN_GAP', '15')}"
+              if KEYFRAME_MODE == "scene" else "interval")
+_VIDEO_FRAMES = {
+    "fixed": f"frames30x15|{_KEYFRAMES}",
+    "adaptive": f"adaptive{os.getenv('ADAPTIVE_MIN_FRAMES', '4')}-{os.getenv('ADAPTIVE_MAX_FRAMES', '48')}"
+                f"b{os.getenv('ADAPTIVE_BATCH', '4')}z{float(os.getenv('ADAPTIVE_Z', '1.96')):g}|{_KEYFRAMES}",
+    "stream": f"stream{os.getenv('VIDEO_STREAM_INTERVAL', '30')}x{os.getenv('VIDEO_STREAM_MAX_FRAMES', '0')}",
+}
+TEMPORAL_WEIGHT = float(os.getenv("TEMPORAL_WEIGHT", "0"))
+
+# Bump the matching entry (video: in video_version()) whenever a model, prompt
+# or weighting changes so stale results stop matching. Video frames go through
+# the image cascade.
+MODEL_VERSIONS = {
+    "text": f"roberta-base-openai-detector|gemini-2.5-flash|w0.6-0.25-0.15|chunked|{INFERENCE_BACKEND}"
+            f"{version_tag('text')}|v6",
+    "image": f"clip-vit-base-patch32|gemini-2.5-flash|w0.3-0.7|{INFERENCE_BACKEND}{version_tag('image')}|v5",
+}
+
+
+def video_version(sampling=None):
+    """MODEL_VERSIONS entry for a video analyzed with `sampling` (default VIDEO_SAMPLING).
+
+    Pass the same sampling that detect_ai_video() gets, so each mode keeps its own entries.
+    """
+    sampling = sampling or VIDEO_SAMPLING
+    return (f"clip-vit-base-patch32|gemini-2.5-flash|{_VIDEO_FRAMES.get(sampling, sampling)}|"
+            f"temporal{TEMPORAL_WEIGHT:g}|{INFERENCE_BACKEND}{version_tag('image')}|v5")
+
+
+MODEL_VERSIONS["video"] = video_version()
+
+
+def normalize_text(text):
+    """Collapse whitespace so trivially reformatted copies share a key."""
+    return " ".join((text or "").split())
+
+
+def normalized_offsets(text):
+    """Map each char offset of text (0..len(text)) to its offset in normalize_text(text)."""
+    offsets, pos, started, space = [], 0, False, False
+    for ch in text or "":
+        if ch.isspace():
+            space = started
+        else:
+            if space:
+                pos += 1
+                space = False
+            started = True
+        offsets.append(pos)
+        if not ch.isspace():
+            pos += 1
+    offsets.append(pos)
+    return offsets
+
+
+def content_key(kind, data, version=None):
+    """SHA-256 key for `data` (str or bytes) analyzed as `kind`.
+
+    version overrides MODEL_VERSIONS[kind], e.g. video_version(sampling).
+    """
+    if isinstance(data, str):
+        data = normalize_text(data).encode("utf-8")
+    if version is None:
+        version = MODEL_VERSIONS.get(kind, "")
+    h = hashlib.sha256()
+    h.update(kind.encode("utf-8") + b"\0")
+    h.update(version.encode("utf-8") + b"\0")
+    h.update(data)
+    return h.hexdigest()
+
+
+def digest_key(kind, sha256_hex, version=None):
+    """Key for a file whose SHA-256 is already known (e.g. computed during upload)."""
+    return content_key(kind, sha256_hex.encode("ascii"), version)
+
+
+def file_key(kind, path, chunk_size=1 << 20, version=None):
+    """Hash a local file in chunks without reading it into memory at once."""
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            h.update(chunk)
+    return digest_key(kind, h.hexdigest(), version)
+
+
+def _json_default(obj):
+    # numpy scalars (np.float64, np.bool_) show up in detector results
+    if hasattr(obj, "item"):
+        return obj.item()
+    return str(obj)
+
+
+class ResultCache:
+    """Two-tier (memory LRU + sqlite) cache of detector result dicts."""
+
+    def __init__(self, db_path=CACHE_DB_PATH, ttl=CACHE_TTL_SECONDS,
+                 max_rows=CACHE_MAX_ROWS, memory_items=CACHE_MEMORY_ITEMS, evict_every=CACHE_EVICT_EVERY):
+        self.db_path = db_path
+        self.ttl = ttl
+        self.max_rows = max_rows
+        self.memory_items = memory_items
+        self.evict_every = max(1, evict_every)
+        self._writes_since_evict = 0
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0,
+                      "writes": 0, "evictions": 0}
+        self._conn = None
+        if db_path:
+            d = os.path.dirname(db_path)
+            if d:
+                os.makedirs(d, exist_ok=True)
+            self._conn = sqlite3.connect(db_path, check_same_thread=False)
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS results ("
+                " key TEXT PRIMARY KEY, kind TEXT, created REAL, accessed REAL, value TEXT)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS results_accessed ON results(accessed)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS results_created ON results(created)")
+            self._conn.commit()
+
+    def _remember(self, key, value, created):
+        self._memory[key] = (created, value)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_items:
+            self._memory.popitem(last=False)
+
+    def get(self, key):
+        with self._lock:
+            if key in self._memory:
+                created, value = self._memory[key]
+                if time.time() - created <= self.ttl:
+                    self._memory.move_to_end(key)
+                    self.stats["memory_hits"] += 1
+                    return value
+                # Expired; the sqlite row (if any) is as old and is dropped below.
+                del self._memory[key]
+            if self._conn is not None:
+                row = self._conn.execute(
+                    "SELECT value, created FROM results WHERE key = ?", (key,)
+                ).fetchone()
+                if row is not None:
+                    value, created = row
+                    if time.time() - created <= self.ttl:
+                        self._conn.execute(
+                            "UPDATE results SET accessed = ? WHERE key = ?", (time.time(), key)
+                        )
+                        self._conn.commit()
+                        result = json.loads(value)
+                        self._remember(key, result, created)
+                        self.stats["disk_hits"] += 1
+                        return result
+                    self._conn.execute("DELETE FROM results WHERE key = ?", (key,))
+                    self._conn.commit()
+                    self.stats["evictions"] += 1
+            self.stats["misses"] += 1
+            return None
+
+    def put(self, key, kind, result):
+        if isinstance(result, dict) and result.get("gemini_unavailable"):
+            # Scored without Gemini during an outage; the next request should try again.
+            return
+        value = json.dumps(result, default=_json_default)
+        with self._lock:
+            now = time.time()
+            self._remember(key, json.loads(value), now)
+            self.stats["writes"] += 1
+            if self._conn is None:
+                return
+            self._conn.execute(
+                "INSERT OR REPLACE INTO results (key, kind, created, accessed, value) VALUES (?, ?, ?, ?, ?)",
+                (key, kind, now, now, value),
+            )
+            self._writes_since_evict += 1
+            if self._writes_since_evict >= self.evict_every:
+                self._evict(now)
+                self._writes_since_evict = 0
+            self._conn.commit()
+
+    def _evict(self, now):
+        """Drop expired rows, then the least recently accessed ones beyond max_rows."""
+        cur = self._conn.execute("DELETE FROM results WHERE created < ?", (now - self.ttl,))
+        removed = cur.rowcount or 0
+        (count,) = self._conn.execute("SELECT COUNT(*) FROM results").fetchone()
+        if count > self.max_rows:
+            cur = self._conn.execute(
+                "DELETE FROM results WHERE key IN "
+                "(SELECT key FROM results ORDER BY accessed ASC LIMIT ?)",
+                (count - self.max_rows,),
+            )
+            removed += cur.rowcount or 0
+        self.stats["evictions"] += removed
+
+    def get_or_compute(self, key, kind, compute):
+        """Return the cached result for `key`, or run `compute()` and store it."""
+        result = self.get(key)
+        if result is not None:
+            return result
+        result = compute()
+        if isinstance(result, dict):
+            self.put(key, kind, result)
+        return result
+
+    def snapshot(self):
+        """Counters plus derived hit rate and current tier sizes."""
+        with self._lock:
+            stats = dict(self.stats)
+            stats["memory_items"] = len(self._memory)
+            if self._conn is not None:
+                (stats["disk_items"],) = self._conn.execute("SELECT COUNT(*) FROM results").fetchone()
+        lookups = stats["memory_hits"] + stats["disk_hits"] + stats["misses"]
+        stats["hit_rate"] = (stats["memory_hits"] + stats["disk_hits"]) / lookups if lookups else 0.0
+        return stats
+
+
+result_cache = ResultCache()
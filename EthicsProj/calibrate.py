@@ -0,0 +1,123 @@
+# calibrate.py
+"""Pick confidence-cascade thresholds from a labeled sample.
+
+Input is JSONL with one item per line and a 0/1 `label` (1 = AI-generated):
+
+    {"text": "...", "label": 1}
+    {"path": "static/uploads/image3.jpg", "label": 0}
+    {"url": "https://example.com/photo.jpg", "label": 1}
+    {"local_score": 0.93, "label": 1}
+
+Local scores are computed with the same local-only path the cascade uses
+(RoBERTa + heuristics for text, CLIP for images); lines that already carry a
+`local_score` skip the models. Every (LOW, HIGH) band on a grid is then
+evaluated, and the band that sends the fewest items to Gemini while keeping
+the error rate of locally decided items under --max-error is printed as
+environment settings. No Gemini calls are made.
+
+    python calibrate.py labeled_text.jsonl --kind text --max-error 0.02
+"""
+import argparse
+import json
+
+import numpy as np
+
+
+def load_records(path):
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def local_scores(records, kind, batch_size=32):
+    """Local score for every record, running the local models only where needed."""
+    scores = [r.get("local_score") for r in records]
+    todo = [i for i, s in enumerate(scores) if s is None]
+    if not todo:
+        return np.asarray(scores, dtype=np.float64)
+    if kind == "text":
+        from text_detector import local_text_scores as score_batch
+        inputs = [records[i]["text"] for i in todo]
+    else:
+        from image_detector import local_image_scores as score_batch
+        inputs = [records[i].get("path") or records[i]["url"] for i in todo]
+    for start in range(0, len(todo), batch_size):
+        batch = inputs[start:start + batch_size]
+        out = score_batch(batch)
+        if kind == "text":
+            out = out[0]
+        for i, s in zip(todo[start:start + batch_size], out):
+            scores[i] = float(s)
+        print(f"Scored {min(start + batch_size, len(todo))}/{len(todo)} items locally")
+    return np.asarray(scores, dtype=np.float64)
+
+
+def evaluate_bands(scores, labels, step=0.01):
+    """Escalation rate and local error rate for every LOW <= 0.5 <= HIGH band on a grid."""
+    rows = []
+    grid = np.round(np.arange(0.0, 1.0 + step / 2, step), 6)
+    for low in grid[grid <= 0.5]:
+        for high in grid[grid >= 0.5]:
+            local_neg = scores <= low
+            local_pos = scores >= high
+            decided = local_neg | local_pos
+            n_local = int(decided.sum())
+            errors = int((local_neg & (labels == 1)).sum() + (local_pos & (labels == 0)).sum())
+            rows.append({
+                "low": float(low),
+                "high": float(high),
+                "escalation_rate": 1.0 - n_local / len(scores),
+                "local_error_rate": errors / n_local if n_local else 0.0,
+                "local_errors": errors,
+            })
+    return rows
+
+
+def pick_band(rows, max_error):
+    """Lowest escalation rate whose local error rate is within max_error (ties: widest margin)."""
+    ok = [r for r in rows if r["local_error_rate"] <= max_error]
+    if not ok:
+        return None
+    return min(ok, key=lambda r: (r["escalation_rate"], r["local_error_rate"], r["low"] - r["high"]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Choose cascade thresholds from labeled data.")
+    parser.add_argument("labeled", help="JSONL file with a 0/1 `label` per item")
+    parser.add_argument("--kind", choices=("text", "image"), required=True)
+    parser.add_argument("--max-error", type=float, default=0.02,
+                        help="highest tolerated error rate among items decided without Gemini")
+    parser.add_argument("--step", type=float, default=0.01, help="threshold grid step")
+    parser.add_argument("--save-scores", help="write the records with their local_score as JSONL")
+    args = parser.parse_args()
+
+    records = load_records(args.labeled)
+    labels = np.asarray([int(r["label"]) for r in records])
+    scores = local_scores(records, args.kind)
+
+    if args.save_scores:
+        with open(args.save_scores, "w") as f:
+            for r, s in zip(records, scores):
+                f.write(json.dumps({**r, "local_score": float(s)}) + "\n")
+
+    rows = evaluate_bands(scores, labels, args.step)
+    print(f"\n{len(records)} items, {int(labels.sum())} labeled AI")
+    print(f"Local-only accuracy at 0.5: {float(((scores > 0.5) == (labels == 1)).mean())*100:.1f}%")
+    print("\nmax error   LOW   HIGH   escalated   local errors")
+    for target in sorted({0.005, 0.01, 0.02, 0.05, args.max_error}):
+        r = pick_band(rows, target)
+        if r:
+            print(f"{target*100:8.1f}%  {r['low']:.2f}   {r['high']:.2f}   {r['escalation_rate']*100:8.1f}%"
+                  f"   {r['local_errors']} ({r['local_error_rate']*100:.1f}%)")
+
+    best = pick_band(rows, args.max_error)
+    if best is None:
+        print(f"\n[!] No band keeps local errors under {args.max_error*100:.1f}%; leave the cascade off.")
+        return
+    prefix = args.kind.upper()
+    print(f"\n{prefix}_CASCADE=on")
+    print(f"{prefix}_CASCADE_LOW={best['low']:.2f}")
+    print(f"{prefix}_CASCADE_HIGH={best['high']:.2f}")
+
+
+if __name__ == "__main__":
+    main()
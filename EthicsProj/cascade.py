@@ -0,0 +1,57 @@
+# cascade.py
+"""Confidence cascade: only ask Gemini when the local models are unsure.
+
+With the cascade on for a media kind, an item whose local score is at or
+below LOW or at or above HIGH is answered from the local models alone; only
+scores strictly inside (LOW, HIGH) are escalated to Gemini. Bands come from
+the environment and can be picked from labeled data with calibrate.py.
+Decisions are counted in aimd_cascade_decisions_total.
+"""
+import os
+
+from metrics import cascade_decisions
+
+
+def _env_band(kind, low="0.1", high="0.9"):
+    prefix = kind.upper()
+    return (float(os.getenv(f"{prefix}_CASCADE_LOW", low)),
+            float(os.getenv(f"{prefix}_CASCADE_HIGH", high)))
+
+
+# TEXT_CASCADE=on / IMAGE_CASCADE=on turn the cascade on by default for that kind.
+CASCADE_ENABLED = {kind: os.getenv(f"{kind.upper()}_CASCADE", "off") == "on" for kind in ("text", "image")}
+CASCADE_BANDS = {kind: _env_band(kind) for kind in ("text", "image")}
+
+
+def band_for(kind, cascade=None):
+    """The active (low, high) band for kind, or None when every item goes to Gemini.
+
+    cascade=True/False overrides the environment switch for one call.
+    """
+    enabled = CASCADE_ENABLED.get(kind, False) if cascade is None else cascade
+    return CASCADE_BANDS[kind] if enabled else None
+
+
+def split(kind, local_scores, band):
+    """Indexes of the items that must go to Gemini, recording the decisions."""
+    if band is None:
+        return list(range(len(local_scores)))
+    low, high = band
+    escalate = [i for i, s in enumerate(local_scores) if low < s < high]
+    cascade_decisions.inc(len(escalate), label=kind, decision="escalated")
+    cascade_decisions.inc(len(local_scores) - len(escalate), label=kind, decision="local")
+    return escalate
+
+
+def escalation_rate(kind):
+    """Fraction of cascaded items sent to Gemini so far in this process (None if none)."""
+    escalated = cascade_decisions.value(label=kind, decision="escalated")
+    local = cascade_decisions.value(label=kind, decision="local")
+    total = escalated + local
+    return escalated / total if total else None
+
+
+def version_tag(kind):
+    """Cache-key suffix: cascaded results differ from full-ensemble ones."""
+    band = band_for(kind)
+    return "" if band is None else f"|cascade{band[0]:g}-{band[1]:g}"
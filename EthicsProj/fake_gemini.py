@@ -0,0 +1,68 @@
+# fake_gemini.py
+"""Local stand-in for the Gemini client used by benchmarks.
+
+Implements the two calls the detectors make (`models.generate_content` and
+`aio.models.generate_content`) with configurable latency, a random error
+rate, and periodic bursts of 503 UNAVAILABLE responses. Install it with
+`models.override("gemini", FakeGeminiClient(...))`.
+"""
+import asyncio
+import json
+import random
+import threading
+import time
+from types import SimpleNamespace
+
+
+class FakeGeminiClient:
+    def __init__(self, latency_ms=800.0, jitter_ms=200.0, error_rate=0.0,
+                 burst_every=0, burst_len=0, seed=None):
+        """burst_every=N, burst_len=M makes calls N+1..N+M of every N+M fail with 503."""
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.burst_every = burst_every
+        self.burst_len = burst_len
+        self.calls = 0
+        self.failures = 0
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self.models = SimpleNamespace(generate_content=self._generate_sync)
+        self.aio = SimpleNamespace(models=SimpleNamespace(generate_content=self._generate_async))
+
+    def _plan(self):
+        """Decide latency and outcome for the next call."""
+        with self._lock:
+            self.calls += 1
+            n = self.calls
+            delay = max(0.0, self._rng.gauss(self.latency_ms, self.jitter_ms)) / 1000.0
+            error = None
+            if self.burst_every and self.burst_len:
+                if (n - 1) % (self.burst_every + self.burst_len) >= self.burst_every:
+                    error = "503 UNAVAILABLE: fake burst"
+            if error is None and self._rng.random() < self.error_rate:
+                error = "500 INTERNAL: fake error"
+            if error:
+                self.failures += 1
+            score = round(self._rng.random(), 3)
+        return delay, error, score
+
+    @staticmethod
+    def _response(config, score):
+        if config is not None and getattr(config, "response_mime_type", None) == "application/json":
+            return SimpleNamespace(text=json.dumps({"score": score, "reasoning": "Fake Gemini reasoning."}))
+        return SimpleNamespace(text=f"Fake Gemini explanation (score {score}).")
+
+    def _generate_sync(self, model, contents, config=None):
+        delay, error, score = self._plan()
+        time.sleep(delay)
+        if error:
+            raise RuntimeError(error)
+        return self._response(config, score)
+
+    async def _generate_async(self, model, contents, config=None):
+        delay, error, score = self._plan()
+        await asyncio.sleep(delay)
+        if error:
+            raise RuntimeError(error)
+        return self._response(config, score)
@@ -0,0 +1,216 @@
+# feature_store.py
+"""Append-only, memory-mapped store of model outputs for offline re-scoring.
+
+Every analysis appends one fixed-size record per scored text or image to
+<FEATURE_STORE_PATH>/<kind>.v1.bin, keyed by the SHA-256 of the content
+(the normalized text, or the decoded RGB pixels of an image):
+
+- text: RoBERTa log-odds, the readability/diversity features and the
+  heuristic score derived from them, and the Gemini score;
+- image (video frames included): the L2-normalized CLIP image embedding
+  as float16, and the Gemini score.
+
+A Gemini score of NaN means Gemini was not asked (confidence cascade).
+Items Gemini could not answer are not recorded. The CLIP prompts and their
+embeddings used at record time are kept next to the image records in
+clip_prompts.npz.
+
+Each batch of records is written with one write() to an O_APPEND file, so
+threads and prefork workers do not interleave records. A short write (disk
+full) raises and stops recording in this process, so nothing is appended
+after the torn record. Readers memory-map the file and ignore a torn last
+record. The same key can appear several
+times; the newest record wins (see latest()). rescore.py recomputes final
+scores from these records under new weights, prompts or thresholds without
+running the models.
+
+Benchmarks record into a temporary store (feature_store.use()), and bulk
+scans into one next to their results file, so only interactive analyses
+reach FEATURE_STORE_PATH.
+"""
+import hashlib
+import os
+import threading
+import time
+
+import numpy as np
+
+from analyzer import FEATURE_NAMES
+from cache import normalize_text
+
+FEATURE_STORE = os.getenv("FEATURE_STORE", "on") == "on"
+FEATURE_STORE_PATH = os.getenv("FEATURE_STORE_PATH", "cache/features")
+STORE_VERSION = 1
+# CLIP ViT-B/32 projection size.
+EMBEDDING_DIM = 512
+
+DTYPES = {
+    "text": np.dtype([
+        ("key", "S32"),
+        ("time", "<f8"),
+        ("roberta_logit", "<f4"),
+        ("features", "<f4", (len(FEATURE_NAMES),)),
+        ("heuristic", "<f4"),
+        ("gemini", "<f4"),
+    ]),
+    "image": np.dtype([
+        ("key", "S32"),
+        ("time", "<f8"),
+        ("embedding", "<f2", (EMBEDDING_DIM,)),
+        ("gemini", "<f4"),
+    ]),
+}
+
+
+def text_digest(text):
+    return hashlib.sha256(normalize_text(text).encode("utf-8")).digest()
+
+
+def image_digest(image):
+    """SHA-256 over the size and RGB pixels of a decoded (and downscaled) PIL image."""
+    image = image if image.mode == "RGB" else image.convert("RGB")
+    h = hashlib.sha256(f"{image.size[0]}x{image.size[1]}".encode())
+    h.update(image.tobytes())
+    return h.digest()
+
+
+def key_hex(key):
+    # numpy drops trailing NUL bytes of "S" fields; put them back.
+    return bytes(key).ljust(32, b"\0").hex()
+
+
+def to_logit(p, eps=1e-6):
+    p = np.clip(np.asarray(p, dtype=np.float64), eps, 1 - eps)
+    return np.log(p / (1 - p))
+
+
+class FeatureStore:
+    def __init__(self, root=FEATURE_STORE_PATH, enabled=FEATURE_STORE):
+        self.root = root
+        self.enabled = enabled
+        self._fds = {}
+        self._prompts_saved = None
+        self._lock = threading.Lock()
+
+    def use(self, root, enabled=True):
+        """Record under root from now on; enabled=False stops recording."""
+        with self._lock:
+            for fd in self._fds.values():
+                os.close(fd)
+            self._fds.clear()
+            self._prompts_saved = None
+            self.root, self.enabled = root, enabled
+
+    def path(self, kind):
+        return os.path.join(self.root, f"{kind}.v{STORE_VERSION}.bin")
+
+    def append(self, kind, rows):
+        """Append a structured array of DTYPES[kind] records."""
+        if not len(rows):
+            return
+        data = memoryview(np.ascontiguousarray(rows, dtype=DTYPES[kind]).tobytes())
+        with self._lock:
+            fd = self._fds.get(kind)
+            if fd is None:
+                os.makedirs(self.root, exist_ok=True)
+                fd = self._fds[kind] = os.open(self.path(kind), os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            written = os.write(fd, data)
+            if written != len(data):
+                # Anything appended after a torn record would be misaligned.
+                self.enabled = False
+                raise OSError(f"short write to {self.path(kind)} ({written} of {len(data)} bytes); "
+                              f"feature recording stopped")
+
+    def load(self, kind):
+        """All records of kind as a read-only memory map (duplicates included)."""
+        dtype = DTYPES[kind]
+        path = self.path(kind)
+        count = os.path.getsize(path) // dtype.itemsize if os.path.exists(path) else 0
+        if count == 0:
+            return np.zeros(0, dtype=dtype)
+        return np.memmap(path, dtype=dtype, mode="r", shape=(count,))
+
+    def latest(self, kind):
+        """Records of kind with only the newest one per key, in append order."""
+        records = self.load(kind)
+        if not len(records):
+            return records
+        _, first_from_end = np.unique(records["key"][::-1], return_index=True)
+        return records[np.sort(len(records) - 1 - first_from_end)]
+
+    def record_texts(self, texts, roberta_probs, features, heuristics, gemini_scores):
+        """gemini_scores holds a score or None (not asked) per text."""
+        rows = np.zeros(len(texts), dtype=DTYPES["text"])
+        rows["key"] = [text_digest(t) for t in texts]
+        rows["time"] = time.time()
+        rows["roberta_logit"] = to_logit(roberta_probs)
+        rows["features"] = np.asarray(features, dtype=np.float32).reshape(len(texts), len(FEATURE_NAMES))
+        rows["heuristic"] = heuristics
+        rows["gemini"] = [np.nan if g is None else g for g in gemini_scores]
+        self.append("text", rows)
+
+    def record_images(self, images, embeddings, gemini_scores):
+        """embeddings is an (n, EMBEDDING_DIM) array of normalized CLIP embeddings."""
+        rows = np.zeros(len(images), dtype=DTYPES["image"])
+        rows["key"] = [image_digest(img) for img in images]
+        rows["time"] = time.time()
+        rows["embedding"] = np.asarray(embeddings, dtype=np.float32)
+        rows["gemini"] = [np.nan if g is None else g for g in gemini_scores]
+        self.append("image", rows)
+
+    def save_clip_prompts(self, prompts, embeddings, logit_scale, ai_prompts):
+        """Keep the prompt set image records are scored against; rewritten only when it changes."""
+        prompts = list(prompts)
+        with self._lock:
+            if self._prompts_saved == prompts:
+                return
+            existing = self.load_clip_prompts()
+            if existing is None or existing["prompts"] != prompts:
+                os.makedirs(self.root, exist_ok=True)
+                tmp = os.path.join(self.root, "clip_prompts.tmp.npz")
+                np.savez(tmp, prompts=np.asarray(prompts), embeddings=np.asarray(embeddings, dtype=np.float32),
+                         logit_scale=float(logit_scale), ai_prompts=np.asarray(ai_prompts))
+                os.replace(tmp, os.path.join(self.root, "clip_prompts.npz"))
+            self._prompts_saved = prompts
+
+    def load_clip_prompts(self):
+        path = os.path.join(self.root, "clip_prompts.npz")
+        if not os.path.exists(path):
+            return None
+        with np.load(path) as data:
+            return {
+                "prompts": [str(p) for p in data["prompts"]],
+                "embeddings": data["embeddings"],
+                "logit_scale": float(data["logit_scale"]),
+                "ai_prompts": [int(i) for i in data["ai_prompts"]],
+            }
+
+
+def _after_fork_in_child():
+    # Descriptors stay valid (O_APPEND keeps records whole); only the lock is reset.
+    feature_store._lock = threading.Lock()
+
+
+feature_store = FeatureStore()
+os.register_at_fork(after_in_child=_after_fork_in_child)
+
+
+def _record(kind, write, *args):
+    """Append through the shared store; failures are logged, never raised."""
+    if not feature_store.enabled:
+        return
+    try:
+        write(*args)
+    except Exception as e:
+        print(f"[!] Could not record {kind} features: {e}")
+
+
+def record_texts(texts, roberta_probs, features, heuristics, gemini_scores):
+    _record("text", feature_store.record_texts, texts, roberta_probs, features, heuristics, gemini_scores)
+
+
+def record_images(images, embeddings, gemini_scores, prompts=None):
+    """prompts=(prompts, embeddings, logit_scale, ai_prompts) of the CLIP prompt set in use."""
+    if prompts is not None:
+        _record("image", feature_store.save_clip_prompts, *prompts)
+    _record("image", feature_store.record_images, images, embeddings, gemini_scores)
@@ -0,0 +1,349 @@
+# gemini.py
+"""Shared Gemini access for all detectors.
+
+Each item gets a single structured request that returns both the score and
+the explanation. Requests run on one background asyncio loop through the
+async client, so a batch (the frames of a video, a list of texts) is in
+flight at once, capped by GEMINI_CONCURRENCY. The client itself comes from
+the model registry, so every detector shares one.
+
+Every call goes through the same resilience layer:
+
+- per-attempt deadline: GEMINI_TIMEOUT_FACTOR x the recent p95 latency of
+  that kind of call (label), kept between GEMINI_TIMEOUT_MIN_SECONDS and GEMINI_TIMEOUT_SECONDS;
+- a latency budget of GEMINI_BUDGET_SECONDS per item, starting when the
+  item gets one of the GEMINI_CONCURRENCY slots (so items queued behind a
+  large batch are not starved) and covering its attempts, backoff and
+  later rate-limit waits. An attempt cut short by the budget is not
+  counted against the service;
+- retries with full-jitter exponential backoff on timeouts and transient
+  errors (503, 429, 500), only while the budget can still fit an attempt;
+- a circuit breaker that opens when at least GEMINI_BREAKER_THRESHOLD of
+  the last GEMINI_BREAKER_WINDOW attempts failed. While it is open, calls
+  fail at once and the detectors fall back to their local-only score.
+  After GEMINI_BREAKER_COOLDOWN_SECONDS, one probe request decides whether
+  it closes again;
+- a token bucket of GEMINI_RATE_PER_SECOND requests (bursts up to
+  GEMINI_RATE_BURST) to stay under quota.
+
+Callers get None for an item that did not get an answer.
+"""
+import asyncio
+import json
+import os
+import random
+import threading
+import time
+from collections import deque
+
+from google.genai import types
+
+import models
+from metrics import (span, stage_seconds, gemini_calls, gemini_retries, gemini_fallbacks, gemini_outcomes,
+                     gemini_latency, gemini_breaker_transitions)
+
+GEMINI_MODEL = "gemini-2.5-flash"
+GEMINI_CONCURRENCY = int(os.getenv("GEMINI_CONCURRENCY", "8"))
+GEMINI_RETRIES = 3
+GEMINI_BUDGET_SECONDS = float(os.getenv("GEMINI_BUDGET_SECONDS", "20"))
+GEMINI_TIMEOUT_SECONDS = float(os.getenv("GEMINI_TIMEOUT_SECONDS", "15"))
+GEMINI_TIMEOUT_MIN_SECONDS = float(os.getenv("GEMINI_TIMEOUT_MIN_SECONDS", "3"))
+GEMINI_TIMEOUT_FACTOR = float(os.getenv("GEMINI_TIMEOUT_FACTOR", "3"))
+GEMINI_BACKOFF_BASE = 0.5
+GEMINI_BACKOFF_MAX = 4.0
+GEMINI_BREAKER_WINDOW = int(os.getenv("GEMINI_BREAKER_WINDOW", "20"))
+GEMINI_BREAKER_MIN_CALLS = int(os.getenv("GEMINI_BREAKER_MIN_CALLS", "5"))
+GEMINI_BREAKER_THRESHOLD = float(os.getenv("GEMINI_BREAKER_THRESHOLD", "0.5"))
+GEMINI_BREAKER_COOLDOWN_SECONDS = float(os.getenv("GEMINI_BREAKER_COOLDOWN_SECONDS", "30"))
+GEMINI_RATE_PER_SECOND = float(os.getenv("GEMINI_RATE_PER_SECOND", "10"))  # 0 disables the limiter
+GEMINI_RATE_BURST = int(os.getenv("GEMINI_RATE_BURST", str(GEMINI_CONCURRENCY)))
+
+# Error text of responses worth retrying; anything else is the request's own fault.
+TRANSIENT_ERRORS = ("503", "UNAVAILABLE", "429", "RESOURCE_EXHAUSTED", "500", "INTERNAL", "DEADLINE_EXCEEDED")
+
+ASSESSMENT_CONFIG = types.GenerateContentConfig(
+    response_mime_type="application/json",
+    response_schema=types.Schema(
+        type=types.Type.OBJECT,
+        properties={
+            "score": types.Schema(type=types.Type.NUMBER),
+            "reasoning": types.Schema(type=types.Type.STRING),
+        },
+        required=["score", "reasoning"],
+    ),
+)
+
+
+class CircuitBreaker:
+    """closed -> open on a high failure rate, open -> half_open after the cooldown,
+    half_open -> closed or open again on the outcome of a single probe."""
+
+    def __init__(self, window=GEMINI_BREAKER_WINDOW, min_calls=GEMINI_BREAKER_MIN_CALLS,
+                 threshold=GEMINI_BREAKER_THRESHOLD, cooldown=GEMINI_BREAKER_COOLDOWN_SECONDS,
+                 clock=time.monotonic):
+        self.min_calls = min_calls
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.clock = clock
+        self.state = "closed"
+        self._outcomes = deque(maxlen=window)
+        self._changed_at = clock()
+        self._lock = threading.Lock()
+
+    def _set(self, state):
+        self.state = state
+        self._changed_at = self.clock()
+        gemini_breaker_transitions.inc(state=state)
+        print(f"[!] Gemini circuit breaker {state}")
+
+    def allow(self):
+        """True if a request may be sent now; in half_open only the probe may."""
+        with self._lock:
+            if self.state == "closed":
+                return True
+            # A probe that never reported back (cancelled, budget spent) is replaced after a cooldown.
+            if self.clock() - self._changed_at >= self.cooldown:
+                self._set("half_open")
+                return True
+            return False
+
+    def record(self, ok):
+        with self._lock:
+            if self.state == "half_open":
+                self._outcomes.clear()
+                self._set("closed" if ok else "open")
+                return
+            if self.state == "open":
+                return
+            self._outcomes.append(ok)
+            failures = self._outcomes.count(False)
+            if len(self._outcomes) >= self.min_calls and failures / len(self._outcomes) >= self.threshold:
+                self._set("open")
+
+    def stats(self):
+        with self._lock:
+            total = len(self._outcomes)
+            return {
+                "state": self.state,
+                "seconds_in_state": self.clock() - self._changed_at,
+                "recent_calls": total,
+                "recent_error_rate": self._outcomes.count(False) / total if total else 0.0,
+            }
+
+
+class TokenBucket:
+    """Requests per second with bursts; used only from the Gemini loop thread."""
+
+    def __init__(self, rate=GEMINI_RATE_PER_SECOND, burst=GEMINI_RATE_BURST, clock=time.monotonic):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.clock = clock
+        self.tokens = float(self.burst)
+        self._updated = clock()
+
+    def reserve(self, max_wait):
+        """Take a token; returns the seconds to wait before using it, or None if longer than max_wait.
+
+        Tokens can go negative, so concurrent callers queue up behind each other.
+        """
+        if self.rate <= 0:
+            return 0.0
+        now = self.clock()
+        self.tokens = min(self.burst, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+        wait = max(0.0, (1 - self.tokens) / self.rate)
+        if wait > max_wait:
+            return None
+        self.tokens -= 1
+        return wait
+
+
+class AdaptiveTimeout:
+    """Per-attempt deadline from the p95 of recent successful latencies."""
+
+    def __init__(self, window=50, min_samples=10):
+        self.min_samples = min_samples
+        self._latencies = deque(maxlen=window)
+
+    def observe(self, seconds):
+        self._latencies.append(seconds)
+
+    def current(self):
+        if len(self._latencies) < self.min_samples:
+            return GEMINI_TIMEOUT_SECONDS
+        ordered = sorted(self._latencies)
+        p95 = ordered[min(len(ordered) - 1, int(0.95 * len(ordered)))]
+        return min(GEMINI_TIMEOUT_SECONDS, max(GEMINI_TIMEOUT_MIN_SECONDS, GEMINI_TIMEOUT_FACTOR * p95))
+
+
+_loop = None
+_loop_lock = threading.Lock()
+_semaphore = None
+breaker = CircuitBreaker()
+_limiter = None
+_timeouts = {}  # label -> AdaptiveTimeout
+
+
+def _get_loop():
+    """Start (once) the daemon thread that runs all async Gemini calls."""
+    global _loop, _semaphore, _limiter
+    with _loop_lock:
+        if _loop is None:
+            loop = asyncio.new_event_loop()
+            threading.Thread(target=loop.run_forever, name="gemini-loop", daemon=True).start()
+            _semaphore = asyncio.Semaphore(GEMINI_CONCURRENCY)
+            _limiter = TokenBucket()
+            _loop = loop
+    return _loop
+
+
+def _after_fork_in_child():
+    # The loop thread does not exist in a forked child; start a fresh one on demand.
+    global _loop, _loop_lock, _semaphore, _limiter, breaker
+    _loop, _semaphore, _limiter = None, None, None
+    _loop_lock = threading.Lock()
+    breaker = CircuitBreaker()
+    _timeouts.clear()
+
+
+os.register_at_fork(after_in_child=_after_fork_in_child)
+
+
+async def _call(contents, label, budget=GEMINI_BUDGET_SECONDS, config=None):
+    """One Gemini request through the resilience layer; returns the response or None."""
+    deadlines = _timeouts.setdefault(label, AdaptiveTimeout())
+    deadline = None  # set when the first attempt gets a slot
+    for attempt in range(GEMINI_RETRIES):
+        remaining = budget if deadline is None else deadline - time.monotonic()
+        if remaining < GEMINI_TIMEOUT_MIN_SECONDS:
+            gemini_outcomes.inc(label=label, outcome="budget")
+            return None
+        if not breaker.allow():
+            gemini_outcomes.inc(label=label, outcome="rejected")
+            return None
+        wait = _limiter.reserve(max_wait=remaining - GEMINI_TIMEOUT_MIN_SECONDS)
+        if wait is None:
+            gemini_outcomes.inc(label=label, outcome="budget")
+            return None
+        if wait:
+            stage_seconds.observe(wait, stage="gemini.rate_wait")
+            await asyncio.sleep(wait)
+
+        error, truncated = None, False
+        async with _semaphore:
+            if deadline is None:
+                deadline = time.monotonic() + budget
+            limit = deadlines.current()
+            timeout = min(limit, deadline - time.monotonic())
+            if timeout <= 0:
+                gemini_outcomes.inc(label=label, outcome="budget")
+                return None
+            gemini_calls.inc(label=label)
+            start = time.monotonic()
+            try:
+                resp = await asyncio.wait_for(
+                    models.get("gemini").aio.models.generate_content(
+                        model=GEMINI_MODEL, contents=contents, config=config),
+                    timeout)
+            except asyncio.TimeoutError:
+                error = f"no answer within {timeout:.1f}s"
+                # Cut short by our own budget rather than the service's deadline.
+                truncated = timeout < limit
+                gemini_outcomes.inc(label=label, outcome="budget" if truncated else "timeout")
+            except Exception as e:
+                error = str(e)
+                if not any(marker in error for marker in TRANSIENT_ERRORS):
+                    # The service answered; the request itself was bad.
+                    print(f"[!] Gemini {label} request failed: {error}")
+                    breaker.record(True)
+                    gemini_outcomes.inc(label=label, outcome="error")
+                    return None
+                gemini_outcomes.inc(label=label, outcome="transient")
+        if error is None:
+            elapsed = time.monotonic() - start
+            breaker.record(True)
+            deadlines.observe(elapsed)
+            gemini_latency.observe(elapsed, label=label)
+            gemini_outcomes.inc(label=label, outcome="ok")
+            return resp
+
+        if not truncated:
+            breaker.record(False)
+        print(f"[!] Gemini {label} attempt {attempt+1} failed: {error}")
+        backoff = random.uniform(0, min(GEMINI_BACKOFF_MAX, GEMINI_BACKOFF_BASE * 2 ** attempt))
+        if attempt + 1 == GEMINI_RETRIES or time.monotonic() + backoff + GEMINI_TIMEOUT_MIN_SECONDS > deadline:
+            break
+        gemini_retries.inc(label=label)
+        stage_seconds.observe(backoff, stage="gemini.retry_wait")
+        await asyncio.sleep(backoff)
+    print(f"[!] Gemini unavailable for {label}; using the local-only score.")
+    return None
+
+
+async def _assess(contents, label):
+    resp = await _call(contents, label, config=ASSESSMENT_CONFIG)
+    if resp is None:
+        return None
+    try:
+        data = json.loads(resp.text)
+        score = max(0.0, min(float(data["score"]), 1.0))
+    except (TypeError, ValueError, KeyError) as e:
+        print(f"[!] Gemini {label} returned an unusable answer: {e}")
+        return None
+    return score, str(data.get("reasoning", "")).strip()
+
+
+def submit_many(contents_list, label="request"):
+    """Start one structured request per item without waiting for the answers.
+
+    Returns a concurrent.futures.Future that resolves to the list assess_many()
+    would return, so callers can keep working while the requests are in flight.
+    """
+    loop = _get_loop()
+
+    async def run_all():
+        results = await asyncio.gather(*[_assess(c, label) for c in contents_list])
+        failed = sum(1 for r in results if r is None)
+        if failed:
+            gemini_fallbacks.inc(failed, label=label)
+        return results
+
+    return asyncio.run_coroutine_threadsafe(run_all(), loop)
+
+
+def assess_many(contents_list, label="request"):
+    """Run one structured request per item concurrently.
+
+    Returns a list aligned with contents_list holding (score, reasoning)
+    tuples, or None for items where Gemini failed.
+    """
+    if not contents_list:
+        return []
+    with span(f"{label}.gemini"):
+        return submit_many(contents_list, label).result()
+
+
+def assess(contents, label="request"):
+    return assess_many([contents], label=label)[0]
+
+
+def generate_text(prompt):
+    """Plain free-text generation; returns "" on failure."""
+    loop = _get_loop()
+    with span("gemini.generate"):
+        resp = asyncio.run_coroutine_threadsafe(_call([prompt], "generate"), loop).result()
+    if resp is None:
+        gemini_fallbacks.inc(label="generate")
+        return ""
+    return resp.text.strip()
+
+
+def stats():
+    """Breaker state, current per-attempt deadline and limiter settings."""
+    return {
+        "breaker": breaker.stats(),
+        "timeout_seconds": {label: t.current() for label, t in list(_timeouts.items())},
+        "budget_seconds": GEMINI_BUDGET_SECONDS,
+        "rate_per_second": GEMINI_RATE_PER_SECOND,
+        "rate_burst": GEMINI_RATE_BURST,
+    }
@@ -1,77 +1,207 @@
 # image_detector.py
 import os
-import requests
-from PIL import Image
 import torch
-from transformers import CLIPProcessor, CLIPModel
-from google import genai
-import time
-import random
+import models
+import cascade
+from gemini import assess_many, submit_many
+from image_loader import load_image
+from metrics import span
+from phash import near_duplicates
+from feature_store import feature_store, record_images
 
-# Load CLIP model for image heuristic
-clip_model = CLIPModel.from_pretrained("openai/clip-vit-base-patch32")
-clip_processor = CLIPProcessor.from_pretrained("openai/clip-vit-base-patch32")
+CLIP_BATCH_SIZE = int(os.getenv("CLIP_BATCH_SIZE", "16"))
 
-genai_client = genai.Client(api_key=os.getenv("GEMINI_API_KEY"))
+# Prompts scored against every image; indexes 1 and 2 are the AI-generated ones.
+AI_PROMPTS = (1, 2)
+CLIP_PROMPTS = [
+    "a real photograph of a person",
+    "an AI-generated image of a person",
+    "a computer-generated landscape",
+    "a real photo taken by a camera"
+]
+
+
+def encode_prompts(prompts):
+    """L2-normalized CLIP text embeddings for a list of prompts."""
+    clip_model, clip_processor = models.get("clip")
+    inputs = clip_processor(text=list(prompts), return_tensors="pt", padding=True)
+    with torch.inference_mode():
+        emb = clip_model.get_text_features(**inputs)
+    return emb / emb.norm(dim=-1, keepdim=True)
+
+
+# Run the CLIP text tower once and keep the prompt embeddings.
+models.register("clip_prompts", lambda: encode_prompts(CLIP_PROMPTS))
+
+GEMINI_IMAGE_PROMPT = (
+    "Rate from 0 to 1 how likely this image is AI-generated or a deepfake (0 = clearly real, "
+    "1 = clearly AI) as `score`. In `reasoning`, write a short (1-3 sentence) plain-language "
+    "explanation of whether the image is AI-generated or likely real, and list concrete visual "
+    "signals that support the conclusion."
+)
+
+def _ask_gemini(images):
+    """Gemini's (score, reasoning) per image, or None where it gave no answer."""
+    return assess_many([[GEMINI_IMAGE_PROMPT, load_image(img)] for img in images], label="image")
+
+def detect_gemini_images(images):
+    """Score and explain each image with one structured Gemini call, all in flight together.
+
+    Returns (score, reasoning) per image; failures fall back to (0.5, None).
+    """
+    return [res if res is not None else (0.5, None) for res in _ask_gemini(images)]
+
+def submit_gemini_images(images):
+    """Like _ask_gemini() but returns a future instead of waiting for the answers."""
+    return submit_many([[GEMINI_IMAGE_PROMPT, load_image(img)] for img in images], label="image")
 
 def detect_gemini_image(image_path_or_url):
     """Use Gemini to analyze the image with retries and fallback."""
-    for attempt in range(3):
-        try:
-            if image_path_or_url.startswith("http"):
-                image = Image.open(requests.get(image_path_or_url, stream=True).raw)
-            else:
-                image = Image.open(image_path_or_url)
-
-            prompt = (
-                "Rate from 0 to 1 how likely this image is AI-generated or a deepfake. "
-                "Respond with only a number."
-            )
-            resp = genai_client.models.generate_content(
-                model="gemini-2.5-flash",
-                contents=[prompt, image],
-            )
-            raw = resp.text.strip()
-            score = float(raw)
-            return max(0.0, min(score, 1.0))
-        except Exception as e:
-            err_msg = str(e)
-            print(f"[!] Gemini image attempt {attempt+1} failed: {err_msg}")
-            if "503" in err_msg or "UNAVAILABLE" in err_msg:
-                wait = random.uniform(2, 5)
-                print(f"Waiting {wait:.1f}s before retry...")
-                time.sleep(wait)
-                continue
-            return 0.5
-    print("[!] Gemini service unavailable after retries; using fallback score.")
-    return 0.5
-
-def detect_ai_image(image_path_or_url):
-    # Load image for CLIP
-    if image_path_or_url.startswith("http"):
-        image = Image.open(requests.get(image_path_or_url, stream=True).raw)
-    else:
-        image = Image.open(image_path_or_url)
+    return detect_gemini_images([image_path_or_url])[0]
+
+def clip_pixel_values(images):
+    """Preprocess a batch of PIL images into the CLIP vision tower's input tensor."""
+    _, clip_processor = models.get("clip")
+    batch = [img if img.mode == "RGB" else img.convert("RGB") for img in images]
+    return clip_processor(images=batch, return_tensors="pt")["pixel_values"]
+
+def clip_embeddings_from_pixels(pixel_values):
+    """L2-normalized CLIP image embeddings for a batch already run through clip_pixel_values()."""
+    clip_model, _ = models.get("clip")
+    with torch.inference_mode():
+        emb = clip_model.get_image_features(pixel_values=pixel_values)
+        return emb / emb.norm(dim=-1, keepdim=True)
+
+def prompt_probs(embeddings):
+    """Probability of each CLIP prompt for every row of normalized image embeddings."""
+    clip_model, _ = models.get("clip")
+    with torch.inference_mode():
+        logits = clip_model.logit_scale.exp() * embeddings @ models.get("clip_prompts").T
+        return logits.softmax(dim=1).tolist()
+
+def clip_embeddings(images, batch_size=None):
+    """Normalized CLIP image embeddings as one (n, dim) tensor, running the vision tower in batches."""
+    batch_size = batch_size or CLIP_BATCH_SIZE
+    return torch.cat([clip_embeddings_from_pixels(clip_pixel_values(images[start:start + batch_size]))
+                      for start in range(0, len(images), batch_size)])
+
+def clip_probs(images, batch_size=None):
+    """Prompt probabilities for each image."""
+    if not images:
+        return []
+    return prompt_probs(clip_embeddings(images, batch_size))
+
+def clip_ai_likelihood(probs):
+    """Mean probability of the AI-generated prompts (AI_PROMPTS); the CLIP part of the ensemble."""
+    return sum(probs[i] for i in AI_PROMPTS) / len(AI_PROMPTS)
+
+def clip_local_score(probs):
+    """Total probability of the AI-generated prompts, in [0, 1]; the score CLIP decides alone on."""
+    return sum(probs[i] for i in AI_PROMPTS)
+
+def local_image_scores(images, batch_size=None):
+    """CLIP-only local score per image (paths, URLs or PIL images), as the cascade sees it."""
+    loaded = [load_image(src) for src in images]
+    return [clip_local_score(p) for p in clip_probs(loaded, batch_size=batch_size)]
+
+def detect_ai_images(images, batch_size=None, cascade_mode=None):
+    """Score many images (paths, URLs or PIL images) with one batched CLIP pass.
+
+    Returns one result dict per input, in order, shaped like detect_ai_image().
+    With the cascade on (IMAGE_CASCADE=on or cascade_mode=True), only images
+    whose CLIP score is inside the uncertainty band are sent to Gemini.
+    Near-duplicates of already scored images (see phash.py) reuse that result
+    and carry a near_duplicate entry with the Hamming distance.
+    """
+    band = cascade.band_for("image", cascade_mode)
+    with span("image.total"):
+        # Fetch and decode each input exactly once; CLIP and Gemini share the result.
+        with span("image.decode"):
+            loaded = [load_image(src) for src in images]
+        results, fresh = reuse_near_duplicates(loaded)
+        if fresh:
+            todo = [loaded[i] for i in fresh]
+            with span("image.clip"):
+                embeddings = clip_embeddings(todo, batch_size=batch_size)
+                all_probs = prompt_probs(embeddings)
+            escalate = cascade.split("image", [clip_local_score(p) for p in all_probs], band)
+            gemini_results = dict(zip(escalate, _ask_gemini([todo[i] for i in escalate])))
+        else:
+            embeddings, all_probs, gemini_results = None, [], {}
+        return finish_image_batch(loaded, results, fresh, all_probs, gemini_results, band, embeddings)
 
-    texts = [
-        "a real photograph of a person",
-        "an AI-generated image of a person",
-        "a computer-generated landscape",
-        "a real photo taken by a camera"
-    ]
-    inputs = clip_processor(text=texts, images=image, return_tensors="pt", padding=True)
-    outputs = clip_model(**inputs)
-    logits = outputs.logits_per_image
-    probs = logits.softmax(dim=1)[0].tolist()
+def finish_image_batch(loaded, results, fresh, all_probs, gemini_results, band, embeddings=None):
+    """Fill in results for the fresh items and resolve in-batch near-duplicates.
 
-    ai_likelihood_clip = (probs[1] + probs[2]) / 2.0
+    all_probs is aligned with fresh; gemini_results maps a position in fresh
+    to its (score, reasoning), or None where Gemini failed, in which case the
+    item falls back to its CLIP-only score. Fresh items the caller already
+    scored with score_fresh_image() keep that result. Fresh results are
+    added to the near-duplicate index and, with their CLIP embeddings
+    (aligned with fresh), to the feature store, except those Gemini could
+    not score.
+    """
+    kept = []
+    for pos, (i, probs) in enumerate(zip(fresh, all_probs)):
+        if results[i] is None:
+            results[i] = score_fresh_image(probs, gemini_results, pos, band)
+        if not (pos in gemini_results and gemini_results[pos] is None):
+            near_duplicates.add(loaded[i].info["phash"], results[i])
+            kept.append(pos)
+    if feature_store.enabled and embeddings is not None and kept:
+        clip_model, _ = models.get("clip")
+        record_images([loaded[fresh[pos]] for pos in kept], embeddings[kept],
+                      [gemini_results[pos][0] if pos in gemini_results else None for pos in kept],
+                      (CLIP_PROMPTS, models.get("clip_prompts"), clip_model.logit_scale.exp().item(), AI_PROMPTS))
+    resolve_batch_duplicates(results)
+    return results
 
-    gemini_score = detect_gemini_image(image_path_or_url)
+def score_fresh_image(probs, gemini_results, pos, band):
+    """Result for fresh item pos of a batch (see finish_image_batch)."""
+    unavailable = pos in gemini_results and gemini_results[pos] is None
+    return _score_image(probs, gemini_results.get(pos), band, unavailable)
+
+def resolve_batch_duplicates(results):
+    """Fill in items that matched an earlier item of the same batch, once that one is scored."""
+    for i, res in enumerate(results):
+        if isinstance(res, tuple) and isinstance(results[res[0]], dict):
+            results[i] = dict(results[res[0]], near_duplicate={"distance": res[1], "source": "batch"})
+
+def reuse_near_duplicates(loaded):
+    """Fill results for images within the index's distance of a scored one.
+
+    Returns (results, fresh): results[i] is a reused dict, an (index, distance)
+    pointer to an earlier image of this batch, or None; fresh lists the
+    indexes that still need scoring.
+    """
+    results = [None] * len(loaded)
+    fresh = []
+    for i, image in enumerate(loaded):
+        match = near_duplicates.lookup(image.info["phash"],
+                                       pending=[(loaded[j].info["phash"], j) for j in fresh])
+        if match is None:
+            fresh.append(i)
+            continue
+        distance, found = match
+        if isinstance(found, int):
+            results[i] = (found, distance)
+        else:
+            results[i] = dict(found, near_duplicate={"distance": distance, "source": "index"})
+    return results, fresh
+
+def detect_ai_image(image_path_or_url, cascade_mode=None):
+    return detect_ai_images([image_path_or_url], cascade_mode=cascade_mode)[0]
+
+def _score_image(probs, gemini_result, band=None, unavailable=False):
+    ai_likelihood_clip = clip_ai_likelihood(probs)
+    if gemini_result is None:
+        return _score_image_locally(probs, ai_likelihood_clip, band, unavailable)
+    gemini_score, gemini_reasoning = gemini_result
 
     final_score = (ai_likelihood_clip * 0.3) + (gemini_score * 0.7)
 
     print("\n--- IMAGE AI DETECTION ---")
-    for txt, p in zip(texts, probs):
+    for txt, p in zip(CLIP_PROMPTS, probs):
         print(f"{txt:45s} -> {p*100:.2f}%")
     print(f"\nCLIP AI-likelihood : {ai_likelihood_clip*100:.2f}%")
     print(f"Gemini score       : {gemini_score*100:.2f}%")
@@ -89,20 +219,8 @@ def detect_ai_image(image_path_or_url):
     )
 
     reasoning = fallback_reasoning
-    try:
-        prompt = (
-            "Write a short (1-3 sentence) plain-language explanation of whether the following image "
-            "is AI-generated or likely real, and list concrete visual signals that support the conclusion.\n\n"
-        )
-        resp = genai_client.models.generate_content(
-            model="gemini-2.5-flash",
-            contents=[prompt, Image.open(image_path_or_url) if not image_path_or_url.startswith('http') else Image.open(requests.get(image_path_or_url, stream=True).raw)],
-        )
-        gen_text = resp.text.strip()
-        if gen_text:
-            reasoning = gen_text + "\n\nComponent summary: " + fallback_reasoning
-    except Exception as e:
-        print(f"[!] Gemini image reasoning failed: {e}")
+    if gemini_reasoning:
+        reasoning = gemini_reasoning + "\n\nComponent summary: " + fallback_reasoning
 
     result = {
         'final_score': final_score,
@@ -111,5 +229,45 @@ def detect_ai_image(image_path_or_url):
         'reasoning': reasoning,
         'is_ai': final_score > 0.5,
     }
+    if band is not None:
+        result['escalated'] = True
+
+    return result
+
+def _score_image_locally(probs, ai_likelihood_clip, band, unavailable=False):
+    """Result for an image answered from CLIP alone: decided by the cascade, or Gemini unavailable."""
+    local_score = clip_local_score(probs)
+    is_ai = local_score > 0.5
+    verdict = 'likely AI-generated' if is_ai else 'likely real'
 
+    print("\n--- IMAGE AI DETECTION (local) ---")
+    for txt, p in zip(CLIP_PROMPTS, probs):
+        print(f"{txt:45s} -> {p*100:.2f}%")
+    print(f"\nFinal AI-likelihood: {local_score*100:.2f}% "
+          f"(CLIP only, Gemini {'unavailable' if unavailable else 'skipped'})")
+
+    best = max(range(len(CLIP_PROMPTS)), key=lambda i: probs[i])
+    evidence = (
+        f"The image matches \"{CLIP_PROMPTS[best]}\" most closely ({probs[best]*100:.2f}%), and the "
+        f"AI-generated prompts together get {local_score*100:.2f}%"
+    )
+    if unavailable:
+        reasoning = f"Gemini could not be reached, so CLIP decided alone. {evidence}, so the image is {verdict}."
+    else:
+        low, high = band
+        reasoning = (
+            f"CLIP was decisive, so Gemini was not consulted. {evidence}, outside the "
+            f"{low*100:.0f}-{high*100:.0f}% uncertainty band, so the image is {verdict}."
+        )
+    result = {
+        'final_score': local_score,
+        'clip': ai_likelihood_clip,
+        'gemini': None,
+        'reasoning': reasoning,
+        'is_ai': is_ai,
+    }
+    if band is not None:
+        result['escalated'] = unavailable
+    if unavailable:
+        result['gemini_unavailable'] = True
     return result
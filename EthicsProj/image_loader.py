@@ -0,0 +1,88 @@
+# image_loader.py
+"""Single image-loading stage shared by CLIP and Gemini.
+
+URLs are fetched once over a pooled keep-alive session with timeouts and a
+size cap. Every image is decoded once, straight to RGB, and large JPEGs use
+PIL draft mode so the decoder downscales while decoding instead of
+materializing the full-resolution bitmap. The returned PIL image is what
+every later consumer should use; its perceptual hash is stored in
+image.info["phash"] for near-duplicate lookups (see phash.py).
+"""
+import io
+import os
+
+import requests
+from PIL import Image
+from requests.adapters import HTTPAdapter
+
+from phash import perceptual_hash
+
+IMAGE_MAX_BYTES = int(os.getenv("IMAGE_MAX_BYTES", str(20 * 1024 * 1024)))
+# Longest side kept after decoding. CLIP resizes to 224 anyway; this leaves
+# Gemini enough detail to judge artifacts.
+IMAGE_MAX_SIDE = int(os.getenv("IMAGE_MAX_SIDE", "1024"))
+IMAGE_CONNECT_TIMEOUT = float(os.getenv("IMAGE_CONNECT_TIMEOUT", "5"))
+IMAGE_READ_TIMEOUT = float(os.getenv("IMAGE_READ_TIMEOUT", "15"))
+
+
+class ImageLoadError(ValueError):
+    """Raised when an image cannot be fetched or is over the size limit."""
+
+
+def _make_session():
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=16, pool_maxsize=32, max_retries=2)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    session.headers["User-Agent"] = "AI-Media-Detector/1.0"
+    return session
+
+
+http_session = _make_session()
+
+
+def _after_fork_in_child():
+    # Pooled connections must not be shared with the parent process.
+    global http_session
+    http_session = _make_session()
+
+
+os.register_at_fork(after_in_child=_after_fork_in_child)
+
+
+def fetch_bytes(url, max_bytes=IMAGE_MAX_BYTES):
+    """Download url over the shared session, refusing bodies larger than max_bytes."""
+    with http_session.get(url, stream=True,
+                          timeout=(IMAGE_CONNECT_TIMEOUT, IMAGE_READ_TIMEOUT)) as resp:
+        resp.raise_for_status()
+        length = resp.headers.get("Content-Length")
+        if length and length.isdigit() and int(length) > max_bytes:
+            raise ImageLoadError(f"Image at {url} is {int(length)} bytes (limit {max_bytes})")
+        buf = io.BytesIO()
+        for chunk in resp.iter_content(chunk_size=64 * 1024):
+            buf.write(chunk)
+            if buf.tell() > max_bytes:
+                raise ImageLoadError(f"Image at {url} exceeds {max_bytes} bytes")
+    buf.seek(0)
+    return buf
+
+
+def load_image(src, max_side=IMAGE_MAX_SIDE):
+    """Fetch (if needed) and decode src once into an RGB PIL image of at most max_side.
+
+    src may be a local path, an http(s) URL, or an already-loaded PIL image,
+    which is returned unchanged apart from gaining its hash.
+    """
+    if isinstance(src, Image.Image):
+        if "phash" not in src.info:
+            src.info["phash"] = perceptual_hash(src)
+        return src
+    # convert() returns a new image, so the file (or buffer) can be closed right after decoding.
+    with Image.open(fetch_bytes(src) if src.startswith("http") else src) as source:
+        # JPEG only: lets libjpeg decode at 1/2, 1/4 or 1/8 scale, never below max_side
+        source.draft("RGB", (max_side, max_side))
+        image = source.convert("RGB")
+    if max(image.size) > max_side:
+        image.thumbnail((max_side, max_side), Image.LANCZOS)
+    image.info["phash"] = perceptual_hash(image)
+    return image
@@ -0,0 +1,253 @@
+# jobs.py
+"""Background job queue for text, image and video analyses.
+
+Routes submit work and get a job id back right away; a thread or process pool
+runs the detectors. JOB_POOL=prefork loads the models once in this process and
+then forks the workers, so they share the weights copy-on-write instead of
+each holding a private copy; each worker gets an even share of the cores for
+torch intra-op threads. The number of queued + running jobs is capped so a burst
+of uploads is turned away (QueueFull -> HTTP 429) instead of piling up.
+
+Each job keeps an ordered list of progress events (streamed to browsers as
+server-sent events) and a cancel flag. Both reach the detector only with the
+thread pool; process-pool jobs publish just their final event and can only be
+cancelled while still queued.
+"""
+import gc
+import multiprocessing
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+JOB_POOL = os.getenv("JOB_POOL", "thread")  # "thread", "process" or "prefork"
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+JOB_QUEUE_SIZE = int(os.getenv("JOB_QUEUE_SIZE", "16"))
+JOB_RETENTION_SECONDS = int(os.getenv("JOB_RETENTION_SECONDS", "3600"))
+# Models prefork workers start with: weights loaded once in the parent, see _FORWARD_PASS_MODELS.
+PREFORK_MODELS = os.getenv("PREFORK_MODELS", "roberta,clip,clip_prompts")
+# Registry entries built by a forward pass. Running one in the parent would start
+# torch's OpenMP pool, which deadlocks in forked children, so workers build these.
+_FORWARD_PASS_MODELS = ("clip_prompts",)
+# Mirrors backends.INFERENCE_BACKEND. Preparing the int8 and onnx backends runs
+# quantization, ONNX export (a traced forward pass) and ONNX Runtime sessions
+# with their own thread pools, so with those backends roberta and clip are
+# built in the workers too and only the torch backend shares weights.
+INFERENCE_BACKEND = os.getenv("INFERENCE_BACKEND", "torch")
+_BACKEND_MODELS = ("roberta", "clip")
+# Torch threads per prefork worker; 0 splits the CPU cores evenly between workers.
+WORKER_TORCH_THREADS = int(os.getenv("WORKER_TORCH_THREADS", "0"))
+
+# Last event a job publishes; one of these always ends its event stream. Not "error",
+# which EventSource also fires on connection drops.
+TERMINAL_EVENTS = ("done", "failed", "cancelled")
+
+
+class QueueFull(Exception):
+    """Raised when the job queue is at capacity."""
+
+
+def run_analysis(kind, arg, progress=None, cancel_event=None):
+    """Run one detector. Module-level so it can be pickled into a process pool.
+
+    progress(event, data) and cancel_event are passed to detectors that report
+    incremental results (currently video).
+    """
+    if kind == "text":
+        from text_detector import detect_ai_text
+        return detect_ai_text(arg)
+    if kind == "image":
+        from image_detector import detect_ai_image
+        return detect_ai_image(arg)
+    if kind == "video":
+        from video_detector import detect_ai_video
+        return detect_ai_video(arg, on_progress=progress, cancel_event=cancel_event)
+    raise ValueError(f"Unknown analysis kind: {kind}")
+
+
+def _init_worker(torch_threads, model_names=()):
+    import torch
+    torch.set_num_threads(torch_threads)
+    if model_names:
+        import models
+        import image_detector  # registers "clip_prompts"
+        models.warmup(model_names)
+    print(f"[jobs] Worker {os.getpid()} ready ({torch_threads} torch threads)")
+
+
+def _worker_models():
+    """Registry entries that must not be built before the fork."""
+    if INFERENCE_BACKEND == "torch":
+        return _FORWARD_PASS_MODELS
+    return _FORWARD_PASS_MODELS + _BACKEND_MODELS
+
+
+def _worker_pid():
+    return os.getpid()
+
+
+def make_prefork_executor(workers, model_names=PREFORK_MODELS, torch_threads=WORKER_TORCH_THREADS):
+    """Load the weights of model_names here, then fork `workers` processes that inherit them.
+
+    Only weights are loaded before the fork; entries that need a forward pass
+    (_FORWARD_PASS_MODELS), and with a non-torch INFERENCE_BACKEND the
+    backend-prepared models, are built in each worker. All workers are forked
+    immediately, before this process starts serving, and gc.freeze() keeps
+    the collector from touching (and so copying) the inherited objects in
+    the children.
+    """
+    import models
+    import image_detector  # registers "clip_prompts"
+    names = [name.strip() for name in model_names.split(",") if name.strip()]
+    in_workers = [name for name in names if name in _worker_models()]
+    models.warmup([name for name in names if name not in in_workers])
+    torch_threads = torch_threads or max(1, (os.cpu_count() or 1) // workers)
+    gc.freeze()
+    executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("fork"),
+                                   initializer=_init_worker, initargs=(torch_threads, in_workers))
+    # With the fork start method the pool forks every worker on the first submit.
+    executor.submit(_worker_pid).result()
+    return executor
+
+
+class Job:
+    def __init__(self, kind, meta=None):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.meta = meta or {}
+        self.status = "queued"
+        self.result = None
+        self.error = None
+        self.created = time.time()
+        self.finished = None
+        self.future = None
+        self.cancel_event = threading.Event()
+        self.events = []  # (event, data) in publish order
+        self._events_cond = threading.Condition()
+
+    def publish(self, event, data):
+        with self._events_cond:
+            self.events.append((event, data))
+            self._events_cond.notify_all()
+
+    def events_since(self, index, timeout):
+        """Events after the first index ones, waiting up to timeout if there are none yet."""
+        with self._events_cond:
+            if len(self.events) <= index:
+                self._events_cond.wait(timeout)
+            return self.events[index:]
+
+    def current_status(self):
+        if self.status == "queued" and self.future is not None and self.future.running():
+            return "running"
+        return self.status
+
+    def to_dict(self):
+        data = {
+            "id": self.id,
+            "kind": self.kind,
+            "status": self.current_status(),
+            "created": self.created,
+            "finished": self.finished,
+        }
+        if self.status == "done":
+            data["result"] = self.result
+        elif self.status == "failed":
+            data["error"] = self.error
+        return data
+
+
+class JobManager:
+    def __init__(self, pool=JOB_POOL, workers=JOB_WORKERS, queue_size=JOB_QUEUE_SIZE,
+                 retention=JOB_RETENTION_SECONDS):
+        if pool == "prefork":
+            self.executor = make_prefork_executor(workers)
+        elif pool == "process":
+            self.executor = ProcessPoolExecutor(max_workers=workers)
+        else:
+            self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.retention = retention
+        # Progress events and cancellation only reach jobs running in this process.
+        self.live_events = isinstance(self.executor, ThreadPoolExecutor)
+        self._slots = threading.BoundedSemaphore(queue_size)
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def submit(self, kind, arg, meta=None, on_done=None):
+        """Queue run_analysis(kind, arg). on_done(job) runs in this process when it succeeds."""
+        if not self._slots.acquire(blocking=False):
+            raise QueueFull(f"{kind} queue is full")
+        job = Job(kind, meta)
+        self._add(job)
+        hooks = (job.publish, job.cancel_event) if self.live_events else ()
+        try:
+            future = self.executor.submit(run_analysis, kind, arg, *hooks)
+        except Exception:
+            self._slots.release()
+            raise
+
+        def finish(fut):
+            try:
+                if fut.cancelled():
+                    job.status = "cancelled"
+                    return
+                job.result = fut.result()
+            except Exception as e:
+                if job.cancel_event.is_set():
+                    job.status = "cancelled"
+                else:
+                    job.error = str(e)
+                    job.status = "failed"
+                    print(f"[!] Job {job.id} ({kind}) failed: {e}")
+            else:
+                job.status = "done"
+                if on_done is not None:
+                    try:
+                        on_done(job)
+                    except Exception as e:
+                        print(f"[!] Job {job.id} completion hook failed: {e}")
+            finally:
+                job.finished = time.time()
+                self._slots.release()
+                job.publish(job.status, job.result if job.status == "done" else {"error": job.error})
+
+        job.future = future
+        future.add_done_callback(finish)
+        return job
+
+    def complete(self, kind, result, meta=None):
+        """Record an already-known result (e.g. a cache hit) as a finished job."""
+        job = Job(kind, meta)
+        job.result = result
+        job.status = "done"
+        job.finished = time.time()
+        job.publish("done", result)
+        self._add(job)
+        return job
+
+    def cancel(self, job_id):
+        """Ask a job to stop. Queued jobs never start; running ones stop at their next checkpoint."""
+        job = self.get(job_id)
+        if job is None or job.status in TERMINAL_EVENTS:
+            return job
+        job.cancel_event.set()
+        if job.future is not None:
+            job.future.cancel()
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def _add(self, job):
+        now = time.time()
+        with self._lock:
+            expired = [jid for jid, j in self._jobs.items()
+                       if j.finished is not None and now - j.finished > self.retention]
+            for jid in expired:
+                del self._jobs[jid]
+            self._jobs[job.id] = job
+
+
+job_manager = JobManager()
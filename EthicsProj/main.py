@@ -1,10 +1,29 @@
 # main.py
+import argparse
+import os
 from text_detector import detect_ai_text
 from image_detector import detect_ai_image
 from scraper import extract_text_from_url
 from video_detector import detect_ai_video
+from cache import result_cache, content_key, file_key
+from metrics import collect_timings, format_timings
 
-def main():
+def run_cached(kind, key, detect, show_timings=False):
+    """Serve a previous result for the same content, otherwise run the detector."""
+    result = result_cache.get(key)
+    if result is not None:
+        print(f"\n[cache] Reusing previous {kind} analysis.")
+        print(f"Final AI-likelihood: {result.get('final_score', 0.0)*100:.2f}%")
+        return result
+    with collect_timings() as timings:
+        result = detect()
+    if show_timings:
+        print("\n" + format_timings(timings))
+    if isinstance(result, dict):
+        result_cache.put(key, kind, result)
+    return result
+
+def main(show_timings=False):
     print("=== AI Media Detector CLI ===")
     print("1. Analyze text/article")
     print("2. Analyze image/photo")
@@ -21,17 +40,42 @@ def main():
                 return
         else:
             text = user_input
-        detect_ai_text(text)
+        run_cached("text", content_key("text", text), lambda: detect_ai_text(text), show_timings)
 
     elif choice == "2":
         image_input = input("Enter local image path or image URL:\n> ").strip()
-        detect_ai_image(image_input)
+        if image_input.startswith("http"):
+            key = content_key("image", image_input)
+        else:
+            key = file_key("image", image_input)
+        run_cached("image", key, lambda: detect_ai_image(image_input), show_timings)
     elif choice == "3":
         video_input = input("Enter local video path:\n> ").strip()
-        detect_ai_video(video_input)
+        run_cached("video", file_key("video", video_input), lambda: detect_ai_video(video_input), show_timings)
 
     else:
         print("[!] Invalid option. Exiting.")
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="AI Media Detector CLI")
+    parser.add_argument("--timings", action="store_true",
+                        help="print a per-stage timing breakdown after each analysis")
+    parser.add_argument("--scan", metavar="SOURCE",
+                        help="analyze every item in a directory tree or JSONL manifest, non-interactively")
+    parser.add_argument("--out", default="scan_results.jsonl",
+                        help="JSONL results file for --scan; also the resume checkpoint")
+    parser.add_argument("--workers", type=int, default=None, help="parallel batches for --scan")
+    parser.add_argument("--batch-size", type=int, default=None, help="texts/images per batch for --scan")
+    parser.add_argument("--restart", action="store_true", help="ignore (and overwrite) an existing --out")
+    parser.add_argument("--feature-store", default=None, metavar="DIR",
+                        help="feature store for --scan (default: <out>.features; 'off' disables recording)")
+    args = parser.parse_args()
+    if args.scan:
+        from scan import run_scan, SCAN_WORKERS, SCAN_BATCH_SIZE
+        from feature_store import feature_store
+        store_dir = args.feature_store or os.path.splitext(args.out)[0] + ".features"
+        feature_store.use(store_dir, enabled=store_dir != "off" and feature_store.enabled)
+        run_scan(args.scan, args.out, workers=args.workers or SCAN_WORKERS,
+                 batch_size=args.batch_size or SCAN_BATCH_SIZE, resume=not args.restart)
+    else:
+        main(show_timings=args.timings)
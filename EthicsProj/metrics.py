@@ -0,0 +1,173 @@
+# metrics.py
+"""Lightweight stage timing and Prometheus-format metrics.
+
+Wrap pipeline stages in `with span("image.clip"):`. Every span feeds the
+aimd_stage_seconds histogram, and when a caller has opened
+`collect_timings()` the span is also recorded in that caller's per-request
+breakdown (used by the CLI's --timings flag). Counters cover Gemini calls,
+retries, outcomes, circuit-breaker changes, fallbacks to the local-only score
+and confidence-cascade decisions.
+
+Metrics live in-process: with JOB_POOL=process or prefork each worker keeps its own.
+"""
+import contextvars
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+_registry = []
+
+
+def _label_str(labelnames, values, extra=None):
+    pairs = list(zip(labelnames, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    escaped = [(k, str(v).replace("\\", "\\\\").replace('"', '\\"')) for k, v in pairs]
+    return "{" + ",".join(f'{k}="{v}"' for k, v in escaped) + "}"
+
+
+class Counter:
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def inc(self, amount=1.0, **labels):
+        key = tuple(labels.get(n, "") for n in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels):
+        return self._values.get(tuple(labels.get(n, "") for n in self.labelnames), 0.0)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_label_str(self.labelnames, key)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._series = {}  # labels -> [bucket counts, sum, count]
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(n, "") for n in self.labelnames)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][i] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, (counts, total, count) in sorted(self._series.items()):
+                for bound, c in zip(self.buckets, counts):
+                    lines.append(f"{self.name}_bucket{_label_str(self.labelnames, key, ('le', bound))} {c}")
+                lines.append(f"{self.name}_bucket{_label_str(self.labelnames, key, ('le', '+Inf'))} {count}")
+                lines.append(f"{self.name}_sum{_label_str(self.labelnames, key)} {total}")
+                lines.append(f"{self.name}_count{_label_str(self.labelnames, key)} {count}")
+        return lines
+
+
+stage_seconds = Histogram("aimd_stage_seconds", "Time spent in each pipeline stage.", ["stage"])
+gemini_calls = Counter("aimd_gemini_calls_total", "Gemini requests sent, including retries.", ["label"])
+gemini_retries = Counter("aimd_gemini_retries_total",
+                         "Gemini requests retried after a timeout or transient error.", ["label"])
+gemini_fallbacks = Counter("aimd_gemini_fallbacks_total",
+                           "Items scored without Gemini because it failed or the breaker was open.", ["label"])
+gemini_outcomes = Counter("aimd_gemini_outcomes_total",
+                          "Gemini attempts by outcome: ok, timeout, transient, error, rejected (breaker "
+                          "open) or budget (latency budget spent).", ["label", "outcome"])
+gemini_latency = Histogram("aimd_gemini_latency_seconds", "Latency of Gemini attempts that got an answer.",
+                           ["label"])
+gemini_breaker_transitions = Counter("aimd_gemini_breaker_transitions_total",
+                                     "Gemini circuit breaker state changes.", ["state"])
+video_frames_scored = Histogram("aimd_video_frames_scored", "Frames scored per analyzed video.",
+                                ["sampling"], buckets=(1, 2, 4, 8, 12, 16, 24, 32, 48, 64, 96))
+phash_lookups = Counter("aimd_phash_lookups_total",
+                        "Near-duplicate index lookups: result reused or missed.", ["outcome"])
+phash_distance = Histogram("aimd_phash_nearest_distance",
+                           "Hamming distance to the nearest indexed hash within the reuse radius, or "
+                           "the probe radius on sampled probe lookups (phash.py).",
+                           buckets=(0, 1, 2, 3, 4, 5, 6, 8, 10, 12, 16))
+cascade_decisions = Counter("aimd_cascade_decisions_total",
+                            "Cascade decisions: answered from local models or escalated to Gemini.",
+                            ["label", "decision"])
+
+def _after_fork_in_child():
+    # A lock held by another thread at fork time would never be released in the child.
+    for metric in _registry:
+        metric._lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_after_fork_in_child)
+
+_timings = contextvars.ContextVar("aimd_timings", default=None)
+
+
+@contextmanager
+def span(stage):
+    """Time a block as `stage`; nested spans are recorded independently."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        stage_seconds.observe(elapsed, stage=stage)
+        timings = _timings.get()
+        if timings is not None:
+            timings.append((stage, elapsed))
+
+
+@contextmanager
+def collect_timings():
+    """Collect (stage, seconds) pairs for spans run in this thread/context."""
+    timings = []
+    token = _timings.set(timings)
+    try:
+        yield timings
+    finally:
+        _timings.reset(token)
+
+
+def format_timings(timings):
+    """Per-stage totals as a printable table, in first-seen order."""
+    totals = {}
+    counts = {}
+    for stage, seconds in timings:
+        totals[stage] = totals.get(stage, 0.0) + seconds
+        counts[stage] = counts.get(stage, 0) + 1
+    lines = ["--- TIMING BREAKDOWN ---"]
+    for stage, seconds in totals.items():
+        suffix = f" ({counts[stage]} calls)" if counts[stage] > 1 else ""
+        lines.append(f"{stage:24s} {seconds*1000:10.1f} ms{suffix}")
+    return "\n".join(lines)
+
+
+def render():
+    """All metrics in the Prometheus text exposition format."""
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,108 @@
+# models.py
+"""Lazy, shared model registry.
+
+Nothing heavy is loaded at import time: each model is built by its loader the
+first time get() asks for it and is then shared by every detector in the
+process. Load times are recorded so slow cold starts are visible.
+
+Loaded models survive a fork (see jobs.py prefork workers); entries in
+FORK_UNSAFE hold network connections and are rebuilt in the child instead.
+"""
+import os
+import threading
+import time
+
+_loaders = {}
+_instances = {}
+_locks = {}
+_registry_lock = threading.Lock()
+load_times = {}
+FORK_UNSAFE = {"gemini"}
+
+
+def register(name, loader):
+    """Register a zero-argument loader for `name`."""
+    with _registry_lock:
+        _loaders[name] = loader
+        _locks.setdefault(name, threading.Lock())
+
+
+def get(name):
+    """Return the shared instance for `name`, loading it on first use."""
+    if name in _instances:
+        return _instances[name]
+    if name not in _loaders:
+        raise KeyError(f"No model registered under {name!r}")
+    with _locks[name]:
+        if name not in _instances:
+            start = time.perf_counter()
+            _instances[name] = _loaders[name]()
+            load_times[name] = time.perf_counter() - start
+            print(f"[models] Loaded {name} in {load_times[name]:.2f}s")
+    return _instances[name]
+
+
+def override(name, instance):
+    """Install a ready-made instance (e.g. a stand-in client for benchmarks)."""
+    with _registry_lock:
+        _locks.setdefault(name, threading.Lock())
+        _instances[name] = instance
+
+
+def is_loaded(name):
+    return name in _instances
+
+
+def warmup(names):
+    """Load the given models now instead of on the first request."""
+    for name in names:
+        name = name.strip()
+        if name:
+            get(name)
+
+
+def stats():
+    return {
+        "registered": sorted(_loaders),
+        "loaded": sorted(_instances),
+        "load_seconds": dict(load_times),
+    }
+
+
+def _load_roberta():
+    from transformers import AutoTokenizer, AutoModelForSequenceClassification
+    from backends import prepare_roberta
+    tokenizer = AutoTokenizer.from_pretrained("roberta-base-openai-detector", use_fast=True)
+    model = AutoModelForSequenceClassification.from_pretrained("roberta-base-openai-detector")
+    model.eval()
+    return tokenizer, prepare_roberta(model)
+
+
+def _load_clip():
+    from transformers import CLIPProcessor, CLIPModel
+    from backends import prepare_clip
+    model = CLIPModel.from_pretrained("openai/clip-vit-base-patch32")
+    processor = CLIPProcessor.from_pretrained("openai/clip-vit-base-patch32")
+    model.eval()
+    return prepare_clip(model), processor
+
+
+def _load_gemini():
+    from google import genai
+    return genai.Client(api_key=os.getenv("GEMINI_API_KEY"))
+
+
+def _after_fork_in_child():
+    global _registry_lock
+    _registry_lock = threading.Lock()
+    for name in list(_locks):
+        _locks[name] = threading.Lock()
+    for name in FORK_UNSAFE:
+        _instances.pop(name, None)
+
+
+os.register_at_fork(after_in_child=_after_fork_in_child)
+
+register("roberta", _load_roberta)
+register("clip", _load_clip)
+register("gemini", _load_gemini)
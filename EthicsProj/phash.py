@@ -0,0 +1,181 @@
+# phash.py
+"""Perceptual hashes and a near-duplicate index for images and video frames.
+
+load_image() stores a 64-bit perceptual hash in image.info["phash"].
+detect_ai_images() looks each hash up in a BK-tree of already scored
+images, and an item within PHASH_MAX_DISTANCE bits reuses that result
+instead of paying for CLIP and Gemini again. Re-encoded or resized reposts
+and near-identical adjacent video frames are the usual hits.
+
+The index lives in-process and holds the PHASH_INDEX_MAX most recent
+entries. Lookups are counted in aimd_phash_lookups_total and search the
+tree at PHASH_MAX_DISTANCE. With PHASH_PROBE_DISTANCE set above it, one
+lookup in PHASH_PROBE_EVERY searches that wider radius instead and records
+the distance to the nearest entry in aimd_phash_nearest_distance, which
+shows how many near misses a larger threshold would pick up. Wide searches
+cost several times more under the index lock, so the probe is off by
+default and sampled when on.
+"""
+import os
+import threading
+from collections import deque
+
+import cv2
+import numpy as np
+from PIL import Image
+
+from metrics import phash_lookups, phash_distance
+
+PHASH_ALGO = os.getenv("PHASH_ALGO", "dhash")  # "dhash" or "phash"
+# Largest Hamming distance (of 64 bits) treated as the same image; -1 disables reuse.
+PHASH_MAX_DISTANCE = int(os.getenv("PHASH_MAX_DISTANCE", "5"))
+# Radius of the sampled distance probe; -1 (default) records only reuse-radius distances.
+PHASH_PROBE_DISTANCE = int(os.getenv("PHASH_PROBE_DISTANCE", "-1"))
+PHASH_PROBE_EVERY = int(os.getenv("PHASH_PROBE_EVERY", "100"))
+PHASH_INDEX_MAX = int(os.getenv("PHASH_INDEX_MAX", "100000"))
+
+
+def _bits_to_int(bits):
+    return int.from_bytes(np.packbits(bits.flatten()).tobytes(), "big")
+
+
+def dhash(image):
+    """Difference hash: brightness gradients of a 9x8 grayscale thumbnail."""
+    small = np.asarray(image.convert("L").resize((9, 8), Image.BILINEAR), dtype=np.int16)
+    return _bits_to_int(small[:, 1:] > small[:, :-1])
+
+
+def phash(image):
+    """DCT hash: low 8x8 frequencies of a 32x32 grayscale thumbnail against their median."""
+    small = np.asarray(image.convert("L").resize((32, 32), Image.BILINEAR), dtype=np.float32)
+    low = cv2.dct(small)[:8, :8]
+    return _bits_to_int(low > np.median(low.flatten()[1:]))
+
+
+def perceptual_hash(image, algo=None):
+    return phash(image) if (algo or PHASH_ALGO) == "phash" else dhash(image)
+
+
+def hamming(a, b):
+    return bin(a ^ b).count("1")
+
+
+class BKTree:
+    """Metric tree over Hamming distance; search(h, r) prunes by the triangle inequality."""
+
+    def __init__(self):
+        self._root = None
+        self.size = 0
+
+    def add(self, h, value):
+        node = [h, value, {}]
+        if self._root is None:
+            self._root = node
+            self.size = 1
+            return
+        current = self._root
+        while True:
+            d = hamming(h, current[0])
+            if d == 0:
+                current[1] = value
+                return
+            child = current[2].get(d)
+            if child is None:
+                current[2][d] = node
+                self.size += 1
+                return
+            current = child
+
+    def search(self, h, radius):
+        """All (distance, value) pairs within radius of h."""
+        found = []
+        stack = [self._root] if self._root is not None else []
+        while stack:
+            node = stack.pop()
+            d = hamming(h, node[0])
+            if d <= radius:
+                found.append((d, node[1]))
+            for child_d, child in node[2].items():
+                if d - radius <= child_d <= d + radius:
+                    stack.append(child)
+        return found
+
+
+class NearDuplicateIndex:
+    """Thread-safe BK-tree of hash -> result, trimmed to the most recent max_items."""
+
+    def __init__(self, max_distance=PHASH_MAX_DISTANCE, probe_distance=PHASH_PROBE_DISTANCE,
+                 max_items=PHASH_INDEX_MAX, probe_every=PHASH_PROBE_EVERY):
+        self.max_distance = max_distance
+        self.probe_distance = max(probe_distance, max_distance)
+        self.probe_every = max(1, probe_every)
+        self.max_items = max_items
+        self._lookups = 0
+        self._tree = BKTree()
+        self._entries = deque()
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return self.max_distance >= 0
+
+    def lookup(self, h, pending=()):
+        """(distance, value) of the nearest entry within max_distance, else None.
+
+        pending holds extra (hash, value) candidates that are not indexed yet,
+        such as earlier items of the batch being scored.
+        """
+        if not self.enabled:
+            return None
+        with self._lock:
+            self._lookups += 1
+            probe = self.probe_distance > self.max_distance and self._lookups % self.probe_every == 0
+            radius = self.probe_distance if probe else self.max_distance
+            found = self._tree.search(h, radius)
+        found.extend((d, value) for d, value in ((hamming(h, ph), value) for ph, value in pending)
+                     if d <= radius)
+        nearest = min(found, key=lambda pair: pair[0]) if found else None
+        # With the probe on, only the probed lookups feed the histogram, so it stays a fair sample.
+        if nearest is not None and (probe or self.probe_distance == self.max_distance):
+            phash_distance.observe(nearest[0])
+        if nearest is not None and nearest[0] <= self.max_distance:
+            phash_lookups.inc(outcome="reused")
+            return nearest
+        phash_lookups.inc(outcome="miss")
+        return None
+
+    def add(self, h, result):
+        if not self.enabled:
+            return
+        with self._lock:
+            self._entries.append((h, result))
+            if len(self._entries) > self.max_items:
+                # BK-trees cannot delete; rebuild from the newest half.
+                for _ in range(len(self._entries) - self.max_items // 2):
+                    self._entries.popleft()
+                self._tree = BKTree()
+                for entry_hash, entry_result in self._entries:
+                    self._tree.add(entry_hash, entry_result)
+            else:
+                self._tree.add(h, result)
+
+    def clear(self):
+        with self._lock:
+            self._tree = BKTree()
+            self._entries.clear()
+
+    def stats(self):
+        reused = phash_lookups.value(outcome="reused")
+        misses = phash_lookups.value(outcome="miss")
+        total = reused + misses
+        return {
+            "algo": PHASH_ALGO,
+            "max_distance": self.max_distance,
+            "items": self._tree.size,
+            "lookups": int(total),
+            "reused": int(reused),
+            "reuse_rate": reused / total if total else 0.0,
+        }
+
+
+near_duplicates = NearDuplicateIndex()
@@ -0,0 +1,179 @@
+# rescore.py
+"""Recompute final scores from the feature store without running the models.
+
+feature_store.py keeps, for every scored text and image, the component
+outputs the ensemble is built from. This tool replays the ensemble over
+them under new weights, CLIP prompts or threshold and reports how the
+verdicts move, so tuning no longer means re-running RoBERTa, CLIP and
+Gemini over the corpus.
+
+    python rescore.py --kind text --weights 0.5,0.3,0.2 --threshold 0.45
+    python rescore.py --kind image --weights 0.4,0.6 --prompts prompts.txt --ai-prompts 1,2
+    python rescore.py --kind text --labels labeled.jsonl --out text_scores.npz
+
+Items Gemini was not asked about are scored like the cascade's local path,
+with the remaining weights renormalized. The heuristic score is recomputed
+from the stored features with the current analyzer formula. --prompts
+(one prompt per line) runs the CLIP text tower once over the new prompts;
+the stored image embeddings are reused as they are. --labels takes
+calibrate.py's JSONL format (text, path or url, or a hex `key`, plus a
+0/1 label) and adds accuracy, precision and recall for both settings.
+"""
+import argparse
+import time
+
+import numpy as np
+
+from analyzer import heuristic_scores
+from calibrate import load_records
+from feature_store import feature_store, key_hex, text_digest, image_digest
+
+# The ensemble currently hard-coded in text_detector._score_text and image_detector._score_image.
+TEXT_WEIGHTS = (0.6, 0.25, 0.15)  # RoBERTa, Gemini, heuristics
+IMAGE_WEIGHTS = (0.3, 0.7)  # CLIP, Gemini
+THRESHOLD = 0.5
+# Image embeddings are converted to float32 this many rows at a time.
+CHUNK_ROWS = 1 << 16
+
+
+def text_scores(records, weights=TEXT_WEIGHTS):
+    w_roberta, w_gemini, w_heuristic = weights
+    roberta = 1.0 / (1.0 + np.exp(-records["roberta_logit"].astype(np.float64)))
+    heuristic = heuristic_scores(records["features"])
+    gemini = records["gemini"].astype(np.float64)
+    local = (w_roberta * roberta + w_heuristic * heuristic) / (w_roberta + w_heuristic)
+    full = w_roberta * roberta + w_gemini * np.nan_to_num(gemini) + w_heuristic * heuristic
+    return np.where(np.isnan(gemini), local, full)
+
+
+def clip_scores(records, prompt_embeddings, logit_scale, ai_prompts):
+    """Softmax probability of each AI prompt per record, as an (n, len(ai_prompts)) array."""
+    prompt_embeddings = np.asarray(prompt_embeddings, dtype=np.float32)
+    out = np.empty((len(records), len(ai_prompts)))
+    for start in range(0, len(records), CHUNK_ROWS):
+        emb = records["embedding"][start:start + CHUNK_ROWS].astype(np.float32)
+        logits = logit_scale * emb @ prompt_embeddings.T
+        logits -= logits.max(axis=1, keepdims=True)
+        probs = np.exp(logits)
+        probs /= probs.sum(axis=1, keepdims=True)
+        out[start:start + CHUNK_ROWS] = probs[:, list(ai_prompts)]
+    return out
+
+
+def image_scores(records, prompts, weights=IMAGE_WEIGHTS):
+    """prompts is a load_clip_prompts()-style dict (embeddings, logit_scale, ai_prompts).
+
+    Like image_detector, the ensemble uses the mean AI-prompt probability and
+    the CLIP-only path their total.
+    """
+    w_clip, w_gemini = weights
+    ai_probs = clip_scores(records, prompts["embeddings"], prompts["logit_scale"], prompts["ai_prompts"])
+    gemini = records["gemini"].astype(np.float64)
+    full = w_clip * ai_probs.mean(axis=1) + w_gemini * np.nan_to_num(gemini)
+    return np.where(np.isnan(gemini), ai_probs.sum(axis=1), full)
+
+
+def _encode_prompts(prompts):
+    from image_detector import encode_prompts
+    return encode_prompts(prompts).numpy()
+
+
+def _label_index(kind, path, records):
+    """(row index, label) pairs for the labeled items found in the store."""
+    rows = {key_hex(k): i for i, k in enumerate(records["key"])}
+    if kind == "image":
+        from image_loader import load_image
+    pairs, missing = [], 0
+    for item in load_records(path):
+        if "key" in item:
+            key = item["key"]
+        elif kind == "text":
+            key = text_digest(item["text"]).hex()
+        else:
+            key = image_digest(load_image(item.get("path") or item["url"])).hex()
+        if key in rows:
+            pairs.append((rows[key], int(item["label"])))
+        else:
+            missing += 1
+    if missing:
+        print(f"[!] {missing} labeled items are not in the feature store")
+    return pairs
+
+
+def _report_labels(name, scores, threshold, pairs):
+    idx = np.asarray([i for i, _ in pairs])
+    labels = np.asarray([label for _, label in pairs]) == 1
+    predicted = scores[idx] > threshold
+    tp = int((predicted & labels).sum())
+    precision = tp / predicted.sum() if predicted.sum() else 0.0
+    recall = tp / labels.sum() if labels.sum() else 0.0
+    print(f"{name:8s} accuracy {float((predicted == labels).mean())*100:5.1f}%   "
+          f"precision {precision*100:5.1f}%   recall {recall*100:5.1f}%")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Re-score stored model outputs under new ensemble settings.")
+    parser.add_argument("--kind", choices=("text", "image"), required=True)
+    parser.add_argument("--weights", help="comma-separated: RoBERTa,Gemini,heuristic for text; CLIP,Gemini for image")
+    parser.add_argument("--threshold", type=float, default=THRESHOLD)
+    parser.add_argument("--prompts", help="file with one CLIP prompt per line (image only)")
+    parser.add_argument("--ai-prompts", help="comma-separated indexes of the AI-generated prompts")
+    parser.add_argument("--labels", help="labeled JSONL (calibrate.py format) to measure accuracy on")
+    parser.add_argument("--out", help="write key, score and is_ai arrays to this .npz file")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    records = feature_store.latest(args.kind)
+    if not len(records):
+        print(f"[!] No {args.kind} records in {feature_store.path(args.kind)}")
+        return
+    default_weights = TEXT_WEIGHTS if args.kind == "text" else IMAGE_WEIGHTS
+    weights = tuple(float(w) for w in args.weights.split(",")) if args.weights else default_weights
+    if len(weights) != len(default_weights):
+        parser.error(f"--weights needs {len(default_weights)} values for {args.kind}")
+
+    if args.kind == "text":
+        baseline = text_scores(records)
+        scores = text_scores(records, weights)
+    else:
+        stored = feature_store.load_clip_prompts()
+        if stored is None:
+            print("[!] No clip_prompts.npz next to the image records")
+            return
+        prompts = dict(stored)
+        if args.prompts:
+            with open(args.prompts) as f:
+                prompts["prompts"] = [line.strip() for line in f if line.strip()]
+            prompts["embeddings"] = _encode_prompts(prompts["prompts"])
+        if args.ai_prompts:
+            prompts["ai_prompts"] = [int(i) for i in args.ai_prompts.split(",")]
+        elif args.prompts:
+            parser.error("--prompts needs --ai-prompts")
+        baseline = image_scores(records, stored)
+        scores = image_scores(records, prompts, weights)
+    elapsed = time.perf_counter() - start
+
+    base_ai = baseline > THRESHOLD
+    new_ai = scores > args.threshold
+    with_gemini = int((~np.isnan(records["gemini"])).sum())
+    print(f"{len(records)} {args.kind} items ({with_gemini} with a Gemini score), re-scored in {elapsed:.2f}s")
+    print(f"current  mean score {baseline.mean()*100:5.1f}%   flagged AI {base_ai.mean()*100:5.1f}%")
+    print(f"new      mean score {scores.mean()*100:5.1f}%   flagged AI {new_ai.mean()*100:5.1f}%")
+    changed = int((base_ai != new_ai).sum())
+    print(f"verdicts changed: {changed} ({changed / len(records)*100:.2f}%): "
+          f"{int((new_ai & ~base_ai).sum())} newly flagged, {int((base_ai & ~new_ai).sum())} cleared")
+
+    if args.labels:
+        pairs = _label_index(args.kind, args.labels, records)
+        if pairs:
+            print(f"\n{len(pairs)} labeled items")
+            _report_labels("current", baseline, THRESHOLD, pairs)
+            _report_labels("new", scores, args.threshold, pairs)
+
+    if args.out:
+        np.savez(args.out, key=np.asarray(records["key"]), score=scores, is_ai=new_ai)
+        print(f"Scores written to {args.out}")
+
+
+if __name__ == "__main__":
+    main()
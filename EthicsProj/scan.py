@@ -0,0 +1,259 @@
+# scan.py
+"""Non-interactive bulk scanning of a directory tree or a JSONL manifest.
+
+Media type comes from the file extension (an explicit "kind" in a manifest
+line wins). Texts and images are scored in batches on a small thread pool,
+videos one per task, and every result is appended to a JSONL file as soon as
+its batch finishes. That file is also the checkpoint: a rerun skips every id
+already recorded without an error, so an interrupted scan resumes where it
+stopped. Results also go through the shared result cache.
+
+Manifest lines look like {"path": ...}, {"url": ...} or {"text": ..., "id": ...}.
+"""
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from urllib.parse import urlsplit
+
+from cache import result_cache, content_key, file_key
+
+TEXT_EXTENSIONS = (".txt", ".md")
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".webp", ".bmp", ".gif")
+VIDEO_EXTENSIONS = (".mp4", ".mov", ".avi", ".mkv", ".webm", ".m4v")
+
+SCAN_WORKERS = int(os.getenv("SCAN_WORKERS", "4"))
+SCAN_BATCH_SIZE = int(os.getenv("SCAN_BATCH_SIZE", "16"))
+SCAN_PROGRESS_SECONDS = 10
+
+
+def media_kind(name):
+    """"text", "image" or "video" from a path or URL's extension; None if unknown."""
+    ext = os.path.splitext(urlsplit(name).path if "://" in name else name)[1].lower()
+    if ext in TEXT_EXTENSIONS:
+        return "text"
+    if ext in IMAGE_EXTENSIONS:
+        return "image"
+    if ext in VIDEO_EXTENSIONS:
+        return "video"
+    return None
+
+
+def iter_directory(root):
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        for name in sorted(filenames):
+            path = os.path.join(dirpath, name)
+            kind = media_kind(path)
+            if kind:
+                yield {"id": path, "kind": kind, "path": path}
+
+
+def iter_manifest(path):
+    with open(path) as f:
+        for lineno, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            entry = json.loads(line)
+            src = entry.get("path") or entry.get("url")
+            if "text" in entry:
+                kind = "text"
+            else:
+                # Article URLs without a media extension are scraped as text.
+                kind = entry.get("kind") or media_kind(src) or ("text" if "url" in entry else None)
+            if kind is None:
+                print(f"[!] {path}:{lineno}: unknown media type for {src}; skipped")
+                continue
+            item = {"id": entry.get("id") or src or f"{path}:{lineno}", "kind": kind}
+            for field in ("path", "url", "text"):
+                if field in entry:
+                    item[field] = entry[field]
+            yield item
+
+
+def iter_items(source):
+    if os.path.isdir(source):
+        return iter_directory(source)
+    return iter_manifest(source)
+
+
+def load_checkpoint(out_path):
+    """Ids already recorded successfully in out_path; drops a torn final line."""
+    done = set()
+    if not os.path.exists(out_path):
+        return done
+    with open(out_path, "rb+") as f:
+        data = f.read()
+        if data and not data.endswith(b"\n"):
+            f.truncate(data.rfind(b"\n") + 1)
+            data = data[:data.rfind(b"\n") + 1]
+    for line in data.splitlines():
+        try:
+            record = json.loads(line)
+        except ValueError:
+            continue
+        if "error" not in record:
+            done.add(record["id"])
+    return done
+
+
+def _cache_key(item, text=None):
+    if item["kind"] == "text":
+        return content_key("text", text)
+    if "path" in item:
+        return file_key(item["kind"], item["path"])
+    return content_key(item["kind"], item["url"])
+
+
+def _texts_for(items):
+    """Text per item: inline, read from a file, or scraped from a URL (None on failure)."""
+    from scraper import extract_texts_from_urls
+
+    texts = {}
+    urls = []
+    for item in items:
+        if "text" in item:
+            texts[item["id"]] = item["text"]
+        elif "path" in item:
+            try:
+                with open(item["path"], encoding="utf-8", errors="replace") as f:
+                    texts[item["id"]] = f.read()
+            except OSError as e:
+                print(f"[!] Could not read {item['path']}: {e}")
+                texts[item["id"]] = None
+        else:
+            urls.append(item["url"])
+    by_url = dict(extract_texts_from_urls(urls)) if urls else {}
+    for item in items:
+        if "url" in item and "text" not in item and "path" not in item:
+            texts[item["id"]] = by_url.get(item["url"])
+    return texts
+
+
+def _detect_batch(kind, inputs):
+    if kind == "text":
+        from text_detector import detect_ai_texts
+        return detect_ai_texts(inputs)
+    if kind == "image":
+        from image_detector import detect_ai_images
+        return detect_ai_images(inputs)
+    from video_detector import detect_ai_video
+    return [detect_ai_video(src) for src in inputs]
+
+
+def score_batch(kind, items):
+    """Records for one batch of same-kind items, using the cache where possible."""
+    records = {}
+    texts = _texts_for(items) if kind == "text" else {}
+    todo = []
+    for item in items:
+        if kind == "text" and not texts.get(item["id"]):
+            records[item["id"]] = {"error": "could not read text"}
+            continue
+        key = _cache_key(item, texts.get(item["id"]))
+        cached = result_cache.get(key)
+        if cached is not None:
+            records[item["id"]] = {"result": cached, "cached": True}
+        else:
+            todo.append((item, key))
+
+    if todo:
+        inputs = [texts[item["id"]] if kind == "text" else item.get("path") or item["url"]
+                  for item, _ in todo]
+        _score(kind, todo, inputs, records)
+    return [{"id": item["id"], "kind": kind, **records[item["id"]]} for item in items]
+
+
+def _score(kind, pairs, inputs, records):
+    """Run the detector on (item, cache key) pairs; a failed batch is retried one by one."""
+    try:
+        results = _detect_batch(kind, inputs)
+    except Exception as e:
+        if len(pairs) == 1:
+            records[pairs[0][0]["id"]] = {"error": str(e)}
+            return
+        # One unreadable file should not sink its whole batch.
+        print(f"[!] {kind} batch failed ({e}); retrying items individually")
+        for pair, src in zip(pairs, inputs):
+            _score(kind, [pair], [src], records)
+        return
+    for (item, key), result in zip(pairs, results):
+        result_cache.put(key, kind, result)
+        records[item["id"]] = {"result": result}
+
+
+def _batches(items, batch_size):
+    """Group a stream of items into same-kind batches; videos go one at a time."""
+    pending = {"text": [], "image": []}
+    for item in items:
+        kind = item["kind"]
+        if kind == "video":
+            yield kind, [item]
+            continue
+        pending[kind].append(item)
+        if len(pending[kind]) >= batch_size:
+            yield kind, pending[kind]
+            pending[kind] = []
+    for kind, batch in pending.items():
+        if batch:
+            yield kind, batch
+
+
+def _format_eta(seconds):
+    seconds = int(seconds)
+    return f"{seconds // 3600}h{seconds % 3600 // 60:02d}m{seconds % 60:02d}s"
+
+
+def run_scan(source, out_path, workers=SCAN_WORKERS, batch_size=SCAN_BATCH_SIZE, resume=True):
+    """Scan source (directory or JSONL manifest) into out_path; returns a summary dict."""
+    done = load_checkpoint(out_path) if resume else set()
+    items = [item for item in iter_items(source) if item["id"] not in done]
+    total = len(items)
+    print(f"[scan] {total} items to analyze ({len(done)} already in {out_path})")
+
+    mode = "a" if resume else "w"
+    counts = {"ok": 0, "error": 0, "cached": 0}
+    finished = 0
+    start = time.perf_counter()
+    last_report = start
+
+    with open(out_path, mode) as out, ThreadPoolExecutor(max_workers=workers) as pool:
+        batch_iter = _batches(items, batch_size)
+        pending = set()
+        exhausted = False
+        while True:
+            while not exhausted and len(pending) < workers * 2:
+                nxt = next(batch_iter, None)
+                if nxt is None:
+                    exhausted = True
+                    break
+                pending.add(pool.submit(score_batch, *nxt))
+            if not pending:
+                break
+            completed, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for fut in completed:
+                records = fut.result()
+                for record in records:
+                    out.write(json.dumps(record, default=float) + "\n")
+                out.flush()
+                os.fsync(out.fileno())
+                for record in records:
+                    counts["error" if "error" in record else "ok"] += 1
+                    counts["cached"] += bool(record.get("cached"))
+                finished += len(records)
+
+            now = time.perf_counter()
+            if now - last_report >= SCAN_PROGRESS_SECONDS or (exhausted and not pending):
+                last_report = now
+                rate = finished / (now - start) if now > start else 0.0
+                eta = (total - finished) / rate if rate else 0.0
+                print(f"[scan] {finished}/{total} ({finished / total * 100 if total else 100:.1f}%) "
+                      f"{rate:.2f} items/s, ETA {_format_eta(eta)}, "
+                      f"{counts['error']} errors, {counts['cached']} from cache")
+
+    elapsed = time.perf_counter() - start
+    summary = {**counts, "items": finished, "seconds": elapsed,
+               "items_per_second": finished / elapsed if elapsed else 0.0}
+    print(f"[scan] Done: {finished} items in {elapsed:.1f}s "
+          f"({summary['items_per_second']:.2f} items/s), {counts['error']} errors -> {out_path}")
+    return summary
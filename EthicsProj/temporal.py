@@ -0,0 +1,144 @@
+# temporal.py
+"""Cheap temporal-consistency signal for videos.
+
+Generated video tends to flicker, warp and "boil": frame-to-frame changes
+that motion does not explain. TemporalAnalyzer is fed decoded frames while
+keyframes are being extracted. It samples short bursts of TEMPORAL_BURST
+frames, TEMPORAL_STRIDE apart, starting every TEMPORAL_PERIOD frames (the
+default keyframe interval, so a burst starts at a frame that is decoded
+anyway and adds TEMPORAL_BURST - 1 decodes per keyframe, keeping the
+grab()-only skipping of the frames in between). Each sample is shrunk to a
+small grayscale image, and dense optical flow (Farneback) is computed
+between consecutive samples of a burst. From that it measures:
+
+- flicker: jumps in global brightness that do not follow a trend
+- residual: mean change left after motion compensation (0-1 intensity)
+- residual_ratio: that residual relative to the raw frame difference
+- flow_jerk: how abruptly the mean motion vector changes
+
+Each measure is mapped linearly onto 0-1 between a "natural" and an
+"artificial" level and averaged into the temporal score. The levels are
+starting points meant to be re-fit from stored features; until then the
+score is reported but not weighted (TEMPORAL_WEIGHT=0 in video_detector).
+Steps that look like hard cuts are skipped.
+"""
+import os
+
+import cv2
+import numpy as np
+
+TEMPORAL_STRIDE = int(os.getenv("TEMPORAL_STRIDE", "1"))
+TEMPORAL_BURST = int(os.getenv("TEMPORAL_BURST", "4"))
+TEMPORAL_PERIOD = int(os.getenv("TEMPORAL_PERIOD", "30"))
+# Samples per video; bounds the extra work on long videos.
+TEMPORAL_MAX_SAMPLES = int(os.getenv("TEMPORAL_MAX_SAMPLES", "600"))
+TEMPORAL_SIZE = (160, 90)
+TEMPORAL_MIN_STEPS = 3
+# Mean absolute difference (0-1) above which a step is treated as a scene cut.
+SCENE_CUT_DIFF = 0.25
+
+# (natural, artificial) levels for each measure.
+FEATURE_RANGES = {
+    "flicker": (0.002, 0.02),
+    "residual": (0.0015, 0.008),
+    "residual_ratio": (0.35, 0.8),
+    "flow_jerk": (0.15, 1.0),
+}
+
+
+class TemporalAnalyzer:
+    def __init__(self, stride=None, burst=None, period=None, size=TEMPORAL_SIZE, max_samples=None):
+        self.stride = stride or TEMPORAL_STRIDE
+        self.burst = burst or TEMPORAL_BURST
+        self.period = max(period or TEMPORAL_PERIOD, self.stride * self.burst)
+        self.max_samples = max_samples or TEMPORAL_MAX_SAMPLES
+        self.size = size
+        self._prev = None
+        self._prev_index = None
+        self._prev_flow_mean = None
+        self._brightness = []
+        self._diffs = []
+        self._residuals = []
+        self._jerks = []
+        self._magnitudes = []
+        self.frames = 0
+        self.cuts = 0
+        h, w = size[1], size[0]
+        self._grid = np.dstack(np.meshgrid(np.arange(w), np.arange(h))).astype(np.float32)
+
+    def wants(self, index):
+        offset = index % self.period
+        return offset % self.stride == 0 and offset < self.stride * self.burst and self.frames < self.max_samples
+
+    def update(self, frame, index=None):
+        """Add one BGR frame (any size) to the running statistics.
+
+        index is the frame's position in the video; a gap since the previous
+        sample starts a new burst instead of being measured as one step.
+        """
+        small = cv2.resize(frame, self.size, interpolation=cv2.INTER_AREA)
+        gray = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+        self.frames += 1
+        if index is not None and self._prev_index is not None and index - self._prev_index != self.stride:
+            self._prev = self._prev_flow_mean = None
+            self._brightness.append(None)
+        self._prev_index = index
+        prev, self._prev = self._prev, gray
+        if prev is None:
+            self._brightness.append(float(gray.mean()) / 255.0)
+            return
+        diff = float(cv2.absdiff(gray, prev).mean()) / 255.0
+        if diff > SCENE_CUT_DIFF:
+            self.cuts += 1
+            self._prev_flow_mean = None
+            self._brightness.append(None)  # breaks the brightness series at the cut
+            self._brightness.append(float(gray.mean()) / 255.0)
+            return
+        self._brightness.append(float(gray.mean()) / 255.0)
+
+        flow = cv2.calcOpticalFlowFarneback(prev, gray, None, 0.5, 2, 9, 2, 5, 1.1, 0)
+        # Rebuild prev from the current frame along the flow; what remains is unexplained change.
+        rebuilt = cv2.remap(gray, self._grid + flow, None, cv2.INTER_LINEAR, borderMode=cv2.BORDER_REPLICATE)
+        residual = float(cv2.absdiff(rebuilt, prev).mean()) / 255.0
+
+        flow_mean = flow.reshape(-1, 2).mean(axis=0)
+        magnitude = float(np.linalg.norm(flow, axis=2).mean())
+        if self._prev_flow_mean is not None:
+            self._jerks.append(float(np.linalg.norm(flow_mean - self._prev_flow_mean)))
+        self._prev_flow_mean = flow_mean
+
+        self._diffs.append(diff)
+        self._residuals.append(residual)
+        self._magnitudes.append(magnitude)
+
+    def features(self):
+        """Aggregate measures, or None if too few usable steps were seen."""
+        if len(self._diffs) < TEMPORAL_MIN_STEPS:
+            return None
+        flicker_steps = []
+        for a, b, c in zip(self._brightness, self._brightness[1:], self._brightness[2:]):
+            if a is not None and b is not None and c is not None:
+                flicker_steps.append(abs(a - 2 * b + c))
+        diffs = np.asarray(self._diffs)
+        residuals = np.asarray(self._residuals)
+        return {
+            "flicker": float(np.mean(flicker_steps)) if flicker_steps else 0.0,
+            "residual": float(residuals.mean()),
+            # The 0.01 floor keeps sensor noise on a static shot from reading as unexplained change.
+            "residual_ratio": float(residuals.mean() / (diffs.mean() + 0.01)),
+            "flow_jerk": float(np.mean(self._jerks) / (np.mean(self._magnitudes) + 0.1)) if self._jerks else 0.0,
+            "mean_diff": float(diffs.mean()),
+            "mean_motion": float(np.mean(self._magnitudes)),
+            "steps": len(self._diffs),
+            "cuts": self.cuts,
+        }
+
+
+def temporal_score(features):
+    """0-1 AI-likelihood from TemporalAnalyzer.features(); None when unavailable."""
+    if not features:
+        return None
+    parts = []
+    for name, (natural, artificial) in FEATURE_RANGES.items():
+        parts.append(np.clip((features[name] - natural) / (artificial - natural), 0.0, 1.0))
+    return float(np.mean(parts))
@@ -1,59 +1,183 @@
 # text_detector.py
 import os
 import torch
-from transformers import AutoTokenizer, AutoModelForSequenceClassification
-from google import genai
-from analyzer import analyze_text_features, heuristic_score
-import time
-import random
+import models
+import cascade
+from analyzer import analyze_text_features_batch, heuristic_scores
+from batcher import MicroBatcher
+from cache import normalized_offsets
+from feature_store import record_texts
+from gemini import assess_many
+from metrics import span
 
-tokenizer = AutoTokenizer.from_pretrained("roberta-base-openai-detector", use_fast=True)
-model = AutoModelForSequenceClassification.from_pretrained("roberta-base-openai-detector")
-genai_client = genai.Client(api_key=os.getenv("GEMINI_API_KEY"))
+ROBERTA_MAX_BATCH = int(os.getenv("ROBERTA_MAX_BATCH", "16"))
+ROBERTA_MAX_WAIT_MS = float(os.getenv("ROBERTA_MAX_WAIT_MS", "5"))
+
+# Long documents are scored as overlapping windows of CHUNK_TOKENS tokens
+# (512 minus the two special tokens) instead of being truncated.
+CHUNK_TOKENS = 510
+CHUNK_OVERLAP = int(os.getenv("CHUNK_OVERLAP", "128"))
+CHUNK_AGGREGATE = os.getenv("CHUNK_AGGREGATE", "weighted")  # "mean", "max" or "weighted"
+
+GEMINI_TEXT_PROMPT = (
+    "Rate from 0 to 1 how likely the following text is AI-generated (0 = clearly human-written, "
+    "1 = clearly AI-generated) as `score`. In `reasoning`, write a short (2-3 sentence) plain-language "
+    "explanation of why. Mention concrete signals (style, repetition, phrasing, or other features) "
+    "that support the conclusion. Be factual and non-judgmental.\n\nText:\n"
+)
+
+def _ask_gemini(texts):
+    """Gemini's (score, reasoning) per text, or None where it gave no answer."""
+    return assess_many([[GEMINI_TEXT_PROMPT + text] for text in texts], label="text")
+
+def detect_gemini_ai_many(texts):
+    """Ask Gemini for a score and explanation of each text in one concurrent batch.
+
+    Returns (score, reasoning) per text; failures fall back to (0.5, None).
+    """
+    return [res if res is not None else (0.5, None) for res in _ask_gemini(texts)]
 
 def detect_gemini_ai(text):
     """Ask Gemini to rate how likely text is AI-generated, with retries."""
-    for attempt in range(3):  
-        try:
-            resp = genai_client.models.generate_content(
-                model="gemini-2.5-flash",
-                contents=[
-                    "Respond with a number between 0 and 1 representing how likely this text is AI-generated:\n",
-                    text
-                ],
-            )
-            raw = resp.text.strip()
-            score = float(raw)
-            return max(0.0, min(score, 1.0))
-        except Exception as e:
-            err_msg = str(e)
-            print(f"[!] Gemini API attempt {attempt+1} failed: {err_msg}")
-            if "503" in err_msg or "UNAVAILABLE" in err_msg:
-                # wait 2–5 seconds and retry
-                wait = random.uniform(2, 5)
-                print(f"Waiting {wait:.1f}s before retry...")
-                time.sleep(wait)
-                continue
-            
-            return 0.5
-    print("[!] Gemini service still unavailable after retries; using fallback.")
-    return 0.5
-
-def detect_ai_text(text):
-    inputs = tokenizer(text, return_tensors="pt", truncation=True, max_length=512)
-    with torch.no_grad():
+    return detect_gemini_ai_many([text])[0]
+
+def _roberta_probs_from_ids(id_lists):
+    """AI probability for pre-tokenized windows, padded into one forward pass."""
+    tokenizer, model = models.get("roberta")
+    encoded = [tokenizer.build_inputs_with_special_tokens(ids) for ids in id_lists]
+    inputs = tokenizer.pad({"input_ids": encoded}, return_tensors="pt")
+    with torch.no_grad(), span("text.roberta_forward"):
         outputs = model(**inputs)
         probs = torch.nn.functional.softmax(outputs.logits, dim=-1)
+    return probs[:, 1].tolist()
+
+# Windows from concurrent threads (and from every document of a batch) are
+# coalesced into shared forward passes.
+roberta_batcher = MicroBatcher(_roberta_probs_from_ids, max_batch=ROBERTA_MAX_BATCH,
+                               max_wait_ms=ROBERTA_MAX_WAIT_MS, name="roberta-batcher")
+
+def iter_windows(text, window=CHUNK_TOKENS, overlap=CHUNK_OVERLAP):
+    """Yield overlapping token windows as dicts with char offsets and token ids."""
+    tokenizer, _ = models.get("roberta")
+    enc = tokenizer(text, add_special_tokens=False, return_offsets_mapping=True, verbose=False)
+    ids, offsets = enc["input_ids"], enc["offset_mapping"]
+    step = max(1, window - overlap)
+    start = 0
+    while start < len(ids):
+        end = min(start + window, len(ids))
+        yield {"start": offsets[start][0], "end": offsets[end - 1][1], "ids": ids[start:end]}
+        if end == len(ids):
+            break
+        start += step
+
+def aggregate_chunks(chunks, mode=CHUNK_AGGREGATE):
+    """Combine chunk scores: plain mean, max, or mean weighted by token count."""
+    if not chunks:
+        return 0.0
+    if mode == "max":
+        return max(c["score"] for c in chunks)
+    if mode == "mean":
+        return sum(c["score"] for c in chunks) / len(chunks)
+    total = sum(c["tokens"] for c in chunks)
+    return sum(c["score"] * c["tokens"] for c in chunks) / max(1, total)
+
+def roberta_documents(texts):
+    """RoBERTa score for each text of any length.
+
+    Returns (probability, chunks) per text. Every text is tokenized once and
+    its windows are generated lazily and streamed through the shared
+    micro-batcher, only a couple of batches at a time; texts go shortest first
+    so batches pad little. Texts that fit in one window get chunks=None;
+    longer ones also get the per-chunk scores, with char offsets into
+    normalize_text(text) so they stay valid for cached results.
+    """
+    def windows():
+        for i in sorted(range(len(texts)), key=lambda i: len(texts[i])):
+            empty = True
+            for w in iter_windows(texts[i]):
+                empty = False
+                yield i, w
+            if empty:
+                yield i, {"start": 0, "end": 0, "ids": []}
+
+    scored = [[] for _ in texts]
+    for (i, w), p in roberta_batcher.imap(windows(), key=lambda item: item[1]["ids"]):
+        scored[i].append({"start": w["start"], "end": w["end"], "tokens": len(w["ids"]), "score": p})
+    results = []
+    for text, doc in zip(texts, scored):
+        if len(doc) == 1:
+            results.append((doc[0]["score"], None))
+            continue
+        positions = normalized_offsets(text)
+        chunks = [dict(c, start=positions[c["start"]], end=positions[c["end"]]) for c in doc]
+        results.append((aggregate_chunks(chunks), chunks))
+    return results
+
+def roberta_document(text):
+    return roberta_documents([text])[0]
+
+def roberta_prob(text):
+    return roberta_document(text)[0]
+
+def local_text_score(roberta_ai_prob, heuristic):
+    """RoBERTa and heuristic blended with their ensemble weights renormalized (Gemini left out)."""
+    return (roberta_ai_prob * 0.6 + heuristic * 0.15) / 0.75
+
+def local_text_scores(texts):
+    """Local-only scores for texts.
+
+    Returns (scores, roberta (prob, chunks) pairs, heuristics, heuristic feature array).
+    """
+    with span("text.roberta"):
+        roberta_results = roberta_documents(texts)
+    with span("text.heuristic"):
+        features = analyze_text_features_batch(texts)
+        heuristics = heuristic_scores(features).tolist()
+    scores = [local_text_score(r, h) for (r, _), h in zip(roberta_results, heuristics)]
+    return scores, roberta_results, heuristics, features
+
+def detect_ai_texts(texts, cascade_mode=None):
+    """Score many texts; Gemini requests for the whole batch run concurrently.
+
+    With the cascade on (TEXT_CASCADE=on or cascade_mode=True), only texts whose
+    local score is inside the uncertainty band are sent to Gemini.
+    """
+    band = cascade.band_for("text", cascade_mode)
+    with span("text.total"):
+        if band is None:
+            gemini_results = _ask_gemini(texts)
+            asked = range(len(texts))
+            _, roberta_results, heuristics, features = local_text_scores(texts)
+        else:
+            local, roberta_results, heuristics, features = local_text_scores(texts)
+            asked = cascade.split("text", local, band)
+            gemini_results = [None] * len(texts)
+            for i, res in zip(asked, _ask_gemini([texts[i] for i in asked])):
+                gemini_results[i] = res
+        # Texts Gemini should have scored but could not fall back to the local score.
+        unavailable = {i for i in asked if gemini_results[i] is None}
+        kept = [i for i in range(len(texts)) if i not in unavailable]
+        record_texts([texts[i] for i in kept], [roberta_results[i][0] for i in kept], features[kept],
+                     [heuristics[i] for i in kept],
+                     [None if gemini_results[i] is None else gemini_results[i][0] for i in kept])
+        return [_score_text(roberta, gemini, heuristic, chunks, band, i in unavailable)
+                for i, ((roberta, chunks), gemini, heuristic)
+                in enumerate(zip(roberta_results, gemini_results, heuristics))]
 
-    roberta_ai_prob = probs[0][1].item()
-    features = analyze_text_features(text)
-    heuristic = heuristic_score(features)
-    gemini_prob = detect_gemini_ai(text)
+def detect_ai_text(text, cascade_mode=None):
+    return detect_ai_texts([text], cascade_mode)[0]
+
+def _score_text(roberta_ai_prob, gemini_result, heuristic, chunks=None, band=None, unavailable=False):
+    if gemini_result is None:
+        return _score_text_locally(roberta_ai_prob, heuristic, chunks, band, unavailable)
+    gemini_prob, gemini_reasoning = gemini_result
 
     final_score = (roberta_ai_prob * 0.6) + (gemini_prob * 0.25) + (heuristic * 0.15)
 
     print("\n--- TEXT AI DETECTION ---")
     print(f"RoBERTa AI prob        : {roberta_ai_prob*100:.2f}%")
+    if chunks:
+        print(f"  ({len(chunks)} chunks, {CHUNK_AGGREGATE} aggregate, max {max(c['score'] for c in chunks)*100:.2f}%)")
     print(f"Gemini detection score : {gemini_prob*100:.2f}%")
     print(f"Heuristic indicator    : {heuristic*100:.2f}%")
     print(f"Final AI-likelihood    : {final_score*100:.2f}%")
@@ -71,28 +195,14 @@ def detect_ai_text(text):
         f"Heuristic signals: {heuristic*100:.2f}% (weight 15%).\n"
         f"Combined final score: {final_score*100:.2f}% — {('likely AI-generated' if is_ai else 'appears human-written')}.")
 
-    # Ask Gemini to write a concise, text-specific explanation for the UI if possible.
+    # Use Gemini's explanation for the UI when it produced one, with the
+    # component summary appended for transparency.
     reasoning = fallback_reasoning
-    try:
-        prompt = (
-            "Write a short (2-3 sentence) plain-language explanation of whether the following text "
-            "is AI-generated or human-written and why. Mention concrete signals (style, repetition, phrasing, "
-            "or other features) that support the conclusion. Be factual and non-judgmental.\n\nText:\n" + text + "\n\nAnswer:"
-        )
-        resp = genai_client.models.generate_content(
-            model="gemini-2.5-flash",
-            contents=[prompt],
-        )
-        gen_text = resp.text.strip()
-        if gen_text:
-            # Use the generated explanation but append component summary for transparency
-            reasoning = gen_text + "\n\nComponent summary: " + fallback_reasoning
-    except Exception as e:
-        # If Gemini fails, keep the fallback reasoning and log the error
-        print(f"[!] Gemini reasoning generation failed: {e}")
+    if gemini_reasoning:
+        reasoning = gemini_reasoning + "\n\nComponent summary: " + fallback_reasoning
 
     # Return a structured result so the web UI can display component scores and reasoning
-    return {
+    result = {
         'final_score': final_score,
         'roberta': roberta_ai_prob,
         'gemini': gemini_prob,
@@ -100,3 +210,59 @@ def detect_ai_text(text):
         'reasoning': reasoning,
         'is_ai': is_ai,
     }
+    if band is not None:
+        result['escalated'] = True
+    if chunks:
+        result['chunks'] = chunks
+        result['chunk_aggregate'] = CHUNK_AGGREGATE
+    return result
+
+def _score_text_locally(roberta_ai_prob, heuristic, chunks, band, unavailable=False):
+    """Result for a text answered without Gemini: decided by the cascade, or Gemini unavailable."""
+    final_score = local_text_score(roberta_ai_prob, heuristic)
+    is_ai = final_score > 0.5
+    verdict = 'is likely AI-generated' if is_ai else 'appears human-written'
+
+    print("\n--- TEXT AI DETECTION (local) ---")
+    print(f"RoBERTa AI prob        : {roberta_ai_prob*100:.2f}%")
+    print(f"Heuristic indicator    : {heuristic*100:.2f}%")
+    print(f"Final AI-likelihood    : {final_score*100:.2f}% (Gemini {'unavailable' if unavailable else 'skipped'})")
+
+    strongest = max(chunks, key=lambda c: c["score"]) if chunks else None
+    evidence = (
+        f"The RoBERTa classifier rates the text {roberta_ai_prob*100:.2f}% likely AI-generated"
+        + (f" (across {len(chunks)} chunks, highest {strongest['score']*100:.2f}%)" if strongest else "")
+        + f" and the readability/diversity heuristics {heuristic*100:.2f}%. "
+    )
+    if unavailable:
+        reasoning = (
+            "Gemini could not be reached, so the local detectors decided alone. " + evidence
+            + f"The combined {final_score*100:.2f}% means the text {verdict}.\n\n"
+        )
+    else:
+        low, high = band
+        reasoning = (
+            "The local detectors were decisive, so Gemini was not consulted. " + evidence
+            + f"The combined {final_score*100:.2f}% is outside the {low*100:.0f}-{high*100:.0f}% uncertainty band, "
+            f"so the text {verdict}.\n\n"
+        )
+    reasoning += (
+        f"Component summary: RoBERTa {roberta_ai_prob*100:.2f}% (weight 80%), "
+        f"heuristics {heuristic*100:.2f}% (weight 20%)."
+    )
+    result = {
+        'final_score': final_score,
+        'roberta': roberta_ai_prob,
+        'gemini': None,
+        'heuristic': heuristic,
+        'reasoning': reasoning,
+        'is_ai': is_ai,
+    }
+    if band is not None:
+        result['escalated'] = unavailable
+    if unavailable:
+        result['gemini_unavailable'] = True
+    if chunks:
+        result['chunks'] = chunks
+        result['chunk_aggregate'] = CHUNK_AGGREGATE
+    return result
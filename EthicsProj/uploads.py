@@ -0,0 +1,169 @@
+# uploads.py
+"""Streaming, content-addressed upload storage.
+
+Multipart file parts are written by werkzeug straight into a HashingSpool
+inside the upload folder, so the body is hashed as it arrives and never
+copied a second time. Once parsing is done the spool is renamed to
+<sha256><ext>; identical uploads collapse onto one file. A background
+janitor removes content-addressed files by age and total-size quota.
+"""
+import hashlib
+import os
+import re
+import tempfile
+import threading
+import time
+
+from flask import Request, current_app
+from werkzeug.exceptions import RequestEntityTooLarge
+from werkzeug.utils import secure_filename
+
+UPLOAD_MAX_IMAGE_BYTES = int(os.getenv("UPLOAD_MAX_IMAGE_BYTES", str(20 * 1024 * 1024)))
+UPLOAD_MAX_VIDEO_BYTES = int(os.getenv("UPLOAD_MAX_VIDEO_BYTES", str(500 * 1024 * 1024)))
+UPLOAD_MAX_AGE_SECONDS = int(os.getenv("UPLOAD_MAX_AGE_SECONDS", str(24 * 3600)))
+UPLOAD_QUOTA_BYTES = int(os.getenv("UPLOAD_QUOTA_BYTES", str(5 * 1024 * 1024 * 1024)))
+UPLOAD_JANITOR_INTERVAL = int(os.getenv("UPLOAD_JANITOR_INTERVAL", "600"))
+# Files younger than this are never evicted for quota, so running jobs keep their input.
+UPLOAD_MIN_KEEP_SECONDS = 600
+
+MAX_REQUEST_BYTES = max(UPLOAD_MAX_IMAGE_BYTES, UPLOAD_MAX_VIDEO_BYTES) + 1024 * 1024
+
+# Uploads with these extensions get the video size limit, whatever content type the client declared.
+VIDEO_EXTENSIONS = (".mp4", ".mov", ".avi", ".mkv", ".webm", ".m4v", ".mpg", ".mpeg", ".wmv", ".flv", ".3gp")
+
+_SPOOL_PREFIX = ".upload-"
+_STORED_NAME = re.compile(r"^[0-9a-f]{64}(\.[a-z0-9]{1,10})?$")
+
+
+def limit_for(filename, content_type=None):
+    """Size limit for an upload, chosen by file extension (browsers often send
+    application/octet-stream for .mkv and friends), then by content type."""
+    if os.path.splitext(filename or "")[1].lower() in VIDEO_EXTENSIONS:
+        return UPLOAD_MAX_VIDEO_BYTES
+    if content_type and content_type.startswith("video/"):
+        return UPLOAD_MAX_VIDEO_BYTES
+    return UPLOAD_MAX_IMAGE_BYTES
+
+
+class HashingSpool:
+    """Writable temp file in the upload folder that hashes and size-checks every write."""
+
+    def __init__(self, folder, max_bytes):
+        os.makedirs(folder, exist_ok=True)
+        fd, self.path = tempfile.mkstemp(dir=folder, prefix=_SPOOL_PREFIX)
+        self._file = os.fdopen(fd, "w+b")
+        self._hash = hashlib.sha256()
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self.size = 0
+
+    def write(self, data):
+        self.size += len(data)
+        if self.size > self.max_bytes:
+            self.discard()
+            raise RequestEntityTooLarge(f"Upload exceeds {self.max_bytes} bytes")
+        self._hash.update(data)
+        return self._file.write(data)
+
+    def __getattr__(self, name):
+        return getattr(self._file, name)
+
+    def finalize(self, filename):
+        """Move the spool to its content-addressed name; returns (path, sha256 hex)."""
+        self._file.close()
+        digest = self._hash.hexdigest()
+        ext = os.path.splitext(secure_filename(filename or ""))[1].lower()[:11]
+        final = os.path.join(self.folder, digest + ext)
+        if os.path.exists(final):
+            os.remove(self.path)
+            os.utime(final)  # a re-upload counts as fresh use for the janitor
+        else:
+            os.replace(self.path, final)
+        return final, digest
+
+    def discard(self):
+        try:
+            self._file.close()
+            os.remove(self.path)
+        except OSError:
+            pass
+
+
+class UploadRequest(Request):
+    """Flask request whose file parts are spooled into HashingSpools."""
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        folder = current_app.config["UPLOAD_FOLDER"]
+        return HashingSpool(folder, limit_for(filename, content_type))
+
+
+def store_upload(file_storage, folder):
+    """Persist an uploaded FileStorage under its content hash; returns (path, sha256 hex).
+
+    Spooled parts are just renamed. Anything else (e.g. a small in-memory part)
+    is streamed into a spool in 1 MiB chunks.
+    """
+    stream = file_storage.stream
+    if not isinstance(stream, HashingSpool):
+        spool = HashingSpool(folder, limit_for(file_storage.filename, file_storage.mimetype))
+        for chunk in iter(lambda: stream.read(1024 * 1024), b""):
+            spool.write(chunk)
+        stream = spool
+    return stream.finalize(file_storage.filename)
+
+
+def sweep(folder, max_age=UPLOAD_MAX_AGE_SECONDS, quota=UPLOAD_QUOTA_BYTES):
+    """Delete stored uploads older than max_age, then the oldest until under quota.
+
+    Only content-addressed files and abandoned spools are touched; anything
+    else in the folder (e.g. bundled sample media) is left alone.
+    """
+    now = time.time()
+    entries = []
+    removed = 0
+    for name in os.listdir(folder):
+        path = os.path.join(folder, name)
+        try:
+            st = os.stat(path)
+        except OSError:
+            continue
+        if name.startswith(_SPOOL_PREFIX):
+            if now - st.st_mtime > 3600:
+                os.remove(path)
+                removed += 1
+            continue
+        if not _STORED_NAME.match(name):
+            continue
+        if now - st.st_mtime > max_age:
+            os.remove(path)
+            removed += 1
+        else:
+            entries.append((st.st_mtime, st.st_size, path))
+
+    total = sum(size for _, size, _ in entries)
+    for mtime, size, path in sorted(entries):
+        if total <= quota:
+            break
+        if now - mtime < UPLOAD_MIN_KEEP_SECONDS:
+            break
+        os.remove(path)
+        total -= size
+        removed += 1
+    return removed
+
+
+def start_janitor(folder, interval=UPLOAD_JANITOR_INTERVAL):
+    """Run sweep(folder) every interval seconds on a daemon thread."""
+    def loop():
+        while True:
+            try:
+                removed = sweep(folder)
+                if removed:
+                    print(f"[uploads] Janitor removed {removed} files from {folder}")
+            except Exception as e:
+                print(f"[!] Upload janitor failed: {e}")
+            time.sleep(interval)
+
+    thread = threading.Thread(target=loop, name="upload-janitor", daemon=True)
+    thread.start()
+    return thread
@@ -1,111 +1,614 @@
 # video_detector.py
+import heapq
+import math
+import queue
+import threading
+from collections import deque
+from concurrent.futures import wait, FIRST_COMPLETED
 import cv2
 import numpy as np
-from image_detector import detect_ai_image
-from google import genai
+import cascade
+from image_detector import (detect_ai_images, GEMINI_IMAGE_PROMPT, CLIP_BATCH_SIZE, clip_pixel_values,
+                            clip_embeddings, clip_embeddings_from_pixels, prompt_probs, clip_local_score,
+                            reuse_near_duplicates, finish_image_batch, score_fresh_image, resolve_batch_duplicates,
+                            submit_gemini_images)
+from gemini import assess, generate_text
+from image_loader import load_image, IMAGE_MAX_SIDE
+from metrics import span, video_frames_scored
+from temporal import TemporalAnalyzer, temporal_score
 import os
 from PIL import Image
-import requests
 
-genai_client = genai.Client(api_key=os.getenv("GEMINI_API_KEY"))
+KEYFRAME_MODE = os.getenv("KEYFRAME_MODE", "interval")  # "interval" or "scene"
+SCENE_PROBE_INTERVAL = int(os.getenv("SCENE_PROBE_INTERVAL", "5"))
+SCENE_MIN_GAP = int(os.getenv("SCENE_MIN_GAP", "15"))
+
+# "fixed" scores every extracted keyframe; "adaptive" samples frames spread over
+# the whole video in batches and stops once the verdict is statistically settled;
+# "stream" scores every VIDEO_STREAM_INTERVAL-th frame of the whole video through
+# FramePipeline, overlapping decoding, preprocessing, CLIP and Gemini.
+VIDEO_SAMPLING = os.getenv("VIDEO_SAMPLING", "fixed")
+ADAPTIVE_BATCH = int(os.getenv("ADAPTIVE_BATCH", "4"))
+ADAPTIVE_MIN_FRAMES = int(os.getenv("ADAPTIVE_MIN_FRAMES", "4"))
+ADAPTIVE_MAX_FRAMES = int(os.getenv("ADAPTIVE_MAX_FRAMES", "48"))
+ADAPTIVE_Z = float(os.getenv("ADAPTIVE_Z", "1.96"))  # two-sided 95% interval
+# Lower bound on the per-frame standard deviation, so a few identical scores
+# do not produce a zero-width interval.
+ADAPTIVE_MIN_STD = 0.05
+# Temporal-consistency analysis (temporal.py). Its score is reported but not
+# weighted into the final video score until its ranges are fitted on labeled videos.
+TEMPORAL = os.getenv("TEMPORAL", "on") == "on"
+TEMPORAL_WEIGHT = float(os.getenv("TEMPORAL_WEIGHT", "0"))
+if not 0 <= TEMPORAL_WEIGHT < 1:
+    # The frame scores must keep some weight; adaptive sampling divides by 1 - TEMPORAL_WEIGHT.
+    raise ValueError(f"TEMPORAL_WEIGHT must be in [0, 1), got {TEMPORAL_WEIGHT:g}")
+VIDEO_STREAM_INTERVAL = int(os.getenv("VIDEO_STREAM_INTERVAL", "30"))
+VIDEO_STREAM_MAX_FRAMES = int(os.getenv("VIDEO_STREAM_MAX_FRAMES", "0"))  # 0 = no cap
+# Pipeline depths: decoded frames, preprocessed batches, batches awaiting Gemini.
+VIDEO_QUEUE_DEPTH = int(os.getenv("VIDEO_QUEUE_DEPTH", "32"))
+VIDEO_PREPROCESS_DEPTH = int(os.getenv("VIDEO_PREPROCESS_DEPTH", "2"))
+VIDEO_INFLIGHT_BATCHES = int(os.getenv("VIDEO_INFLIGHT_BATCHES", "3"))
+_PIPELINE_POLL_SECONDS = 0.1
+_PIPELINE_DONE = object()
+# Two-sided 97.5% Student t quantiles for 1..15 degrees of freedom; small
+# samples widen the interval by t/1.96 (z is used beyond the table).
+_T975 = (12.71, 4.303, 3.182, 2.776, 2.571, 2.447, 2.365, 2.306, 2.262, 2.228,
+         2.201, 2.179, 2.160, 2.145, 2.131)
+
+
+class AnalysisCancelled(Exception):
+    """Raised when a video analysis is stopped through its cancel_event."""
+
+
+def _to_pil(frame, index, max_side=IMAGE_MAX_SIDE):
+    """Convert an OpenCV BGR frame to a PIL image of at most max_side, tagged with its frame index."""
+    h, w = frame.shape[:2]
+    if max(h, w) > max_side:
+        scale = max_side / max(h, w)
+        frame = cv2.resize(frame, (max(1, round(w * scale)), max(1, round(h * scale))),
+                           interpolation=cv2.INTER_AREA)
+    image = Image.fromarray(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
+    image.info["frame_index"] = index
+    return image
+
+
+def _frame_histogram(frame):
+    """Normalized hue/saturation histogram of a downscaled frame."""
+    small = cv2.resize(frame, (160, 90), interpolation=cv2.INTER_AREA)
+    hsv = cv2.cvtColor(small, cv2.COLOR_BGR2HSV)
+    hist = cv2.calcHist([hsv], [0, 1], None, [32, 32], [0, 180, 0, 256])
+    return cv2.normalize(hist, hist).flatten()
+
+
+def extract_keyframes(video_path, frame_interval=30, max_frames=15, mode=None, temporal=None):
+    """Sample up to max_frames frames and return them in memory as PIL images.
+
+    "interval" keeps one frame every frame_interval frames; skipped frames are
+    only grab()bed, never converted, unless a TemporalAnalyzer passed as
+    `temporal` wants them. "scene" spreads the budget over shot changes across
+    the whole video (see extract_scene_keyframes).
+    """
+    mode = mode or KEYFRAME_MODE
+    if mode == "scene":
+        return extract_scene_keyframes(video_path, max_frames=max_frames, temporal=temporal)
 
-def extract_keyframes(video_path, frame_interval=30, max_frames=15):
-    """Extracts one frame every N frames and saves them temporarily."""
     vidcap = cv2.VideoCapture(video_path)
-    count, saved, frames = 0, 0, []
-    while vidcap.isOpened() and saved < max_frames:
-        success, frame = vidcap.read()
-        if not success:
+    count, frames = 0, []
+    while vidcap.isOpened() and len(frames) < max_frames:
+        if not vidcap.grab():
             break
-        if count % frame_interval == 0:
-            frame_path = f"temp_frame_{saved}.jpg"
-            cv2.imwrite(frame_path, frame)
-            frames.append(frame_path)
-            saved += 1
+        keep = count % frame_interval == 0
+        feed = temporal is not None and temporal.wants(count)
+        if keep or feed:
+            success, frame = vidcap.retrieve()
+            if not success:
+                break
+            if feed:
+                temporal.update(frame, count)
+            if keep:
+                frames.append(_to_pil(frame, count))
         count += 1
     vidcap.release()
     return frames
 
 
-def gemini_reason_about_frame(frame_path):
+def extract_scene_keyframes(video_path, max_frames=15, probe_interval=None, min_gap=None, temporal=None):
+    """Pick the max_frames strongest shot changes across the whole video.
+
+    Every probe_interval-th frame is decoded and its colour histogram compared
+    with the previous probe. Changes closer than min_gap frames are merged into
+    the strongest one, and a bounded heap keeps only the top max_frames
+    candidates, so memory does not grow with video length. The first frame is
+    always kept.
     """
-    Use Gemini to provide both a numeric probability (0–1) and reasoning text
-    for a single image frame.
+    probe_interval = probe_interval or SCENE_PROBE_INTERVAL
+    min_gap = min_gap or SCENE_MIN_GAP
+    vidcap = cv2.VideoCapture(video_path)
+    heap = []  # (distance, index, frame) min-heap of the strongest changes
+    pending = None
+    prev_hist = None
+    count = 0
+
+    def push(candidate):
+        if len(heap) < max_frames:
+            heapq.heappush(heap, candidate)
+        elif candidate[0] > heap[0][0]:
+            heapq.heapreplace(heap, candidate)
+
+    while vidcap.isOpened():
+        if not vidcap.grab():
+            break
+        probe = count % probe_interval == 0
+        feed = temporal is not None and temporal.wants(count)
+        if probe or feed:
+            success, frame = vidcap.retrieve()
+            if not success:
+                break
+            if feed:
+                temporal.update(frame, count)
+        if probe:
+            hist = _frame_histogram(frame)
+            if prev_hist is None:
+                distance = float("inf")
+            else:
+                distance = cv2.compareHist(prev_hist, hist, cv2.HISTCMP_BHATTACHARYYA)
+            prev_hist = hist
+            if pending is not None and count - pending[1] < min_gap:
+                if distance > pending[0]:
+                    pending = (distance, count, frame)
+            else:
+                if pending is not None:
+                    push(pending)
+                pending = (distance, count, frame)
+        count += 1
+    if pending is not None:
+        push(pending)
+    vidcap.release()
+
+    return [_to_pil(frame, index) for _, index, frame in sorted(heap, key=lambda c: c[1])]
+
+
+def frame_count(video_path):
+    """Frame count from the container header; 0 when the stream does not report it."""
+    vidcap = cv2.VideoCapture(video_path)
+    count = int(vidcap.get(cv2.CAP_PROP_FRAME_COUNT) or 0)
+    vidcap.release()
+    return max(0, count)
+
+
+def extract_candidate_frames(video_path, max_frames=None, mode=None, temporal=None):
+    """Up to max_frames keyframes covering the whole video, for adaptive sampling."""
+    max_frames = max_frames or ADAPTIVE_MAX_FRAMES
+    total = frame_count(video_path)
+    interval = max(1, total // max_frames) if total else 30
+    return extract_keyframes(video_path, frame_interval=interval, max_frames=max_frames, mode=mode,
+                             temporal=temporal)
+
+
+def spread_order(n):
+    """Indexes 0..n-1 in bit-reversed order, so every prefix is spread evenly over the range."""
+    bits = max(1, (n - 1).bit_length())
+    order = []
+    for k in range(1 << bits):
+        r = int(format(k, f"0{bits}b")[::-1], 2)
+        if r < n:
+            order.append(r)
+    return order
+
+
+def verdict_interval(scores, population, z=None):
+    """(mean, low, high) confidence interval for the mean frame score.
+
+    Frames are drawn without replacement from `population` candidates, so the
+    finite-population correction shrinks the interval to zero once all of
+    them have been scored.
     """
-    try:
-        image = Image.open(frame_path)
-        prompt = (
-            "Examine this image and do two things:\n"
-            "1. Give a number between 0 and 1 representing how likely it is "
-            "that this image is AI-generated or a deepfake (0 = clearly real, 1 = clearly AI).\n"
-            "2. Briefly explain your reasoning in one or two sentences."
-        )
-        resp = genai_client.models.generate_content(
-            model="gemini-2.5-flash",
-            contents=[prompt, image],
-        )
-        text = resp.text.strip()
+    z = ADAPTIVE_Z if z is None else z
+    n = len(scores)
+    mean = float(np.mean(scores))
+    if n < 2:
+        return mean, 0.0, 1.0
+    std = max(float(np.std(scores, ddof=1)), ADAPTIVE_MIN_STD)
+    if n - 1 <= len(_T975):
+        z *= _T975[n - 2] / 1.96
+    fpc = math.sqrt(max(0.0, (population - n) / (population - 1))) if population > 1 else 0.0
+    half = z * std / math.sqrt(n) * fpc
+    return mean, max(0.0, mean - half), min(1.0, mean + half)
+
+
+def verdict_settled(scores, population, threshold=0.5):
+    """True once the confidence interval lies entirely on one side of threshold."""
+    if len(scores) < min(ADAPTIVE_MIN_FRAMES, population):
+        return False
+    _, low, high = verdict_interval(scores, population)
+    return low > threshold or high <= threshold
 
-        # Parse out the numeric value if possible
-        score = 0.5
-        for token in text.split():
+
+class FramePipeline:
+    """Stream a video's frames through decode, preprocessing and scoring stages at once.
+
+    A decoder thread feeds the TemporalAnalyzer and queues every
+    frame_interval-th frame, downscaled and hashed, in a queue of at most
+    VIDEO_QUEUE_DEPTH frames. A preprocessing thread groups them into
+    CLIP_BATCH_SIZE batches, drops near-duplicates of frames already seen and
+    builds the CLIP input tensors. The consumer of batches() runs CLIP on each
+    batch as it arrives and sends the cascade's escalations to Gemini without
+    waiting, keeping up to VIDEO_INFLIGHT_BATCHES batches in flight. Every
+    stage blocks while the next one is full, so memory is bounded by the queue
+    depths rather than the length of the video.
+    """
+
+    def __init__(self, video_path, frame_interval=None, max_frames=None, temporal=None, cancel_event=None):
+        self.video_path = video_path
+        self.frame_interval = frame_interval or VIDEO_STREAM_INTERVAL
+        self.max_frames = VIDEO_STREAM_MAX_FRAMES if max_frames is None else max_frames
+        self.temporal = temporal
+        self.cancel_event = cancel_event
+        self.band = cascade.band_for("image")
+        self.decoded = threading.Event()
+        self.frames_decoded = 0
+        total = frame_count(video_path)
+        self._estimate = -(-total // self.frame_interval) if total else None
+        if self._estimate and self.max_frames:
+            self._estimate = min(self._estimate, self.max_frames)
+        self._frames = queue.Queue(maxsize=VIDEO_QUEUE_DEPTH)
+        self._batches = queue.Queue(maxsize=VIDEO_PREPROCESS_DEPTH)
+        self._stop = threading.Event()
+        self._errors = []
+
+    def expected_frames(self):
+        """Frames to be scored: exact once decoding is done, else estimated from the header (or None)."""
+        return self.frames_decoded if self.decoded.is_set() else self._estimate
+
+    def _put(self, q, item):
+        """Blocking put that gives up (returns False) once the pipeline is stopping."""
+        while not self._stop.is_set():
             try:
-                val = float(token)
-                if 0 <= val <= 1:
-                    score = val
-                    break
-            except ValueError:
+                q.put(item, timeout=_PIPELINE_POLL_SECONDS)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _get(self, q):
+        while not self._stop.is_set():
+            try:
+                return q.get(timeout=_PIPELINE_POLL_SECONDS)
+            except queue.Empty:
                 continue
+        return _PIPELINE_DONE
+
+    def _decode(self):
+        vidcap = cv2.VideoCapture(self.video_path)
+        count = 0
+        try:
+            with span("video.decode"):
+                while vidcap.isOpened() and not self._stop.is_set():
+                    if self.max_frames and self.frames_decoded >= self.max_frames:
+                        break
+                    if not vidcap.grab():
+                        break
+                    keep = count % self.frame_interval == 0
+                    feed = self.temporal is not None and self.temporal.wants(count)
+                    if keep or feed:
+                        success, frame = vidcap.retrieve()
+                        if not success:
+                            break
+                        if feed:
+                            self.temporal.update(frame, count)
+                        if keep:
+                            if not self._put(self._frames, load_image(_to_pil(frame, count))):
+                                break
+                            self.frames_decoded += 1
+                    count += 1
+        except Exception as e:
+            self._errors.append(e)
+        finally:
+            vidcap.release()
+            self.decoded.set()
+            self._put(self._frames, _PIPELINE_DONE)
 
-        return score, text
-    except Exception as e:
-        print(f"[!] Gemini reasoning error: {e}")
+    def _preprocess(self):
+        batch = []
+        try:
+            while True:
+                item = self._get(self._frames)
+                if item is not _PIPELINE_DONE:
+                    batch.append(item)
+                if batch and (item is _PIPELINE_DONE or len(batch) >= CLIP_BATCH_SIZE):
+                    results, fresh = reuse_near_duplicates(batch)
+                    pixels = None
+                    if fresh:
+                        with span("video.preprocess"):
+                            pixels = clip_pixel_values([batch[i] for i in fresh])
+                    if not self._put(self._batches, (batch, results, fresh, pixels)):
+                        break
+                    batch = []
+                if item is _PIPELINE_DONE:
+                    break
+        except Exception as e:
+            self._errors.append(e)
+        finally:
+            self._put(self._batches, _PIPELINE_DONE)
+
+    def _infer(self, frames, results, fresh, pixels):
+        """Run CLIP on one batch and start its Gemini requests; returns the pending batch."""
+        embeddings, probs, escalate = None, [], []
+        if pixels is not None:
+            with span("video.clip"):
+                embeddings = clip_embeddings_from_pixels(pixels)
+                probs = prompt_probs(embeddings)
+            escalate = cascade.split("image", [clip_local_score(p) for p in probs], self.band)
+        future = submit_gemini_images([frames[fresh[pos]] for pos in escalate])
+        return frames, results, fresh, embeddings, probs, escalate, future
+
+    def _finish(self, pending):
+        frames, results, fresh, embeddings, probs, escalate, future = pending
+        with span("video.gemini_wait"):
+            answers = future.result()
+        return frames, finish_image_batch(frames, results, fresh, probs, dict(zip(escalate, answers)),
+                                          self.band, embeddings)
+
+    def batches(self):
+        """Yield (frames, results) per batch in video order as each one is fully scored.
+
+        Raises AnalysisCancelled once cancel_event is set, and re-raises a
+        decoding or preprocessing error after the batches before it.
+        """
+        workers = [threading.Thread(target=self._decode, name="video-decode", daemon=True),
+                   threading.Thread(target=self._preprocess, name="video-preprocess", daemon=True)]
+        for worker in workers:
+            worker.start()
+        inflight = deque()
+        try:
+            while True:
+                _check_cancelled(self.cancel_event)
+                try:
+                    item = self._batches.get(timeout=_PIPELINE_POLL_SECONDS)
+                except queue.Empty:
+                    # CLIP is idle: hand back batches whose Gemini answers are in.
+                    while inflight and inflight[0][-1].done():
+                        yield self._finish(inflight.popleft())
+                    continue
+                if item is _PIPELINE_DONE:
+                    break
+                inflight.append(self._infer(*item))
+                while inflight and (len(inflight) > VIDEO_INFLIGHT_BATCHES or inflight[0][-1].done()):
+                    yield self._finish(inflight.popleft())
+            while inflight:
+                _check_cancelled(self.cancel_event)
+                yield self._finish(inflight.popleft())
+            if self._errors:
+                raise self._errors[0]
+        finally:
+            self._stop.set()
+            for pending in inflight:
+                pending[-1].cancel()
+            for worker in workers:
+                worker.join()
+
+
+def score_frames_as_answered(frames, cancel_event=None):
+    """Score frames with one CLIP pass and every Gemini request in flight at once.
+
+    Yields lists of (index, result) as results become final: first the frames
+    decided without Gemini, then each escalated frame (with its in-batch
+    near-duplicates) as its answer arrives. Raises AnalysisCancelled once
+    cancel_event is set; the remaining requests are cancelled.
+    """
+    band = cascade.band_for("image")
+    loaded = [load_image(frame) for frame in frames]
+    results, fresh = reuse_near_duplicates(loaded)
+    embeddings, probs, escalate = None, [], []
+    if fresh:
+        with span("video.clip"):
+            embeddings = clip_embeddings([loaded[i] for i in fresh])
+            probs = prompt_probs(embeddings)
+        escalate = cascade.split("image", [clip_local_score(p) for p in probs], band)
+    # One request per frame, so each answer can be published as soon as it arrives.
+    pending = {submit_gemini_images([loaded[fresh[pos]]]): pos for pos in escalate}
+    gemini_results = {}
+    published = set()
+
+    def newly_final():
+        resolve_batch_duplicates(results)
+        ready = [i for i, res in enumerate(results) if i not in published and isinstance(res, dict)]
+        published.update(ready)
+        return [(i, results[i]) for i in ready]
+
+    try:
+        waiting = set(escalate)
+        for pos, i in enumerate(fresh):
+            if pos not in waiting:
+                results[i] = score_fresh_image(probs[pos], gemini_results, pos, band)
+        yield newly_final()
+        while pending:
+            _check_cancelled(cancel_event)
+            with span("video.gemini_wait"):
+                done, _ = wait(pending, timeout=_PIPELINE_POLL_SECONDS, return_when=FIRST_COMPLETED)
+            for future in done:
+                pos = pending.pop(future)
+                gemini_results[pos] = future.result()[0]
+                results[fresh[pos]] = score_fresh_image(probs[pos], gemini_results, pos, band)
+            if done:
+                yield newly_final()
+    finally:
+        for future in pending:
+            future.cancel()
+    # Everything is scored; add the frames to the near-duplicate index and feature store.
+    finish_image_batch(loaded, results, fresh, probs, gemini_results, band, embeddings)
+
+
+def gemini_reason_about_frame(frame):
+    """
+    Use Gemini to provide both a numeric probability (0–1) and reasoning text
+    for a single image frame (a path or an in-memory PIL image).
+    """
+    res = assess([GEMINI_IMAGE_PROMPT, load_image(frame)], label="frame")
+    if res is None:
         return 0.5, "Reasoning unavailable due to API error."
+    return res
+
+
+def detect_ai_video(video_path, on_progress=None, cancel_event=None, sampling=None):
+    """Run AI-generated likelihood detection on a video by sampling frames.
+
+    sampling ("fixed", "adaptive" or "stream", default VIDEO_SAMPLING) picks
+    between scoring every extracted keyframe, sequential sampling with early
+    stop, and streaming every VIDEO_STREAM_INTERVAL-th frame of the whole
+    video through FramePipeline. Callers caching the result key it with
+    cache.video_version(sampling).
+
+    If given, on_progress(event, data) is called with a "frame" event per
+    scored frame (its frame_details entry) and a "progress" event with the
+    running average after each step. Setting cancel_event (a threading.Event)
+    stops the analysis between steps with AnalysisCancelled.
+    """
+    with span("video.total"):
+        return _analyze_video(video_path, on_progress, cancel_event, sampling or VIDEO_SAMPLING)
+
+
+def _check_cancelled(cancel_event):
+    if cancel_event is not None and cancel_event.is_set():
+        raise AnalysisCancelled("Video analysis cancelled")
 
 
-def detect_ai_video(video_path):
-    """Run AI-generated likelihood detection on a video by sampling frames."""
+def _no_frames_result():
+    print("Could not extract frames from video.")
+    return {
+        'final_score': 0.0,
+        'avg': 0.0,
+        'gemini_frame': 0.0,
+        'reasoning': 'Could not extract frames from video.',
+        'is_ai': False,
+    }
+
+
+def _analyze_video(video_path, on_progress=None, cancel_event=None, sampling="fixed"):
     print("\n🎬 Analyzing video frames for deepfake / AI content...\n")
 
-    frames = extract_keyframes(video_path)
-    if not frames:
-        print("Could not extract frames from video.")
-        return {
-            'final_score': 0.0,
-            'avg': 0.0,
-            'gemini_frame': 0.0,
-            'reasoning': 'Could not extract frames from video.',
-            'is_ai': False,
-        }
+    adaptive = sampling == "adaptive"
+    stream = sampling == "stream"
+    temporal = TemporalAnalyzer() if TEMPORAL or TEMPORAL_WEIGHT > 0 else None
+    temporal_features, t_score, t_weight = None, None, 0.0
+
+    def finish_temporal():
+        nonlocal temporal_features, t_score, t_weight
+        temporal_features = temporal.features() if temporal is not None else None
+        t_score = temporal_score(temporal_features)
+        t_weight = TEMPORAL_WEIGHT if t_score is not None else 0.0
+        if t_score is not None:
+            print(f"Temporal consistency score: {t_score*100:.2f}% over {temporal_features['steps']} steps")
+            if on_progress:
+                # Available once decoding is done, before the frame scores: a local-only early verdict.
+                on_progress("temporal", {'score': t_score, 'features': temporal_features})
+
+    def combined(frame_avg):
+        return (1 - t_weight) * frame_avg + t_weight * (t_score or 0.0)
 
     # Collect per-frame numeric scores and any per-frame reasoning if available
     frame_scores = []
     frame_details = []
-    for i, frame in enumerate(frames):
-        print(f"Analyzing frame {i+1}/{len(frames)}...")
-        res = detect_ai_image(frame)
-        if isinstance(res, dict):
-            score = res.get('final_score', 0.0)
-            fr_reason = res.get('reasoning', '')
-            fr_gemini = res.get('gemini', None)
+    gemini_unavailable = []  # frames scored by CLIP alone because Gemini could not be reached
+
+    def record(chunk, frame_results, total, positions=None):
+        """positions are the frames' indexes in the sample when they arrive out of order."""
+        for n, (frame, res) in enumerate(zip(chunk, frame_results)):
+            i = positions[n] if positions is not None else len(frame_scores)
+            if isinstance(res, dict):
+                score = res.get('final_score', 0.0)
+                fr_reason = res.get('reasoning', '')
+                fr_gemini = res.get('gemini', None)
+                if res.get('gemini_unavailable'):
+                    gemini_unavailable.append(i)
+            else:
+                score = res if res is not None else 0.0
+                fr_reason = ''
+                fr_gemini = None
+            frame_scores.append(float(score))
+            detail = {
+                'frame': frame.info.get('frame_index', i),
+                'score': float(score),
+                'reasoning': fr_reason,
+                'gemini': None if fr_gemini is None else float(fr_gemini),
+                'index': i,
+            }
+            frame_details.append(detail)
+            if on_progress:
+                on_progress("frame", detail)
+        if on_progress:
+            running_avg = float(np.mean(frame_scores))
+            on_progress("progress", {'done': len(frame_scores), 'total': total,
+                                     'running_avg': running_avg, 'running_score': combined(running_avg)})
+
+    if stream:
+        pipeline = FramePipeline(video_path, temporal=temporal, cancel_event=cancel_event)
+        print(f"Streaming every {pipeline.frame_interval}th frame "
+              f"(about {pipeline.expected_frames() or '?'} frames)...")
+        if on_progress:
+            on_progress("progress", {'done': 0, 'total': pipeline.expected_frames(),
+                                     'running_avg': None, 'running_score': None})
+        temporal_done = False
+        with span("video.frames"):
+            for chunk, frame_results in pipeline.batches():
+                if not temporal_done and pipeline.decoded.is_set():
+                    finish_temporal()
+                    temporal_done = True
+                record(chunk, frame_results, pipeline.expected_frames())
+        if not frame_scores:
+            return _no_frames_result()
+        if not temporal_done:
+            finish_temporal()
+    else:
+        with span("video.extract"):
+            if adaptive:
+                candidates = extract_candidate_frames(video_path, temporal=temporal)
+                frames = [candidates[i] for i in spread_order(len(candidates))]
+            else:
+                frames = extract_keyframes(video_path, temporal=temporal)
+        if not frames:
+            return _no_frames_result()
+        finish_temporal()
+
+        # Mean frame score at which the combined score crosses 0.5.
+        frame_threshold = (0.5 - t_weight * (t_score or 0.0)) / (1 - t_weight)
+
+        print(f"Analyzing {len(frames)} frames...")
+        if on_progress:
+            on_progress("progress", {'done': 0, 'total': len(frames), 'running_avg': None, 'running_score': None})
+        if adaptive:
+            for start in range(0, len(frames), ADAPTIVE_BATCH):
+                if verdict_settled(frame_scores, len(frames), frame_threshold):
+                    break
+                _check_cancelled(cancel_event)
+                chunk = frames[start:start + ADAPTIVE_BATCH]
+                with span("video.frames"):
+                    frame_results = detect_ai_images(chunk)
+                record(chunk, frame_results, len(frames))
         else:
-            score = res if res is not None else 0.0
-            fr_reason = ''
-            fr_gemini = None
-        frame_scores.append(score)
-        frame_details.append({
-            'frame': frame,
-            'score': score,
-            'reasoning': fr_reason,
-            'gemini': fr_gemini,
-            'index': i,
-        })
+            # All frames at once; each frame is reported when its Gemini answer arrives.
+            with span("video.frames"):
+                for ready in score_frames_as_answered(frames, cancel_event):
+                    if ready:
+                        positions, frame_results = zip(*ready)
+                        record([frames[i] for i in positions], frame_results, len(frames), positions)
+            frame_details.sort(key=lambda d: d['index'])
+    _check_cancelled(cancel_event)
+    video_frames_scored.observe(len(frame_scores), sampling=sampling)
 
     avg_score = float(np.mean(frame_scores)) if frame_scores else 0.0
+    final_score = combined(avg_score)
     print("\n--- VIDEO AI DETECTION SUMMARY ---")
-    print(f"Average AI-likelihood across {len(frames)} frames: {avg_score*100:.2f}%")
+    print(f"Average AI-likelihood across {len(frame_scores)} frames: {avg_score*100:.2f}%")
+    if t_score is not None:
+        print(f"Temporal consistency            : {t_score*100:.2f}% (weight {t_weight*100:.0f}%)")
+        print(f"Final AI-likelihood             : {final_score*100:.2f}%")
+    if adaptive:
+        _, ci_low, ci_high = verdict_interval(frame_scores, len(frames))
+        print(f"Adaptive sampling: {len(frame_scores)} of {len(frames)} candidate frames, "
+              f"95% interval {ci_low*100:.1f}-{ci_high*100:.1f}%")
 
-    if avg_score > 0.5:
+    if final_score > 0.5:
         print("⚠️  Video likely AI-generated or deepfake.")
     else:
         print("✅  Video likely authentic.")
@@ -127,50 +630,60 @@ def detect_ai_video(video_path):
         f"Analyzed {total} frames. {high_count} frames ({(high_count/total*100) if total else 0:.1f}%) show strong AI indicators. "
         f"Average AI-likelihood across frames: {avg_score*100:.2f}%. Examples: " + "; ".join(examples)
     )
+    if t_score is not None:
+        fallback_reasoning += (
+            f". Temporal consistency (flicker {temporal_features['flicker']:.4f}, unexplained change "
+            f"{temporal_features['residual']:.4f} / ratio {temporal_features['residual_ratio']:.2f}, motion jerk {temporal_features['flow_jerk']:.2f}): "
+            f"{t_score*100:.2f}% (weight {t_weight*100:.0f}%). Combined score: {final_score*100:.2f}%."
+        )
 
     # Try to synthesize an overall explanation using Gemini, passing the per-frame summary (not images)
     reasoning = fallback_reasoning
-    try:
-        prompt_parts = [
-            "You are given per-frame AI-likelihood scores and short notes extracted from a video. \n",
-            f"Total frames: {total}. Average score: {avg_score*100:.2f}%.\n",
-            "Per-frame top examples:\n",
-        ]
-        for ex in examples:
-            prompt_parts.append(ex + "\n")
-        prompt_parts.append(
-            "\nWrite a concise (2-3 sentence) explanation of whether the video is likely AI-generated or a deepfake, using the frame evidence. Mention the most important signals."
-        )
+    prompt_parts = [
+        "You are given per-frame AI-likelihood scores and short notes extracted from a video. \n",
+        f"Total frames: {total}. Average score: {avg_score*100:.2f}%.\n",
+        (f"Temporal consistency score (flicker, motion-compensated residuals, flow jerk): {t_score*100:.2f}%.\n"
+         if t_score is not None else ""),
+        "Per-frame top examples:\n",
+    ]
+    for ex in examples:
+        prompt_parts.append(ex + "\n")
+    prompt_parts.append(
+        "\nWrite a concise (2-3 sentence) explanation of whether the video is likely AI-generated or a deepfake, using the frame evidence. Mention the most important signals."
+    )
 
-        resp = genai_client.models.generate_content(
-            model="gemini-2.5-flash",
-            contents=["".join(prompt_parts)],
-        )
-        gen_text = resp.text.strip()
-        if gen_text:
-            reasoning = gen_text + "\n\nComponent summary: " + fallback_reasoning
-    except Exception as e:
-        print(f"[!] Gemini video synthesis failed: {e}")
+    with span("video.synthesis"):
+        gen_text = generate_text("".join(prompt_parts))
+    if gen_text:
+        reasoning = gen_text + "\n\nComponent summary: " + fallback_reasoning
+    else:
+        print("[!] Gemini video synthesis failed; using frame summary.")
 
     result = {
-        'final_score': avg_score,
+        'final_score': final_score,
         'avg': avg_score,
         'gemini_frame': gemini_frame_mean,
+        'temporal': t_score,
         'reasoning': reasoning,
-        'is_ai': avg_score > 0.5,
+        'is_ai': final_score > 0.5,
         'frame_details': frame_details,
     }
-
-    # Clean up temporary frame files created during extraction
-    try:
-        import os
-        for f in frames:
-            try:
-                if os.path.exists(f):
-                    os.remove(f)
-            except Exception:
-                pass
-    except Exception:
-        pass
+    if temporal_features:
+        result['temporal_features'] = temporal_features
+    if gemini_unavailable:
+        result['gemini_unavailable'] = True
+    if adaptive:
+        result['sampling'] = {
+            'mode': 'adaptive',
+            'frames_scored': len(frame_scores),
+            'frames_available': len(frames),
+            'interval': [ci_low, ci_high],
+        }
+    elif stream:
+        result['sampling'] = {
+            'mode': 'stream',
+            'frame_interval': pipeline.frame_interval,
+            'frames_scored': len(frame_scores),
+        }
 
     return result